@@ -5,8 +5,10 @@ import fs from "fs/promises";
 import { isObject } from "./obj-manip";
 import { mozart } from "./mozart";
 import {
-    deploy,
+    deployMany,
     DeployOptions,
+    FanOutOptions,
+    hostLabel,
     parseCommands,
     parseSshUrl,
     SshOptions,
@@ -46,15 +48,41 @@ function getEnv(): Record<string, Record<string, string>> {
 }
 
 /**
- * Reads and validates the input(s) regarding the SSH connection
+ * Reads and validates the input(s) regarding the SSH connections, one per
+ * line of the URL input
  */
-function getSshConfig(): SshOptions {
-    return parseSshUrl(
-        core.getInput("ssh_url"),
-        core.getInput("ssh_private_key")
+function getSshConfigs(): SshOptions[] {
+    const urls = core
+        .getInput("ssh_url")
+        .split("\n")
+        .map((url) => url.trim())
+        .filter((url) => url);
+
+    if (!urls.length) {
+        throw new Error("At least one SSH URL is required");
+    }
+
+    return urls.map((url) =>
+        parseSshUrl(url, core.getInput("ssh_private_key"))
     );
 }
 
+/**
+ * Reads and validates the inputs regarding the deployment to several hosts
+ */
+function getFanOut(): FanOutOptions {
+    const parallel = parseInt(core.getInput("parallel") || "4", 10);
+
+    if (!(parallel >= 1)) {
+        throw new Error("Parallel should be a number above 0");
+    }
+
+    return {
+        parallel,
+        canary: core.getBooleanInput("canary"),
+    };
+}
+
 /** Guess the project name from inputs or context */
 function getProjectName(): string {
     return core.getInput("project_name") || github.context.repo.repo;
@@ -71,6 +99,7 @@ function getDeploy(composeFile: string, projectName: string): DeployOptions {
         projectName,
         after: parseCommands(core.getInput("after")),
         before: parseCommands(core.getInput("before")),
+        compress: core.getBooleanInput("compress"),
     };
 }
 
@@ -88,22 +117,29 @@ export async function main(): Promise<void> {
         });
 
         const deployConfig = getDeploy(compose, projectName);
-        const options = {
-            ssh: getSshConfig(),
+        const hosts = getSshConfigs().map((ssh) => ({
+            ssh,
             command: core.getInput("master_builder_command"),
-        };
+        }));
 
-        const outcome = await deploy(
-            options,
+        const outcomes = await deployMany(
+            hosts,
             deployConfig,
+            getFanOut(),
             (message: string) => {
                 core.info(message);
             }
         );
 
-        if (!outcome.success) {
+        const failed = hosts
+            .map((host) => hostLabel(host))
+            .filter(
+                (label) => !(label in outcomes && outcomes[label].success)
+            );
+
+        if (failed.length) {
             // noinspection ExceptionCaughtLocallyJS
-            throw new Error(`Master Builder failed`);
+            throw new Error(`Master Builder failed on: ${failed.join(", ")}`);
         }
     } catch (e) {
         if (e instanceof Error) {
@@ -1,4 +1,5 @@
 import { Client } from "ssh2";
+import { gzipSync } from "zlib";
 
 /**
  * Options for Master Builder to know what to do
@@ -50,6 +51,10 @@ export interface Command {
     service: string;
     /** The command to run */
     command: string;
+    /** Commands of the same group run at the same time */
+    group?: string;
+    /** Run the command in the running container instead of a new one */
+    exec?: boolean;
 }
 
 /**
@@ -64,6 +69,18 @@ export interface DeployOptions {
     after: Command[];
     /** The content of the compose file */
     composeFile: string;
+    /** Send the compose file compressed with gzip */
+    compress?: boolean;
+}
+
+/**
+ * How to deploy to several hosts
+ */
+export interface FanOutOptions {
+    /** Maximum number of hosts deploying at the same time */
+    parallel: number;
+    /** Deploy to the first host alone, and to the others only if it worked */
+    canary: boolean;
 }
 
 /**
@@ -136,7 +153,7 @@ export function parseSshUrl(url: string, privateKey?: string): SshOptions {
 
 /**
  * Parses a list of commands into an array of objects (for the before/after
- * feature).
+ * feature). Each line is in the `[group/]service[@exec]:command` format.
  */
 export function parseCommands(commands: string): Command[] {
     if (!commands.trim()) {
@@ -144,23 +161,42 @@ export function parseCommands(commands: string): Command[] {
     }
 
     return commands.split("\n").map((fullCommand) => {
-        const re = /([^:]+):(.+)/;
+        const re = /^(?:([\w.-]+)\/)?([\w.-]+)(?:@(run|exec))?:(.+)$/s;
         const match = fullCommand.trim().match(re);
 
         if (!match) {
             throw new Error("Invalid command format");
         }
 
-        const [, service, command] = match;
+        const [, group, service, mode, command] = match;
 
         if (!service || !command) {
             throw new Error("Invalid command format");
         }
 
-        return { service, command };
+        return {
+            service,
+            command,
+            ...(group ? { group } : {}),
+            ...(mode === "exec" ? { exec: true } : {}),
+        };
     });
 }
 
+/**
+ * Formats a command back into the format expected by Master Builder's
+ * `--before` and `--after` options, quoted for the shell.
+ *
+ * @param command The command to format
+ * @returns The quoted argument
+ */
+export function formatCommand(command: Command): string {
+    const group = command.group ? `${command.group}/` : "";
+    const mode = command.exec ? "@exec" : "";
+
+    return `${shQuote(group + command.service + mode)}:${shQuote(command.command)}`;
+}
+
 /**
  * Does the deployment through SSH using Master Builder.
  */
@@ -176,14 +212,14 @@ export function deploy(
             let cmd = `${host.command} deploy ${deploy.projectName}`;
 
             for (const before of deploy.before) {
-                cmd += ` --before ${shQuote(before.service)}:${shQuote(before.command)}`;
+                cmd += ` --before ${formatCommand(before)}`;
             }
 
             for (const after of deploy.after) {
-                cmd += ` --after ${shQuote(after.service)}:${shQuote(after.command)}`;
+                cmd += ` --after ${formatCommand(after)}`;
             }
 
-            reporter(`Running: ${cmd}`);
+            reporter(`Running: ${cmd}\n`);
 
             conn.exec(cmd, (err, stream) => {
                 if (err) {
@@ -191,7 +227,11 @@ export function deploy(
                     return;
                 }
 
-                stream.stdin.write(deploy.composeFile, () => {
+                const payload = deploy.compress
+                    ? gzipSync(deploy.composeFile)
+                    : deploy.composeFile;
+
+                stream.stdin.write(payload, () => {
                     stream.stdin.end();
                 });
 
@@ -228,3 +268,126 @@ export function deploy(
             });
     });
 }
+
+/**
+ * A name for the target, to prefix its output with. It identifies the target
+ * fully, since the same host can be reached as several users.
+ *
+ * @param host The target
+ * @returns Its name
+ */
+export function hostLabel(host: MasterBuilderOptions): string {
+    const port = host.ssh.port === 22 ? "" : `:${host.ssh.port}`;
+    return `${host.ssh.user}@${host.ssh.host}${port}`;
+}
+
+/**
+ * Wraps a reporter so that it receives whole lines, each one prefixed. The
+ * output of a host comes in chunks which don't necessarily end with a line.
+ *
+ * @param prefix What to put in front of each line
+ * @param reporter The reporter to wrap
+ * @returns The wrapped reporter and a function flushing the last line
+ */
+export function prefixLines(
+    prefix: string,
+    reporter: reporter
+): [reporter, () => void] {
+    let pending = "";
+
+    const report = (message: string) => {
+        const lines = (pending + message).split("\n");
+        pending = lines.pop() || "";
+
+        for (const line of lines) {
+            reporter(`${prefix} ${line}`);
+        }
+    };
+
+    const flush = () => {
+        if (pending) {
+            reporter(`${prefix} ${pending}`);
+            pending = "";
+        }
+    };
+
+    return [report, flush];
+}
+
+/**
+ * Runs a function on items, with at most `limit` calls running at once
+ */
+async function runPool<T>(
+    items: T[],
+    limit: number,
+    fn: (item: T) => Promise<void>
+): Promise<void> {
+    let next = 0;
+
+    const workers = Array.from(
+        { length: Math.max(1, Math.min(limit, items.length)) },
+        async () => {
+            while (next < items.length) {
+                await fn(items[next++]);
+            }
+        }
+    );
+
+    await Promise.all(workers);
+}
+
+/**
+ * Deploys to several hosts at the same time, each line of output being
+ * prefixed by its host. A host which can't be reached counts as a failure.
+ *
+ * @param hosts The hosts to deploy to
+ * @param deployOptions The deployment, the same on every host
+ * @param fanOut How many hosts at once and in which order
+ * @param reporter Receives the output of all the hosts
+ * @returns The outcome of the deployment of each host, by label
+ */
+export async function deployMany(
+    hosts: MasterBuilderOptions[],
+    deployOptions: DeployOptions,
+    fanOut: FanOutOptions,
+    reporter: reporter
+): Promise<Record<string, DeployOutput>> {
+    const outcomes: Record<string, DeployOutput> = {};
+
+    const labels = hosts.map((host) => hostLabel(host));
+    hosts = hosts.filter((host, i) => labels.indexOf(labels[i]) === i);
+
+    const width = Math.max(...hosts.map((h) => hostLabel(h).length));
+
+    const deployTo = async (host: MasterBuilderOptions) => {
+        const label = hostLabel(host);
+        const [report, flush]: [reporter, () => void] =
+            hosts.length > 1
+                ? prefixLines(`${label.padEnd(width)} |`, reporter)
+                : [reporter, () => undefined];
+
+        try {
+            outcomes[label] = await deploy(host, deployOptions, report);
+        } catch (e) {
+            report(`Could not deploy: ${e instanceof Error ? e.message : e}\n`);
+            outcomes[label] = { success: false };
+        }
+
+        flush();
+    };
+
+    let rest = hosts;
+
+    if (fanOut.canary && hosts.length > 1) {
+        await deployTo(hosts[0]);
+        rest = hosts.slice(1);
+
+        if (!outcomes[hostLabel(hosts[0])].success) {
+            reporter(`Canary host ${hostLabel(hosts[0])} failed, stopping there`);
+            return outcomes;
+        }
+    }
+
+    await runPool(rest, fanOut.parallel, deployTo);
+    return outcomes;
+}
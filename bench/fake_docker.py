@@ -0,0 +1,69 @@
+"""
+Stands in for the `docker` CLI during the benchmarks. All the behavior lives
+in the fake engine (see `fake_engine.py`), this only tells it about the call,
+waits for as long as the profile says and prints what it's told to.
+
+It only uses the standard library and runs with `python -S`, so that its own
+startup stays small next to the simulated latencies.
+"""
+
+import http.client
+import json
+import os
+import socket
+import sys
+import time
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+class _Connection(http.client.HTTPConnection):
+    def __init__(self, path: str):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def _process_start() -> float:
+    """
+    When this process was started (with a precision of a clock tick), so that
+    the interpreter startup counts as time spent in `docker`.
+    """
+
+    try:
+        with open("/proc/self/stat") as f:
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+    return time.time() - max(0.0, uptime - ticks / CLOCK_TICKS)
+
+
+def _post(path: str, data: dict) -> dict:
+    conn = _Connection(os.environ["DOCKER_HOST"].removeprefix("unix://"))
+    conn.request("POST", path, json.dumps(data), {"Content-Type": "application/json"})
+    return json.loads(conn.getresponse().read())
+
+
+def main() -> None:
+    start = min(_process_start(), time.time())
+    argv = sys.argv[1:]
+    plan = _post(
+        "/_bench/cli/start", {"argv": argv, "cwd": os.getcwd(), "start": start}
+    )
+    time.sleep(plan["delay"])
+    result = _post("/_bench/cli/end", {"call": plan["call"], "exit": plan["exit"]})
+
+    sys.stdout.write(result.get("stdout", ""))
+    sys.stderr.write(plan["stderr"] + result.get("stderr", ""))
+    sys.exit(result["exit"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,519 @@
+"""
+A simulated Docker host for the benchmarks: an Engine API server listening on
+a unix socket, plus the behavior of the `docker` CLI (see `fake_docker.py`,
+which forwards each call here so that both share the same state).
+
+Only what Master Builder uses is implemented. Containers never run anything,
+they simply go through the states described by the profile of the benchmark.
+"""
+
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlparse
+
+import yaml
+
+PROJECT_LABEL = "com.docker.compose.project"
+SERVICE_LABEL = "com.docker.compose.service"
+
+
+@dataclass
+class Profile:
+    """
+    How the simulated host behaves.
+
+    Parameters
+    ----------
+    latency
+        Duration of CLI calls, in seconds, by subcommand ("pull",
+        "compose up", "compose down", "network create", etc). Calls which are
+        not listed take `default_latency`.
+    default_latency
+        Duration of the CLI calls not listed in `latency`
+    api_latency
+        Added to every Engine API call
+    failures
+        Probability of failure of CLI calls, by subcommand
+    health
+        Sequence of (health status, duration) that containers with a health
+        check go through once started. The last status stays forever.
+    seed
+        Seed of the failure randomness, so that runs are reproducible
+    """
+
+    latency: dict[str, float] = field(default_factory=dict)
+    default_latency: float = 0.05
+    api_latency: float = 0.0
+    failures: dict[str, float] = field(default_factory=dict)
+    health: list[tuple[str, float]] = field(default_factory=lambda: [("healthy", 0)])
+    seed: int = 42
+
+
+@dataclass
+class CliCall:
+    """A call to the fake `docker` CLI, as recorded by the engine"""
+
+    argv: list[str]
+    cwd: str
+    start: float
+    end: float = 0.0
+    exit_code: int = 0
+
+
+def _project_name(directory: Path, document: dict) -> str:
+    name = str(document.get("name") or directory.name).lower()
+    return re.sub(r"[^a-z0-9_-]", "", name)
+
+
+def _labels(service: dict) -> dict[str, str]:
+    labels = service.get("labels") or {}
+
+    if isinstance(labels, list):
+        return dict(str(x).partition("=")[::2] for x in labels)
+
+    return {str(k): str(v) for k, v in labels.items()}
+
+
+def _cli_subcommand(argv: list[str]) -> str:
+    """
+    Turns `compose --ansi never up -d` into "compose up", `pull x` into "pull"
+    """
+
+    words = [a for a in argv if not a.startswith("-")]
+
+    if words[:1] in (["compose"], ["network"], ["image"]):
+        return " ".join(words[:2])
+
+    return words[0] if words else ""
+
+
+class FakeEngine:
+    """
+    State of the simulated host: images (local and in the registry),
+    networks, containers and the events that happened to them.
+
+    Parameters
+    ----------
+    socket_path
+        Where the Engine API listens
+    profile
+        How the host behaves
+    root_dir
+        Reported as the Docker data directory
+    """
+
+    def __init__(self, socket_path: Path, profile: Profile, root_dir: Path):
+        self.socket_path = socket_path
+        self.profile = profile
+        self.root_dir = root_dir
+        self.random = random.Random(profile.seed)  # noqa: S311
+        self.lock = threading.Condition()
+        self.remote: dict[str, str] = {}
+        self.local: dict[str, str] = {}
+        self.networks: set[str] = set()
+        self.containers: dict[str, dict] = {}
+        self.events: list[dict] = []
+        self.calls: list[CliCall] = []
+        self.server: socketserver.UnixStreamServer | None = None
+
+    # --- Simulation ---
+
+    def publish(self, image: str, version: str) -> None:
+        """
+        Pushes a new version of an image to the (fake) registry.
+
+        Parameters
+        ----------
+        image
+            Reference of the image
+        version
+            Anything that identifies the version
+        """
+
+        with self.lock:
+            self.remote[image] = (
+                "sha256:" + sha256(f"{image}{version}".encode()).hexdigest()
+            )
+
+    def _event(self, container_id: str, action: str) -> None:
+        labels = (
+            self.containers.get(container_id, {}).get("Config", {}).get("Labels", {})
+        )
+        self.events.append(
+            {
+                "Type": "container",
+                "Action": action,
+                "id": container_id,
+                "Actor": {"ID": container_id, "Attributes": labels},
+                "timeNano": time.time_ns(),
+            }
+        )
+        self.lock.notify_all()
+
+    def _pull(self, image: str) -> str | None:
+        if image not in self.remote:
+            return f"pull access denied for {image}"
+
+        self.local[image] = self.remote[image]
+        return None
+
+    def _compose_up(self, cwd: Path, only: list[str]) -> None:
+        document = yaml.safe_load((cwd / "docker-compose.yml").read_text()) or {}
+        project = _project_name(cwd, document)
+
+        for name, service in (document.get("services") or {}).items():
+            if only and name not in only:
+                continue
+
+            service = service or {}
+            image = service.get("image", f"{project}-{name}")
+
+            if image not in self.local:
+                self._pull(image)
+
+            container_id = sha256(
+                f"{project}/{name}/{time.time_ns()}".encode()
+            ).hexdigest()
+            labels = {**_labels(service), PROJECT_LABEL: project, SERVICE_LABEL: name}
+            has_health = "healthcheck" in service
+            command = service.get("command") or []
+            self.containers[container_id] = {
+                "Id": container_id,
+                "Image": self.local.get(image, ""),
+                "Config": {"Image": image, "Labels": labels},
+                "Command": " ".join(command) if isinstance(command, list) else command,
+                "Mounts": [
+                    {"Destination": str(volume).split(":")[1]}
+                    for volume in service.get("volumes") or []
+                    if ":" in str(volume)
+                ],
+                "State": {
+                    "Status": "running",
+                    "Running": True,
+                    "Restarting": False,
+                    "ExitCode": 0,
+                    **({"Health": {"Status": "starting"}} if has_health else {}),
+                },
+            }
+            self._event(container_id, "create")
+            self._event(container_id, "start")
+
+            if has_health:
+                threading.Thread(
+                    target=self._go_through_health,
+                    args=(container_id,),
+                    daemon=True,
+                ).start()
+
+    def _go_through_health(self, container_id: str) -> None:
+        for status, duration in self.profile.health:
+            with self.lock:
+                if container_id not in self.containers:
+                    return
+
+                self.containers[container_id]["State"]["Health"]["Status"] = status
+                self._event(container_id, f"health_status: {status}")
+
+            time.sleep(duration)
+
+    def _compose_down(self, cwd: Path) -> None:
+        try:
+            document = yaml.safe_load((cwd / "docker-compose.yml").read_text()) or {}
+        except FileNotFoundError:
+            document = {}
+
+        project = _project_name(cwd, document)
+
+        for container_id, container in list(self.containers.items()):
+            if container["Config"]["Labels"].get(PROJECT_LABEL) == project:
+                self._event(container_id, "die")
+                self._event(container_id, "destroy")
+                del self.containers[container_id]
+
+    def _compose_toggle(self, cwd: Path, only: list[str], running: bool) -> None:
+        document = yaml.safe_load((cwd / "docker-compose.yml").read_text()) or {}
+        project = _project_name(cwd, document)
+
+        for container_id, container in self.containers.items():
+            labels = container["Config"]["Labels"]
+
+            if labels.get(PROJECT_LABEL) != project or (
+                only and labels.get(SERVICE_LABEL) not in only
+            ):
+                continue
+
+            container["State"]["Running"] = running
+            container["State"]["Status"] = "running" if running else "exited"
+            self._event(container_id, "start" if running else "die")
+
+    def cli_start(self, argv: list[str], cwd: str, start: float) -> dict:
+        """
+        Called by the fake CLI when it starts, returns what it must do: how
+        long to wait, what to print and its exit code. The effects of the
+        call happen once it's done (see `cli_end()`).
+        """
+
+        subcommand = _cli_subcommand(argv)
+        delay = self.profile.latency.get(subcommand, self.profile.default_latency)
+
+        with self.lock:
+            self.calls.append(CliCall(argv=argv, cwd=cwd, start=start))
+            index = len(self.calls) - 1
+            failed = self.random.random() < self.profile.failures.get(subcommand, 0)
+
+        return {
+            "call": index,
+            "delay": delay,
+            "exit": 1 if failed else 0,
+            "stderr": f"simulated failure of docker {subcommand}\n" if failed else "",
+        }
+
+    def cli_end(self, call_index: int, exit_code: int) -> dict:
+        """
+        Called by the fake CLI once it waited, applies the effects of the
+        call and returns the final output and exit code.
+        """
+
+        with self.lock:
+            call = self.calls[call_index]
+            call.end = time.time()
+            call.exit_code = exit_code
+
+            if exit_code:
+                return {"exit": exit_code, "stdout": ""}
+
+            return self._apply(call)
+
+    def _apply(self, call: CliCall) -> dict:
+        subcommand = _cli_subcommand(call.argv)
+        args = [a for a in call.argv if not a.startswith("-")]
+        cwd = Path(call.cwd)
+
+        if subcommand == "pull":
+            if error := self._pull(args[-1]):
+                call.exit_code = 1
+                return {"exit": 1, "stdout": "", "stderr": error + "\n"}
+
+            return {"exit": 0, "stdout": f"{args[-1]}\n"}
+        elif subcommand == "tag":
+            self.local[args[-1]] = self.local[args[-2]]
+        elif subcommand == "network create":
+            self.networks.add(args[-1])
+        elif subcommand == "compose up":
+            self._compose_up(cwd, args[2:])
+        elif subcommand in ("compose stop", "compose start"):
+            self._compose_toggle(cwd, args[2:], subcommand == "compose start")
+        elif subcommand == "compose down":
+            self._compose_down(cwd)
+
+        return {"exit": 0, "stdout": ""}
+
+    # --- Engine API ---
+
+    def _match(self, container: dict, filters: dict[str, list[str]]) -> bool:
+        labels = container["Config"]["Labels"]
+
+        for label in filters.get("label", []):
+            key, sep, value = label.partition("=")
+
+            if key not in labels or (sep and labels[key] != value):
+                return False
+
+        status = filters.get("status")
+        return not status or container["State"]["Status"] in status
+
+    def list_containers(self, filters: dict[str, list[str]]) -> list[dict]:
+        with self.lock:
+            return [
+                {
+                    "Id": c["Id"],
+                    "Image": c["Config"]["Image"],
+                    "ImageID": c["Image"],
+                    "Labels": c["Config"]["Labels"],
+                    "State": c["State"]["Status"],
+                    "Command": c["Command"],
+                    "Mounts": c["Mounts"],
+                }
+                for c in self.containers.values()
+                if self._match(c, filters)
+            ]
+
+    def follow_events(
+        self,
+        filters: dict[str, list[str]],
+        since: float,
+        until: float,
+    ) -> Iterator[dict]:
+        sent = 0
+
+        while time.time() < until:
+            with self.lock:
+                matching = [
+                    e
+                    for e in self.events
+                    if e["timeNano"] / 1e9 >= since
+                    and self._match(
+                        {
+                            "Config": {"Labels": e["Actor"]["Attributes"]},
+                            "State": {"Status": ""},
+                        },
+                        {"label": filters.get("label", [])},
+                    )
+                ]
+                new = matching[sent:]
+
+                if not new:
+                    self.lock.wait(max(0.0, min(0.5, until - time.time())))
+                    continue
+
+            sent += len(new)
+            yield from new
+
+    def image(self, name: str) -> dict | None:
+        with self.lock:
+            if name not in self.local:
+                return None
+
+            digest = self.local[name]
+            repo = name.rsplit(":", 1)[0] if ":" in name.rsplit("/", 1)[-1] else name
+
+            return {
+                "Id": "sha256:" + sha256(digest.encode()).hexdigest(),
+                "RepoDigests": [f"{repo}@{digest}"],
+            }
+
+    # --- Server ---
+
+    def start(self) -> None:
+        """
+        Starts listening on the socket, in a background thread.
+        """
+
+        engine = self
+
+        class Handler(_Handler):
+            pass
+
+        Handler.engine = engine
+        self.socket_path.unlink(missing_ok=True)
+        self.server = _Server(str(self.socket_path), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    engine: FakeEngine
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, data, status: int = 200) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _filters(self, query: dict) -> dict[str, list[str]]:
+        return json.loads(query.get("filters", ["{}"])[0] or "{}")
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = unquote(url.path)
+        time.sleep(self.engine.profile.api_latency)
+
+        if path == "/version":
+            self._send({"Version": "fake", "ApiVersion": "1.41"})
+        elif path == "/info":
+            self._send({"DockerRootDir": str(self.engine.root_dir)})
+        elif path == "/system/df":
+            self._send({"LayersSize": 0, "Images": []})
+        elif path == "/networks":
+            names = self._filters(query).get("name", [])
+            found = [
+                {"Name": n}
+                for n in sorted(self.engine.networks)
+                if not names or any(x in n for x in names)
+            ]
+            self._send(found)
+        elif path == "/containers/json":
+            self._send(self.engine.list_containers(self._filters(query)))
+        elif path == "/events":
+            self._stream_events(query)
+        else:
+            self._inspect(path)
+
+    def _inspect(self, path: str) -> None:
+        if m := re.fullmatch(r"/containers/([^/]+)/json", path):
+            if container := self.engine.containers.get(m[1]):
+                self._send(container)
+            else:
+                self._send({"message": f"No such container: {m[1]}"}, 404)
+        elif m := re.fullmatch(r"/images/(.+)/json", path):
+            if image := self.engine.image(m[1]):
+                self._send(image)
+            else:
+                self._send({"message": f"No such image: {m[1]}"}, 404)
+        elif m := re.fullmatch(r"/distribution/(.+)/json", path):
+            if digest := self.engine.remote.get(m[1]):
+                self._send({"Descriptor": {"digest": digest}})
+            else:
+                self._send({"message": f"manifest unknown: {m[1]}"}, 404)
+        else:
+            self._send({"message": f"Not simulated: GET {path}"}, 404)
+
+    def _stream_events(self, query: dict) -> None:
+        since = float(query.get("since", ["0"])[0])
+        until = float(query.get("until", [str(time.time() + 3600)])[0])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        try:
+            for event in self.engine.follow_events(self._filters(query), since, until):
+                chunk = (json.dumps(event) + "\n").encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            pass
+
+    def do_POST(self) -> None:
+        path = urlparse(self.path).path
+        body = self._body()
+
+        if path == "/_bench/cli/start":
+            self._send(self.engine.cli_start(body["argv"], body["cwd"], body["start"]))
+        elif path == "/_bench/cli/end":
+            self._send(self.engine.cli_end(body["call"], body["exit"]))
+        else:
+            self._send({"message": f"Not simulated: POST {path}"}, 404)
+
+    def do_DELETE(self) -> None:
+        self._send([])
@@ -0,0 +1,407 @@
+"""
+End-to-end benchmarks of the command line against a simulated Docker host
+(see `fake_engine.py` and `fake_docker.py`), so that the performance of
+deployments can be measured without a real one.
+
+Each profile describes how the host behaves (slow pulls, slow shutdowns,
+flapping health checks, failures...) and goes through the same steps: start
+the ingress, deploy a project, deploy a new version of it, deploy the same
+version again, deploy two versions with a progressive traffic shift and
+draining (the first one only sets up the routing, the second one also drains
+the old version), use the compose passthrough, and check and update the ingress.
+
+For each step, this reports:
+
+- The wall time of the command
+- The number of `docker` CLI calls it made
+- The time spent in those calls (overlapping calls count once)
+- The overhead, which is the rest: our own startup, API calls, waiting for
+  health checks and so on. That's what the optimizations are about.
+
+Results are stored in `bench/results/<label>.json` (the label defaults to
+`git describe`) and compared with a previous run, to spot regressions
+between versions. Run it with `make bench`.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from fake_engine import CliCall, FakeEngine, Profile
+
+BENCH_DIR = Path(__file__).resolve().parent
+RESULTS_DIR = BENCH_DIR / "results"
+SRC_DIR = BENCH_DIR.parent / "src"
+
+PROJECT = "bench-app"
+WEB_IMAGE = "example/web:latest"
+WORKER_IMAGE = "example/worker:latest"
+
+COMPOSE_FILE = f"""
+services:
+    web:
+        image: {WEB_IMAGE}
+        restart: always
+        healthcheck:
+            test: ["CMD", "true"]
+        labels:
+            - "traefik.enable=true"
+            - "traefik.http.routers.web.rule=Host(`bench.example.com`)"
+    worker:
+        image: {WORKER_IMAGE}
+        restart: always
+"""
+
+BASE_LATENCY = {
+    "pull": 0.3,
+    "compose up": 0.5,
+    "compose down": 0.5,
+    "compose pull": 0.5,
+    "compose ps": 0.1,
+}
+
+PROFILES = {
+    "baseline": Profile(latency=BASE_LATENCY),
+    "slow-pulls": Profile(latency={**BASE_LATENCY, "pull": 3.0, "compose pull": 3.0}),
+    "slow-down": Profile(latency={**BASE_LATENCY, "compose down": 3.0}),
+    "flapping": Profile(
+        latency=BASE_LATENCY,
+        health=[
+            ("starting", 0.5),
+            ("unhealthy", 0.3),
+            ("starting", 0.3),
+            ("unhealthy", 0.3),
+            ("healthy", 0),
+        ],
+    ),
+    "slow-api": Profile(latency=BASE_LATENCY, api_latency=0.02),
+    "flaky-down": Profile(latency=BASE_LATENCY, failures={"compose down": 0.5}),
+}
+
+VERBOSE = False
+REGRESSION_RATIO = 1.2
+REGRESSION_MIN_MS = 25
+
+
+@dataclass
+class StepResult:
+    """Measures of one step of a profile"""
+
+    wall_ms: float
+    spawns: int
+    docker_ms: float
+    overhead_ms: float
+    exit_code: int
+
+
+@dataclass
+class Step:
+    """One command to run, with what to do to the host before"""
+
+    name: str
+    args: list[str]
+    stdin: str = ""
+    prepare: Callable[[FakeEngine], None] | None = None
+
+
+DEPLOY = ["deploy", PROJECT]
+SHIFT = ["deploy", "--shift", "10,50,100", "--shift-interval", "0.1"]
+
+STEPS = [
+    Step("ingress start", ["ingress", "start"]),
+    Step("deploy (first)", DEPLOY, COMPOSE_FILE),
+    Step(
+        "deploy (new version)",
+        DEPLOY,
+        COMPOSE_FILE,
+        lambda engine: engine.publish(WEB_IMAGE, "v2"),
+    ),
+    Step("deploy (no change)", DEPLOY, COMPOSE_FILE),
+    Step(
+        "deploy (routed)",
+        [*SHIFT, "--drain-timeout", "30", PROJECT],
+        COMPOSE_FILE,
+        lambda engine: engine.publish(WEB_IMAGE, "v3"),
+    ),
+    Step(
+        "deploy (traffic shift)",
+        [*SHIFT, "--drain-timeout", "30", PROJECT],
+        COMPOSE_FILE,
+        lambda engine: engine.publish(WEB_IMAGE, "v4"),
+    ),
+    Step("compose passthrough", ["compose", PROJECT, "ps"]),
+    Step("ingress status", ["ingress", "status"]),
+    Step("ingress update", ["ingress", "update"]),
+]
+
+
+def busy_time(calls: list[CliCall], start: float, end: float) -> float:
+    """
+    Total time during which at least one call was running, between two
+    instants.
+    """
+
+    intervals = sorted(
+        (max(c.start, start), min(c.end or end, end))
+        for c in calls
+        if c.start < end and (c.end or end) > start
+    )
+    total = 0.0
+    cursor = start
+
+    for a, b in intervals:
+        a = max(a, cursor)
+
+        if b > a:
+            total += b - a
+            cursor = b
+
+    return total
+
+
+def install_fake_docker(bin_dir: Path) -> None:
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    docker = bin_dir / "docker"
+    docker.write_text(
+        f"#!{sys.executable} -S\n"
+        f"import sys\n"
+        f"sys.path.insert(0, {str(BENCH_DIR)!r})\n"
+        f"from fake_docker import main\n"
+        f"main()\n"
+    )
+    docker.chmod(0o755)
+
+
+def run_profile(profile: Profile) -> dict[str, StepResult]:
+    """
+    Goes through all the steps on a fresh simulated host.
+    """
+
+    with tempfile.TemporaryDirectory(prefix="mb-bench-") as tmp:
+        root = Path(tmp)
+        home = root / "home"
+        home.mkdir()
+        (home / "config.yml").write_text("init_done: true\n")
+        install_fake_docker(root / "bin")
+
+        engine = FakeEngine(root / "docker.sock", profile, root)
+        engine.publish(WEB_IMAGE, "v1")
+        engine.publish(WORKER_IMAGE, "v1")
+        engine.start()
+
+        env = {
+            **os.environ,
+            "PATH": f"{root / 'bin'}{os.pathsep}{os.environ['PATH']}",
+            "PYTHONPATH": str(SRC_DIR),
+            "DOCKER_HOST": f"unix://{root / 'docker.sock'}",
+            "DOCKER_CONFIG": str(root / "docker-config"),
+            "MB_HOME": str(home),
+            "MB_NO_AGENT": "1",
+        }
+        results = {}
+
+        try:
+            for step in STEPS:
+                if step.prepare:
+                    step.prepare(engine)
+
+                results[step.name] = run_step(engine, step, env)
+        finally:
+            engine.stop()
+
+        return results
+
+
+def run_step(engine: FakeEngine, step: Step, env: dict[str, str]) -> StepResult:
+    calls_before = len(engine.calls)
+    start = time.time()
+    process = subprocess.run(
+        [sys.executable, "-m", "master_builder", *step.args],
+        input=step.stdin,
+        env=env,
+        capture_output=True,
+        encoding="utf-8",
+        check=False,
+    )
+    end = time.time()
+    calls = engine.calls[calls_before:]
+    docker = busy_time(calls, start, end)
+
+    if process.returncode:
+        sys.stderr.write(process.stdout[-2000:] + process.stderr[-2000:])
+
+    if VERBOSE:
+        for call in calls:
+            duration = ((call.end or end) - call.start) * 1000
+            print(f"    {step.name}: docker {' '.join(call.argv)} ({duration:.0f}ms)")
+
+    return StepResult(
+        wall_ms=(end - start) * 1000,
+        spawns=len(calls),
+        docker_ms=docker * 1000,
+        overhead_ms=(end - start - docker) * 1000,
+        exit_code=process.returncode,
+    )
+
+
+def merge_runs(runs: list[dict[str, StepResult]]) -> dict[str, StepResult]:
+    """
+    Merges several runs of a profile, keeping the median of each measure.
+    """
+
+    merged = {}
+
+    for name in runs[0]:
+        steps = [r[name] for r in runs]
+        merged[name] = StepResult(
+            wall_ms=statistics.median(s.wall_ms for s in steps),
+            spawns=max(s.spawns for s in steps),
+            docker_ms=statistics.median(s.docker_ms for s in steps),
+            overhead_ms=statistics.median(s.overhead_ms for s in steps),
+            exit_code=max(s.exit_code for s in steps),
+        )
+
+    return merged
+
+
+def default_label() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--tags", "--always", "--dirty"],
+            cwd=BENCH_DIR,
+            capture_output=True,
+            encoding="utf-8",
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_results(label: str) -> tuple[str, dict] | None:
+    """
+    Finds the most recent results of another version, to compare with.
+    """
+
+    files = sorted(
+        (f for f in RESULTS_DIR.glob("*.json") if f.stem != label),
+        key=lambda f: f.stat().st_mtime,
+    )
+
+    if not files:
+        return None
+
+    return files[-1].stem, json.loads(files[-1].read_text())
+
+
+def compare(old: dict | None, new: dict) -> list[str]:
+    """
+    Prints the results, next to the previous ones if any, and returns the
+    steps whose overhead regressed.
+    """
+
+    regressions = []
+
+    for profile, steps in new["profiles"].items():
+        print(f"\n{profile}")
+        print(
+            f"  {'step':24} {'wall':>9} {'spawns':>6} {'docker':>9} {'overhead':>9}"
+            f" {'before':>9}"
+        )
+
+        for name, result in steps.items():
+            before = (old or {}).get("profiles", {}).get(profile, {}).get(name)
+            line = (
+                f"  {name:24} {result['wall_ms']:7.0f}ms {result['spawns']:6}"
+                f" {result['docker_ms']:7.0f}ms {result['overhead_ms']:7.0f}ms"
+            )
+
+            if before:
+                line += f" {before['overhead_ms']:7.0f}ms"
+                limit = max(
+                    before["overhead_ms"] * REGRESSION_RATIO,
+                    before["overhead_ms"] + REGRESSION_MIN_MS,
+                )
+
+                if result["overhead_ms"] > limit:
+                    line += "  REGRESSION"
+                    regressions.append(f"{profile} / {name}")
+
+            if result["exit_code"]:
+                line += f"  (exit code {result['exit_code']})"
+
+            print(line)
+
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--profile",
+        action="append",
+        choices=sorted(PROFILES),
+        help="Profiles to run (all by default)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per profile")
+    parser.add_argument("--label", default=None, help="Name of the results")
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="Label of the results to compare with (latest by default)",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Exit with an error if the overhead regressed",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Show every docker call",
+    )
+    args = parser.parse_args()
+
+    global VERBOSE
+    VERBOSE = args.verbose
+
+    label = args.label or default_label()
+    profiles = {}
+
+    for name in args.profile or PROFILES:
+        runs = [run_profile(PROFILES[name]) for _ in range(args.repeat)]
+        profiles[name] = {k: asdict(v) for k, v in merge_runs(runs).items()}
+
+    results = {"label": label, "date": time.time(), "profiles": profiles}
+
+    if args.baseline:
+        old = json.loads((RESULTS_DIR / f"{args.baseline}.json").read_text())
+        print(f"Comparing with {args.baseline}")
+    elif found := previous_results(label):
+        print(f"Comparing with {found[0]}")
+        old = found[1]
+    else:
+        old = None
+
+    regressions = compare(old, results)
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    (RESULTS_DIR / f"{label}.json").write_text(json.dumps(results, indent=2) + "\n")
+    print(f"\nResults saved as {label}")
+
+    if regressions and args.check:
+        print(f"Overhead regressed in: {', '.join(regressions)}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Startup-time budget of the command line, measured with `python -X importtime`.
+
+Each scenario imports what a given command needs before doing any work and
+must stay under its budget (each module counting for its best time over a
+few runs), without importing any of the modules which it is not supposed to
+need. Run it with `make startup-budget`, it exits with an error when a
+budget is exceeded. The tests check the same budgets.
+
+Budgets are in milliseconds on a reasonably fast machine, multiply them with
+the MB_STARTUP_BUDGET_SCALE environment variable on slower ones.
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+
+RUNS = 15
+SCALE = float(os.environ.get("MB_STARTUP_BUDGET_SCALE", "1"))
+
+# Installed packages come with their bytecode, so the scenarios run with it
+# too, even where writing it is disabled (the first run compiles, which the
+# best of the runs leaves out)
+ENV = {
+    **{k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"},
+    "PYTHONPYCACHEPREFIX": str(Path(tempfile.gettempdir()) / "mb-startup-pycache"),
+}
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    modules: list[str]
+    budget_ms: float
+    forbidden: list[str]
+
+
+SCENARIOS = [
+    Scenario(
+        name="compose passthrough",
+        modules=[
+            "master_builder.__main__",
+            "master_builder.agent_client",
+            "master_builder.passthrough",
+        ],
+        budget_ms=50,
+        forbidden=["click", "rich", "rich_click", "yaml", "importlib.metadata"],
+    ),
+    Scenario(
+        name="ingress status",
+        modules=["master_builder.cli", "master_builder.ingress"],
+        budget_ms=130,
+        forbidden=[
+            "master_builder.deploy",
+            "master_builder.compose",
+            "master_builder.init",
+            "rich.traceback",
+            "importlib.metadata",
+        ],
+    ),
+    Scenario(
+        name="deploy",
+        modules=["master_builder.cli", "master_builder.deploy"],
+        budget_ms=180,
+        forbidden=["rich.traceback", "importlib.metadata"],
+    ),
+]
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+\d+ \| *(\S+)$")
+
+
+def self_times(modules: list[str]) -> dict[str, int]:
+    """
+    Time spent importing each module (itself, not what it imports) in a
+    fresh interpreter which imports some modules, in microseconds.
+    """
+
+    code = f"import {', '.join(modules)}" if modules else "pass"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        encoding="utf-8",
+        check=True,
+        env=ENV,
+    )
+
+    return {
+        m[2]: int(m[1])
+        for line in result.stderr.splitlines()
+        if (m := LINE.match(line))
+    }
+
+
+def import_time_ms(modules: list[str]) -> float:
+    """
+    Import time of some modules, leaving out the modules which the
+    interpreter imports by itself when starting. Each module counts for its
+    best time over a few runs, so that the noise of the machine doesn't add
+    up over the hundreds of modules imported.
+    """
+
+    best: dict[str, int] = {}
+
+    for _ in range(RUNS):
+        for module, time_us in self_times(modules).items():
+            best[module] = min(best.get(module, time_us), time_us)
+
+    startup = self_times([])
+
+    return sum(t for module, t in best.items() if module not in startup) / 1000
+
+
+def loaded_modules(modules: list[str]) -> set[str]:
+    code = f"import sys, json; import {', '.join(modules)}; "
+    code += "print(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        encoding="utf-8",
+        check=True,
+    )
+
+    return set(json.loads(result.stdout))
+
+
+def main() -> int:
+    failed = False
+
+    for scenario in SCENARIOS:
+        best = import_time_ms(scenario.modules)
+        budget = scenario.budget_ms * SCALE
+        leaked = sorted(set(scenario.forbidden) & loaded_modules(scenario.modules))
+        ok = best <= budget and not leaked
+        failed = failed or not ok
+
+        status = "ok" if ok else "FAIL"
+        print(f"{status:4} {scenario.name:20} {best:7.1f} ms (budget {budget:.0f} ms)")
+
+        if leaked:
+            print(f"     unexpected imports: {', '.join(leaked)}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
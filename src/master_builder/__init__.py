@@ -1,9 +1,19 @@
-try:
-    from importlib.metadata import PackageNotFoundError, version
-except ImportError:  # pragma: no cover
-    __version__ = "unknown"
-else:
+def __getattr__(name: str) -> str:
+    """
+    The version is only computed when asked for, as importlib.metadata takes
+    a while to load and most commands don't need it.
+    """
+
+    if name != "__version__":
+        msg = f"module {__name__!r} has no attribute {name!r}"
+        raise AttributeError(msg)
+
     try:
-        __version__ = version("master-builder")
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:  # pragma: no cover
+        return "unknown"
+
+    try:
+        return version("master-builder")
     except PackageNotFoundError:  # pragma: no cover
-        __version__ = "unknown"
+        return "unknown"
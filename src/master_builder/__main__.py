@@ -1,4 +1,26 @@
-from .cli import cli
+import sys
+
+
+def main():
+    """
+    Entry point of the command line. Commands that the resident agent can
+    run are handed over to it if it's there, and the compose passthrough gets
+    a fast path that doesn't even load the CLI framework.
+    """
+
+    from .agent_client import forward_to_agent
+
+    forward_to_agent(sys.argv[1:])
+
+    if sys.argv[1:2] == ["compose"]:
+        from .passthrough import compose_passthrough
+
+        compose_passthrough(sys.argv[2:])
+
+    from .cli import cli
 
-if __name__ == "__main__":
     cli()
+
+
+if __name__ == "__main__":
+    main()
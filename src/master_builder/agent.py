@@ -0,0 +1,191 @@
+import json
+import os
+import socket
+import struct
+import threading
+from contextlib import suppress
+from importlib import import_module
+from pathlib import Path
+from typing import IO
+
+import rich_click as click
+from rich.console import Console
+
+from .agent_client import shared_env
+from .cli import LAZY_SUBCOMMANDS
+from .config import Config
+from .docker_api import DockerClient
+from .errors import ErrorForUser, MasterBuilderError
+from .reporting import bound_streams, handle_fatal, install_stream_proxies
+
+console = Console(force_terminal=True)
+
+MAX_REQUEST_SIZE = 64 * 1024
+WARM_COMMANDS = ["deploy", "ingress"]
+
+
+def _peer_uid(conn: socket.socket) -> int:
+    creds = conn.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    return struct.unpack("3i", creds)[1]
+
+
+def _receive_request(conn: socket.socket) -> tuple[dict, list[int]]:
+    """
+    Reads the request of a client: a JSON line with the command line
+    arguments and the client's environment (see `shared_env()`), sent along
+    with the client's stdin, stdout and stderr.
+    """
+
+    data, fds, _, _ = socket.recv_fds(conn, MAX_REQUEST_SIZE, 3)
+
+    while data and not data.endswith(b"\n") and len(data) < MAX_REQUEST_SIZE:
+        if not (chunk := conn.recv(MAX_REQUEST_SIZE)):
+            break
+
+        data += chunk
+
+    return json.loads(data), fds
+
+
+def _open_streams(fds: list[int]) -> tuple[IO, IO, IO]:
+    stdin, stdout, stderr = fds
+    return (
+        os.fdopen(stdin, encoding="utf-8"),
+        os.fdopen(stdout, "w", encoding="utf-8", buffering=1),
+        os.fdopen(stderr, "w", encoding="utf-8", buffering=1),
+    )
+
+
+def _run(args: list[str]) -> int:
+    """
+    Runs a command of the CLI like the entry point would, returns its exit
+    code.
+    """
+
+    from .cli import cli
+
+    try:
+        cli.main(args=args, prog_name="master-builder", standalone_mode=True)
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else int(e.code is not None)
+
+    return 0
+
+
+def handle_client(conn: socket.socket) -> None:
+    """
+    Serves one client of the agent, see `serve`.
+
+    Parameters
+    ----------
+    conn
+        The connection with the client
+    """
+
+    with conn:
+        if _peer_uid(conn) != os.getuid():
+            return
+
+        try:
+            request, fds = _receive_request(conn)
+        except (OSError, ValueError):
+            return
+
+        if len(fds) != 3 or request.get("env") != shared_env(dict(os.environ)):
+            for fd in fds:
+                os.close(fd)
+
+            with suppress(OSError):
+                conn.sendall(b'{"refused": true}\n')
+
+            return
+
+        streams = _open_streams(fds)
+
+        try:
+            with bound_streams(*streams):
+                code = _run([str(a) for a in request.get("args", [])])
+        finally:
+            for stream in streams:
+                with suppress(OSError):
+                    stream.close()
+
+        with suppress(OSError):
+            conn.sendall(json.dumps({"exit": code}).encode() + b"\n")
+
+
+def _bind(path: Path) -> socket.socket:
+    """
+    Listens on the agent socket, taking over the socket file of a previous
+    agent if it's not alive anymore.
+    """
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    with probe:
+        try:
+            probe.connect(str(path))
+        except OSError:
+            path.unlink(missing_ok=True)
+        else:
+            msg = f"An agent is already listening on {path}"
+            raise ErrorForUser(msg)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+
+    try:
+        server.bind(str(path))
+    finally:
+        os.umask(old_umask)
+
+    server.listen()
+    return server
+
+
+def _warm_up() -> None:
+    """
+    Loads everything a command could need, so that the first command is as
+    fast as the next ones.
+    """
+
+    config = Config.instance(no_init_required=True)
+    _ = config.persisted
+
+    for name in WARM_COMMANDS:
+        module_name, attribute = LAZY_SUBCOMMANDS[name].split(":")
+        getattr(import_module(module_name), attribute)
+
+    try:
+        DockerClient.instance().request("GET", "/version")
+    except MasterBuilderError as e:
+        console.print(f"[yellow]Docker is not reachable yet: {e}")
+
+
+@click.command()
+@handle_fatal
+def serve():
+    """
+    Run the resident agent, which executes the deploy and ingress status
+    commands on behalf of the CLI.
+    """
+
+    config = Config.instance(no_init_required=True)
+    server = _bind(config.agent_socket)
+    install_stream_proxies()
+    _warm_up()
+
+    console.print(f"Agent listening on {config.agent_socket}")
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=handle_client, args=(conn,), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        config.agent_socket.unlink(missing_ok=True)
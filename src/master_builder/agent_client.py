@@ -0,0 +1,124 @@
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+
+from .config import Config
+
+FORWARDED_COMMANDS = [["deploy"], ["ingress", "status"]]
+PATH_OPTIONS = {"--file", "--trace-file"}
+SHARED_ENV_PREFIXES = ("MB_", "DOCKER_", "COMPOSE_")
+
+
+def shared_env(environ: dict[str, str]) -> dict[str, str]:
+    """
+    The environment variables which change what a command does, and that the
+    agent must therefore have just like its caller: the ones of Master
+    Builder, Docker and Docker Compose, and HOME which locates the Docker
+    configuration.
+
+    Parameters
+    ----------
+    environ
+        The environment to pick the variables from
+    """
+
+    return {
+        k: v
+        for k, v in environ.items()
+        if k == "HOME" or k.startswith(SHARED_ENV_PREFIXES)
+    }
+
+
+def _absolute_paths(args: list[str]) -> list[str]:
+    """
+    Makes the paths given to options absolute, since the agent runs them
+    from its own directory.
+    """
+
+    out: list[str] = []
+    path_next = False
+
+    for arg in args:
+        name, eq, value = arg.partition("=")
+
+        if path_next:
+            arg = str(Path(arg).absolute())
+        elif eq and name in PATH_OPTIONS:
+            arg = f"{name}={Path(value).absolute()}"
+        elif arg == "--":
+            out.extend(args[len(out) :])
+            break
+
+        path_next = arg in PATH_OPTIONS
+        out.append(arg)
+
+    return out
+
+
+def _should_forward(args: list[str]) -> bool:
+    if os.environ.get("MB_NO_AGENT"):
+        return False
+
+    return any(args[: len(c)] == c for c in FORWARDED_COMMANDS)
+
+
+def forward_to_agent(args: list[str]) -> None:
+    """
+    If an agent is listening (see `master_builder.agent`), hands over the
+    command to it and exits with its exit code. The agent gets our standard
+    streams, so it reads the compose file and writes its output directly
+    from/to our terminal (or SSH session).
+
+    Returns (without doing anything) when the command is not one the agent
+    handles, when there is no agent or when the agent refuses it because it
+    doesn't share our environment (see `shared_env()`), in which case the
+    command must run locally. Setting `MB_NO_AGENT` disables the forwarding.
+
+    Parameters
+    ----------
+    args
+        The command line arguments, without the program name
+    """
+
+    if not _should_forward(args):
+        return
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(str(Config().agent_socket))
+    except OSError:
+        sock.close()
+        return
+
+    with sock:
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+
+        request = {"args": _absolute_paths(args), "env": shared_env(dict(os.environ))}
+        data = json.dumps(request).encode() + b"\n"
+        socket.send_fds(sock, [data], [0, 1, 2])
+
+        try:
+            reply = sock.makefile("rb").readline()
+        except KeyboardInterrupt:
+            sys.stderr.write("\nDetached, the command goes on in the agent\n")
+            sys.exit(130)
+
+    try:
+        outcome = json.loads(reply)
+    except ValueError:
+        outcome = None
+
+    if isinstance(outcome, dict) and outcome.get("refused"):
+        return
+
+    try:
+        code = outcome["exit"]
+    except (KeyError, TypeError):
+        sys.stderr.write("Error: The agent hung up before the command finished\n")
+        code = 1
+
+    sys.exit(code)
@@ -1,14 +1,66 @@
+from importlib import import_module
+
 import rich_click as click
 
-from . import __version__
-from .compose import compose
-from .deploy import deploy
-from .ingress import ingress
-from .init import init
+LAZY_SUBCOMMANDS = {
+    "deploy": "master_builder.deploy:deploy",
+    "multi-deploy": "master_builder.multi_deploy:multi_deploy",
+    "ingress": "master_builder.ingress:ingress",
+    "registry-cache": "master_builder.registry_cache:registry_cache",
+    "compose": "master_builder.compose:compose",
+    "init": "master_builder.init:init",
+    "gc": "master_builder.image_gc:gc",
+    "rollback": "master_builder.releases:rollback",
+    "serve": "master_builder.agent:serve",
+}
+
+
+class LazyGroup(click.RichGroup):
+    """
+    A group whose subcommands are only imported when they are invoked (or
+    when they must be listed, for the help).
+
+    Parameters
+    ----------
+    lazy_subcommands
+        Maps the name of each subcommand to its import path, as
+        `module:attribute`
+    """
+
+    def __init__(self, *args, lazy_subcommands: dict[str, str], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted({*super().list_commands(ctx), *self.lazy_subcommands})
 
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        if cmd_name not in self.lazy_subcommands:
+            return super().get_command(ctx, cmd_name)
 
-@click.group()
-@click.version_option(version=__version__)
+        module_name, attribute = self.lazy_subcommands[cmd_name].split(":")
+        return getattr(import_module(module_name), attribute)
+
+
+def print_version(ctx: click.Context, _param: click.Parameter, value: bool):
+    if not value or ctx.resilient_parsing:
+        return
+
+    from . import __version__
+
+    click.echo(f"master-builder, version {__version__}")
+    ctx.exit()
+
+
+@click.group(cls=LazyGroup, lazy_subcommands=LAZY_SUBCOMMANDS)
+@click.option(
+    "--version",
+    is_flag=True,
+    expose_value=False,
+    is_eager=True,
+    callback=print_version,
+    help="Show the version and exit.",
+)
 def cli():
     """
     Master Builder: Deploy and manage your applications on a single VM with
@@ -16,11 +68,5 @@ def cli():
     """
 
 
-cli.add_command(deploy)
-cli.add_command(ingress)
-cli.add_command(compose)
-cli.add_command(init)
-
-
 if __name__ == "__main__":
     cli()
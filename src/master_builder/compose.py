@@ -4,6 +4,7 @@ from rich.console import Console
 from .config import Config
 from .errors import ErrorForUser
 from .reporting import handle_fatal, run_command
+from .state import current_deployment
 
 console = Console()
 
@@ -17,13 +18,12 @@ def compose(project_name: str, compose_args: tuple[str, ...]):
     config = Config.instance()
     project_dir = config.project_dir(project_name)
 
-    try:
-        latest_deploy = max(
-            (d for d in project_dir.iterdir() if d.is_dir()),
-            key=lambda d: d.stat().st_mtime,
-        )
-    except ValueError:
+    if not (current_deploy := current_deployment(project_dir)):
         msg = f"No deployments found for project {project_name}"
-        raise ErrorForUser(msg) from None
+        raise ErrorForUser(msg)
 
-    run_command(["docker", "compose", *compose_args], cwd=latest_deploy)
+    run_command(
+        ["docker", "compose", *compose_args],
+        cwd=current_deploy,
+        interactive=True,
+    )
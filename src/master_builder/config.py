@@ -1,10 +1,13 @@
 import os
 from dataclasses import asdict, dataclass, field
 from pathlib import Path
-
-import yaml
+from typing import TYPE_CHECKING, Any
 
 from .errors import ErrorForUser
+from .files import atomic_write_text
+
+if TYPE_CHECKING:
+    from types import ModuleType
 
 
 def detect_home():
@@ -17,6 +20,21 @@ def detect_home():
 _config: "Config | None" = None
 
 
+def load_yaml() -> "tuple[ModuleType, Any, Any]":
+    """
+    Imports YAML only when needed, since some commands never read the config
+    and would rather start fast. Returns the module along with the fastest
+    safe loader and dumper available (the libyaml ones if possible).
+    """
+
+    import yaml
+
+    try:
+        return yaml, yaml.CSafeLoader, yaml.CSafeDumper
+    except AttributeError:  # pragma: no cover
+        return yaml, yaml.SafeLoader, yaml.SafeDumper
+
+
 @dataclass(frozen=True)
 class PersistedConfig:
     init_done: bool = False
@@ -24,14 +42,30 @@ class PersistedConfig:
     ssl_contact: str = ""
     ssl_key: str = ""
     ssl_cert: str = ""
+    gc_keep_versions: int = 3
+    gc_budget: str = "80%"
+    traefik_profile: str = "default"
+    traefik_options: dict[str, str] = field(default_factory=dict)
+    registry_cache: str = ""
+    registry_cache_port: int = 5000
 
 
 @dataclass
 class Config:
     home: Path = field(default_factory=detect_home)
+    _persisted_cache: tuple[tuple[int, int, int], PersistedConfig] | None = field(
+        default=None,
+        init=False,
+        repr=False,
+        compare=False,
+    )
+
+    @property
+    def deployments_dir(self) -> Path:
+        return self.home / "deployments"
 
     def project_dir(self, project_name: str) -> Path:
-        return self.home / "deployments" / project_name
+        return self.deployments_dir / project_name
 
     def ensure_init(self):
         if not self.persisted.init_done:
@@ -42,32 +76,92 @@ class Config:
     def ingress_dir(self) -> Path:
         return self.home / "ingress"
 
+    @property
+    def traefik_dynamic_dir(self) -> Path:
+        return self.ingress_dir / "dynamic"
+
     @property
     def traefik_dynamic_file(self) -> Path:
-        return self.ingress_dir / "dynamic.yaml"
+        return self.traefik_dynamic_dir / "tls.yaml"
+
+    @property
+    def registry_cache_dir(self) -> Path:
+        return self.home / "registry-cache"
 
     @property
     def letsencrypt_dir(self) -> Path:
         return self.home / "letsencrypt"
 
+    @property
+    def locks_dir(self) -> Path:
+        return self.home / "locks"
+
+    @property
+    def cpus_file(self) -> Path:
+        return self.home / "cpus.json"
+
+    @property
+    def gc_lock_file(self) -> Path:
+        return self.home / "gc.lock"
+
+    @property
+    def gc_log_file(self) -> Path:
+        return self.home / "gc.log"
+
+    @property
+    def ssh_control_dir(self) -> Path:
+        return self.home / "ssh"
+
+    @property
+    def agent_socket(self) -> Path:
+        return self.home / "agent.sock"
+
     @property
     def config_file(self) -> Path:
         return self.home / "config.yml"
 
+    def _config_file_key(self) -> tuple[int, int, int] | None:
+        """
+        Identifies the current version of the config file from its metadata,
+        which is much cheaper than reading it.
+        """
+
+        try:
+            stat = self.config_file.stat()
+        except FileNotFoundError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
     @property
     def persisted(self) -> PersistedConfig:
-        if not self.config_file.exists():
+        """
+        The configuration stored by `init`. It's parsed only once, unless the
+        file changes in the meantime.
+        """
+
+        if (key := self._config_file_key()) is None:
             return PersistedConfig()
 
+        if self._persisted_cache and self._persisted_cache[0] == key:
+            return self._persisted_cache[1]
+
+        yaml, loader, _ = load_yaml()
+
         with self.config_file.open() as f:
-            return PersistedConfig(**yaml.safe_load(f))
+            value = PersistedConfig(**yaml.load(f, Loader=loader))
+
+        self._persisted_cache = (key, value)
+        return value
 
     @persisted.setter
     def persisted(self, value: PersistedConfig):
-        self.config_file.parent.mkdir(parents=True, exist_ok=True)
+        yaml, _, dumper = load_yaml()
+        content = yaml.dump(asdict(value), Dumper=dumper)
+        atomic_write_text(self.config_file, content)
 
-        with self.config_file.open("w") as f:
-            yaml.safe_dump(asdict(value), f)
+        if key := self._config_file_key():
+            self._persisted_cache = (key, value)
 
     @classmethod
     def instance(cls, no_init_required: bool = False) -> "Config":
@@ -76,7 +170,7 @@ class Config:
         if _config is None:
             _config = cls()
 
-            if not no_init_required:
-                _config.ensure_init()
+        if not no_init_required:
+            _config.ensure_init()
 
         return _config
@@ -0,0 +1,279 @@
+import copy
+import fcntl
+import json
+import math
+import os
+import re
+from collections import Counter
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+from pathlib import Path
+
+from rich.console import Console
+
+from .config import Config
+from .errors import ErrorForUser
+from .teardown import RETIRED_DIR
+from .traffic import service_labels
+
+console = Console(force_terminal=True)
+
+REPLICAS_LABEL = "master-builder.replicas"
+REPLICAS = re.compile(r"(?:(\d+)|cores(?:/(\d+))?)")
+
+
+def host_cpus() -> list[int]:
+    """
+    The CPUs Master Builder may use, which are all the cores of the host
+    unless it was itself restricted to some of them.
+    """
+
+    return sorted(os.sched_getaffinity(0))
+
+
+def format_cpuset(cpus: list[int]) -> str:
+    """
+    Formats a list of CPUs the way Docker expects it, like "0-3,8".
+
+    Parameters
+    ----------
+    cpus
+        The CPU numbers
+    """
+
+    ranges: list[list[int]] = []
+
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+
+    return ",".join(f"{a}-{b}" if a != b else f"{a}" for a, b in ranges)
+
+
+def parse_replicas(text: str, cores: int) -> int:
+    """
+    Parses a number of replicas, which is either fixed ("4") or derived from
+    the number of cores ("cores", or "cores/2" for one replica every two
+    cores). There is always at least one replica.
+
+    Parameters
+    ----------
+    text
+        The number of replicas
+    cores
+        Number of cores available
+    """
+
+    if not (match := REPLICAS.fullmatch(text.strip())):
+        msg = f"Invalid number of replicas {text!r}, expected like 4, cores or cores/2"
+        raise ErrorForUser(msg)
+
+    if match[1]:
+        return max(1, int(match[1]))
+
+    return max(1, cores // int(match[2] or 1))
+
+
+def apply_replicas(document: dict, overrides: Mapping[str, str]) -> dict:
+    """
+    Sets the number of replicas of the services which have one, either from
+    the command line or from their `master-builder.replicas` label. Returns
+    the document untouched if no service is scaled.
+
+    Parameters
+    ----------
+    document
+        The parsed compose file
+    overrides
+        Number of replicas of services, from the command line (see
+        `parse_replicas()`)
+    """
+
+    services = document.get("services") or {}
+    cores = len(host_cpus())
+    wanted = {}
+
+    if unknown := set(overrides) - set(services):
+        msg = f"Unknown services to scale: {', '.join(sorted(unknown))}"
+        raise ErrorForUser(msg)
+
+    for name, spec in services.items():
+        text = overrides.get(name) or service_labels(spec or {}).get(REPLICAS_LABEL)
+
+        if text:
+            wanted[name] = parse_replicas(text, cores)
+
+    if not wanted:
+        return document
+
+    document = copy.deepcopy(document)
+
+    for name, replicas in wanted.items():
+        spec = document["services"][name] = document["services"][name] or {}
+
+        if replicas > 1 and "container_name" in spec:
+            msg = f"Service {name} can't have several replicas with a container_name"
+            raise ErrorForUser(msg)
+
+        if replicas > 1 and any(_fixed_host_port(p) for p in spec.get("ports") or []):
+            msg = f"Service {name} can't have several replicas with a fixed host port"
+            raise ErrorForUser(msg)
+
+        spec.setdefault("deploy", {})["replicas"] = replicas
+
+    return document
+
+
+def _fixed_host_port(port: object) -> bool:
+    if isinstance(port, dict):
+        return bool(port.get("published"))
+
+    return ":" in str(port).split("/")[0]
+
+
+def _cpus_per_replica(spec: dict) -> int:
+    limit = spec.get("cpus") or (
+        ((spec.get("deploy") or {}).get("resources") or {}).get("limits") or {}
+    ).get("cpus")
+
+    try:
+        return max(1, math.ceil(float(limit))) if limit else 1
+    except ValueError:
+        return 1
+
+
+class CpuAllocator:
+    """
+    Hands out disjoint sets of cores to scaled services, so that the old and
+    new versions of a project, or different projects, don't fight for the
+    same cores. Allocations are stored in a file shared by all deployments
+    and belong to a deployment directory. They get released when the
+    deployment is torn down, or when its directory disappears.
+
+    When there are not enough free cores left, the least used ones get
+    shared.
+    """
+
+    def __init__(self) -> None:
+        self.file = Config.instance().cpus_file
+
+    @contextmanager
+    def _allocations(self) -> Iterator[dict[str, list[int]]]:
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+
+        with self.file.open("a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+
+            try:
+                allocations = json.loads(f.read() or "{}")
+            except ValueError:
+                allocations = {}
+
+            allocations = {
+                owner: cpus
+                for owner, cpus in allocations.items()
+                if _deployment_exists(Path(owner))
+            }
+
+            yield allocations
+
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(allocations, indent=2))
+
+    def allocate(self, owner: Path, count: int) -> list[int]:
+        """
+        Reserves some cores for a deployment.
+
+        Parameters
+        ----------
+        owner
+            Directory of the deployment
+        count
+            Number of cores
+        """
+
+        cpus = host_cpus()
+        count = min(count, len(cpus))
+
+        with self._allocations() as allocations:
+            usage = Counter(c for taken in allocations.values() for c in taken)
+            chosen = sorted(cpus, key=lambda c: (usage[c], c))[:count]
+            allocations.setdefault(str(owner), []).extend(chosen)
+
+        if usage[chosen[-1]]:
+            console.print(
+                f"[yellow]Not enough free cores, sharing {format_cpuset(chosen)}"
+            )
+
+        return sorted(chosen)
+
+    def release(self, owner: Path) -> None:
+        """
+        Gives back the cores of a deployment.
+
+        Parameters
+        ----------
+        owner
+            Directory of the deployment (which may since have been retired)
+        """
+
+        if not self.file.exists():
+            return
+
+        with self._allocations() as allocations:
+            allocations.pop(str(owner), None)
+            allocations.pop(str(owner.parent.parent / owner.name), None)
+
+
+def _deployment_exists(deploy_dir: Path) -> bool:
+    return (
+        deploy_dir.exists()
+        or (deploy_dir.parent / RETIRED_DIR / deploy_dir.name).exists()
+    )
+
+
+def pin_cpus(document: dict, deploy_dir: Path) -> dict:
+    """
+    Gives each scaled service of a deployment its own set of cores (see
+    `CpuAllocator`), enough for all its replicas. Services which already
+    have a cpuset are left alone. Returns the document untouched if there is
+    nothing to pin.
+
+    The replicas of a service share its set rather than getting one core
+    each, since Compose applies the cpuset of a service to all of its
+    containers. Splitting replicas into separate services would change the
+    name that other services, hooks and Traefik routers know them by.
+
+    Parameters
+    ----------
+    document
+        The compose file, once scaled by `apply_replicas()`
+    deploy_dir
+        Directory of the deployment, which owns the cores
+    """
+
+    services = document.get("services") or {}
+    scaled = {
+        name: spec
+        for name, spec in services.items()
+        if isinstance(spec, dict)
+        and "replicas" in (spec.get("deploy") or {})
+        and "cpuset" not in spec
+    }
+
+    if not scaled:
+        return document
+
+    document = copy.deepcopy(document)
+    allocator = CpuAllocator()
+
+    for name, spec in scaled.items():
+        count = spec["deploy"]["replicas"] * _cpus_per_replica(spec)
+        cpus = allocator.allocate(deploy_dir, count)
+        document["services"][name]["cpuset"] = format_cpuset(cpus)
+
+    return document
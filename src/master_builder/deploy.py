@@ -1,5 +1,9 @@
-import shlex
+import gzip
 import sys
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
 from shutil import rmtree
 from uuid import uuid4
@@ -9,134 +13,788 @@ import yaml
 from rich.console import Console
 
 from .config import Config
+from .cpus import CpuAllocator, apply_replicas, pin_cpus
+from .docker_api import DockerClient, compose_project_name
 from .errors import ErrorForUser
-from .ingress import ensure_network, start_ingress
-from .reporting import action, handle_fatal, run_command, success
+from .fingerprint import deploy_fingerprint
+from .hooks import Hook, parse_hooks, run_hooks
+from .image_gc import schedule_gc
+from .images import (
+    compose_images,
+    compose_left_to_pull,
+    local_image_ids,
+    pull_images,
+)
+from .ingress import ensure_network, running_features, start_ingress
+from .init import parse_options
+from .locks import DeployQueue
+from .pipeline import Step, run_steps
+from .readiness import project_ready, wait_until_ready
+from .registry_cache import cache_references, start_registry_cache
+from .releases import save_release
+from .reporting import (
+    action,
+    command_log,
+    handle_fatal,
+    run_command,
+    skipped,
+    success,
+)
+from .resources import check_admission
+from .rollout import roll_out
+from .state import DeployRecord, ProjectState, current_deployment
+from .teardown import retire_deployments, teardown_deployments
+from .tracing import tracing
+from .traefik import TraefikProfile
+from .traffic import ROUTING_DELAY, Cutover, ShiftPlan, has_routers, load_routes
 
 console = Console(force_terminal=True)
 
+GZIP_MAGIC = b"\x1f\x8b"
+LOGS_DIR = ".logs"
+KEPT_LOGS = 20
+
 
 @click.command()
 @click.option(
     "--before",
     multiple=True,
-    help="Commands to run before deployment (format: service:command)",
+    help=(
+        "Commands to run before deployment, in new containers (format: "
+        "[group/]service:command, commands of the same group run at the same "
+        "time)"
+    ),
 )
 @click.option(
     "--after",
     multiple=True,
-    help="Commands to run after deployment (format: service:command)",
+    help=(
+        "Commands to run after deployment (format: "
+        "[group/]service[@exec]:command, @exec runs it in the running "
+        "container of the service instead of a new one)"
+    ),
 )
 @click.option("--no-pull", is_flag=True, help="Do not pull images before deployment")
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Deploy even if the same version is already running",
+)
+@click.option(
+    "--pull-workers",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Maximum number of images to pull at the same time",
+)
+@click.option(
+    "--replicas",
+    multiple=True,
+    metavar="SERVICE=COUNT",
+    help=(
+        "Number of containers of a service, either fixed (web=4) or derived "
+        "from the number of cores (web=cores, web=cores/2). Can be repeated, "
+        "and overrides the master-builder.replicas label of the service. The "
+        "replicas of a service share a set of cores of their own (one per "
+        "replica), which the OS balances them across: Compose can't pin each "
+        "replica to its own core"
+    ),
+)
+@click.option(
+    "--ready-timeout",
+    type=float,
+    default=300,
+    show_default=True,
+    help=(
+        "Seconds each service has to become healthy before the deployment is "
+        "aborted (can be overridden per service with the "
+        "master-builder.ready-timeout label)"
+    ),
+)
+@click.option(
+    "--rollout",
+    type=click.Choice(["auto", "blue-green", "rolling"]),
+    default="auto",
+    show_default=True,
+    help=(
+        "How the new version replaces the old one: entirely side by side "
+        "(blue-green), one service at a time (rolling), or side by side only "
+        "if the host has enough memory and CPU for both (auto)"
+    ),
+)
+@click.option(
+    "--shift",
+    metavar="STEPS",
+    help=(
+        "Move the traffic progressively to the new version, by these "
+        "percentages (like 10,50,100), rolling back if it degrades the error "
+        "rate or the latency"
+    ),
+)
+@click.option(
+    "--shift-interval",
+    type=click.FloatRange(min=0),
+    default=30,
+    show_default=True,
+    help="Seconds each step of the traffic shift lasts",
+)
+@click.option(
+    "--shift-max-error-rate",
+    type=click.FloatRange(min=0, max=1),
+    default=0.01,
+    show_default=True,
+    help="How much more 5xx responses the new version may return (0.01 = 1 point)",
+)
+@click.option(
+    "--shift-max-latency-ratio",
+    type=click.FloatRange(min=1),
+    default=1.5,
+    show_default=True,
+    help="How many times slower the new version may respond, on average",
+)
+@click.option(
+    "--drain-timeout",
+    type=click.FloatRange(min=0),
+    default=30,
+    show_default=True,
+    help=(
+        "Once the old version stops receiving requests, seconds to wait for "
+        "the requests it is serving to finish before stopping it (0 to stop "
+        "it right away)"
+    ),
+)
+@click.option(
+    "--stop-timeout",
+    type=click.IntRange(min=0),
+    help=(
+        "Seconds the old containers have to stop before getting killed "
+        "(their stop_grace_period by default)"
+    ),
+)
+@click.option(
+    "--file",
+    "compose_file",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Read the compose file from this file instead of stdin",
+)
+@click.option(
+    "--trace-file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help=(
+        "Write the timing of each step and command to this file, in the Chrome "
+        "trace format (open it with https://ui.perfetto.dev)"
+    ),
+)
 @click.argument("project_name")
 @handle_fatal
-def deploy(before: list[str], after: list[str], no_pull: bool, project_name: str):
+def deploy(
+    before: list[str],
+    after: list[str],
+    no_pull: bool,
+    force: bool,
+    pull_workers: int,
+    replicas: tuple[str, ...],
+    ready_timeout: float,
+    rollout: str,
+    shift: str | None,
+    shift_interval: float,
+    shift_max_error_rate: float,
+    shift_max_latency_ratio: float,
+    drain_timeout: float,
+    stop_timeout: int | None,
+    compose_file: Path | None,
+    trace_file: Path | None,
+    project_name: str,
+):
     """Deploy a project using Docker Compose."""
 
     config = Config.instance()
+    compose_content, original_document = _read_compose_file(compose_file)
+    compose_document = apply_replicas(original_document, parse_options(replicas))
+    release_document = compose_document
+    before_hooks = parse_hooks(before, allow_exec=False)
+    after_hooks = parse_hooks(after, allow_exec=True)
+    plan = None
+
+    if shift:
+        plan = ShiftPlan.parse(
+            shift, shift_interval, shift_max_error_rate, shift_max_latency_ratio
+        )
+
     project_dir = config.project_dir(project_name)
     deploy_id = f"{uuid4()}"
+
+    with (
+        tracing(trace_file),
+        DeployQueue(project_name).turn() as go_on,
+        _pruning_logs(project_dir),
+        command_log(project_dir / LOGS_DIR / f"{deploy_id}.log") as log,
+    ):
+        if not go_on:
+            log.discard()
+            skipped(f"Deployment of {project_name} skipped, a newer one is queued.")
+            return
+
+        images = compose_images(compose_document)
+        prepared = run_steps(
+            [
+                Step(
+                    "registry cache",
+                    partial(_ensure_registry_cache, no_pull),
+                    critical=False,
+                ),
+                Step(
+                    "pull",
+                    partial(_fetch_images, images, no_pull, pull_workers),
+                    after=("registry cache",),
+                ),
+                Step("network", ensure_network),
+                Step("ingress", _ensure_ingress, after=("network",)),
+            ]
+        )
+        image_ids = prepared["pull"]
+        fingerprint = deploy_fingerprint(compose_document, image_ids)
+
+        if not force and _is_running(project_dir, fingerprint, compose_document):
+            log.discard()
+            skipped(f"This version of {project_name} is already running.")
+            return
+
+        deploy_dir = project_dir / deploy_id
+        compose_project = compose_project_name(deploy_dir, compose_document)
+        rolling_from = _rolling_from(project_dir, compose_document, rollout, plan)
+        cutover = Cutover(project_name, load_routes(current_deployment(project_dir)))
+
+        if (plan or drain_timeout or rolling_from) and _can_route(
+            compose_document, bool(plan)
+        ):
+            cutover.plan = None if rolling_from else plan
+            cutover.metrics_port = _metrics_port() if plan or drain_timeout else None
+            compose_document = cutover.route(compose_document, compose_project)
+
+        try:
+            with action(f"Creating new deployment for {project_name}"):
+                deploy_dir.mkdir(parents=True, exist_ok=True)
+                compose_document = pin_cpus(compose_document, deploy_dir)
+                compose_file = deploy_dir / "docker-compose.yml"
+                compose_file.write_text(
+                    compose_content
+                    if compose_document is original_document
+                    else _dump_compose(compose_document)
+                )
+
+                cutover.prepare(deploy_dir)
+
+                state = ProjectState.load(project_dir)
+                state.add_pending(deploy_id)
+                state.save(project_dir)
+
+            if not no_pull and (left := compose_left_to_pull(compose_document)):
+                with action("Pulling the images left to Compose"):
+                    _pull_left_to_compose(deploy_dir, left)
+
+            if before_hooks:
+                with action("Running before commands"):
+                    run_hooks(deploy_dir, before_hooks)
+
+            if not rolling_from:
+                with action("Deploying new version"):
+                    _deploy(deploy_dir)
+
+            _go_live(
+                deploy_dir,
+                compose_document,
+                compose_project,
+                ready_timeout,
+                cutover,
+                rolling_from,
+            )
+        except BaseException:
+            _abort(project_dir, deploy_id, cutover)
+            raise
+
+        obsolete = _activate(project_dir, deploy_id, compose_project, fingerprint)
+
+        if (
+            obsolete
+            and drain_timeout
+            and not cutover.drains
+            and has_routers(compose_document)
+        ):
+            console.print(
+                "[yellow]The old version isn't routed through the ingress' file "
+                "provider, so it can't be drained: the requests it is serving "
+                "get cut (see `deploy --drain-timeout`)"
+            )
+
+        stop_old = partial(
+            _stop_old, project_dir, obsolete, cutover, drain_timeout, stop_timeout
+        )
+        run_after = partial(_run_after_commands, deploy_dir, after_hooks)
+        keep_release = partial(save_release, project_dir, deploy_id, release_document)
+        run_steps(
+            [
+                Step("stop old", stop_old, shielded=True),
+                Step("ingress", _ensure_ingress),
+                Step("release", keep_release, critical=False),
+                *([Step("after", run_after)] if after_hooks else []),
+                Step("gc", _schedule_gc, after=("stop old",), critical=False),
+            ]
+        )
+
+    success(f"Deployment of {project_name} completed successfully.")
+
+
+def _abort(project_dir: Path, deploy_id: str, cutover: Cutover) -> None:
+    """
+    Removes a deployment which failed before going live, whatever it got to
+    (containers, reserved CPUs, pending state), and sends the traffic back
+    to the old deployment.
+
+    Parameters
+    ----------
+    project_dir
+        Directory of the project
+    deploy_id
+        ID of the failed deployment
+    cutover
+        How the traffic was moving to it
+    """
+
     deploy_dir = project_dir / deploy_id
 
-    ensure_network()
+    with action("Aborting new deployment, keeping the old one"):
+        cutover.abort()
 
-    with action(f"Creating new deployment for {project_name}"):
-        deploy_dir.mkdir(parents=True, exist_ok=True)
-        compose_content = _read_compose_file()
-        compose_file = deploy_dir / "docker-compose.yml"
-        compose_file.write_text(compose_content)
+        if (deploy_dir / "docker-compose.yml").exists():
+            run_command(["docker", "compose", "down"], cwd=deploy_dir, check=False)
 
-    if before:
-        with action("Running before commands"):
-            _run_service_commands(deploy_dir, before)
+        rmtree(deploy_dir, ignore_errors=True)
+        CpuAllocator().release(deploy_dir)
 
-    with action("Deploying new version"):
-        _deploy(deploy_dir, no_pull)
+        state = ProjectState.load(project_dir)
+        state.discard(deploy_id)
+        state.save(project_dir)
 
-    with action("Stop old deployments"):
-        old_deploys = [
-            d for d in project_dir.iterdir() if d.is_dir() and d.name != deploy_id
-        ]
-        for old_deploy_dir in old_deploys:
-            run_command(["docker", "compose", "down"], cwd=old_deploy_dir)
-            rmtree(old_deploy_dir)
 
+@contextmanager
+def _pruning_logs(project_dir: Path) -> Iterator[None]:
+    """
+    Once this context exits, only the last `KEPT_LOGS` command logs of the
+    project are kept. The logs are out of the deployment directories, to
+    outlive failed deployments.
+
+    Parameters
+    ----------
+    project_dir
+        The directory of the project
+    """
+
+    try:
+        yield
+    finally:
+        logs_dir = project_dir / LOGS_DIR
+
+        if logs_dir.is_dir():
+            logs = sorted(logs_dir.glob("*.log"), key=lambda f: f.stat().st_mtime)
+
+            for old in logs[: max(0, len(logs) - KEPT_LOGS)]:
+                old.unlink(missing_ok=True)
+
+
+def _rolling_from(
+    project_dir: Path,
+    document: dict,
+    rollout: str,
+    plan: ShiftPlan | None,
+) -> Path | None:
+    """
+    Picks how the new version replaces the old one. Returns the directory of
+    the current deployment if services are to be replaced one at a time (see
+    `roll_out()`), or None to start the whole new deployment beside it.
+
+    In auto mode, the new version goes side by side with the old one only if
+    the host has room for both, see `check_admission()`.
+
+    Parameters
+    ----------
+    project_dir
+        The directory of the project
+    document
+        The compose file of the new deployment
+    rollout
+        The rollout mode: auto, blue-green or rolling
+    plan
+        The traffic shift, which only works side by side
+    """
+
+    current = current_deployment(project_dir)
+
+    if rollout == "blue-green" or not current or document.get("name"):
+        return None
+
+    if rollout == "auto":
+        with action("Checking available resources"):
+            admission = check_admission(
+                document, compose_project_name(current, document)
+            )
+
+        if admission.fits:
+            return None
+
+        console.print(
+            f"[yellow]The new version {admission.describe()}: replacing "
+            f"services one at a time instead of side by side."
+        )
+
+    if plan:
+        console.print("[yellow]Rolling deployments don't shift traffic.")
+
+    return current
+
+
+def _go_live(
+    deploy_dir: Path,
+    document: dict,
+    compose_project: str,
+    ready_timeout: float,
+    cutover: Cutover,
+    rolling_from: Path | None,
+) -> None:
+    """
+    Gets the new deployment ready and sends the traffic to it, either once
+    all its services are ready or one service at a time (see `roll_out()`).
+
+    Parameters
+    ----------
+    deploy_dir
+        Directory of the new deployment
+    document
+        Its compose file
+    compose_project
+        Its compose project
+    ready_timeout
+        Seconds each service has to become ready
+    cutover
+        How the traffic moves to the new deployment
+    rolling_from
+        Directory of the deployment to replace service by service, if any
+    """
+
+    if rolling_from:
+        roll_out(
+            deploy_dir,
+            rolling_from,
+            document,
+            compose_project,
+            ready_timeout,
+            cutover.move,
+            ROUTING_DELAY if cutover.new is not None else 0,
+        )
+        return
+
+    with action("Waiting for services to be ready"):
+        wait_until_ready(compose_project, ready_timeout)
+
+    cutover.run()
+
+
+def _fetch_images(
+    images: list[str],
+    no_pull: bool,
+    workers: int,
+) -> dict[str, str | None]:
+    """
+    Pulls the images, unless told not to, and returns the IDs of their local
+    copies (see `pull_images()`). Images from the registry mirrored by the
+    registry cache are pulled through it.
+
+    Parameters
+    ----------
+    images
+        The images of the compose file
+    no_pull
+        Only look at the local images
+    workers
+        Maximum number of concurrent pulls
+    """
+
+    if no_pull:
+        return local_image_ids(images)
+
+    with action("Pulling images"):
+        return pull_images(images, workers, cache_references(images))
+
+
+def _pull_left_to_compose(deploy_dir: Path, left: dict[str, bool]) -> None:
+    """
+    Pulls the images of the services that weren't pulled beforehand (see
+    `compose_left_to_pull()`), once the compose file is in the deployment
+    directory, so that Compose resolves their variables. Services which can
+    be built go on without their image if it isn't in a registry, and Compose
+    builds it.
+
+    Parameters
+    ----------
+    deploy_dir
+        The directory of the new deployment
+    left
+        The services, each one with whether it can be built
+    """
+
+    pulled = [service for service, buildable in left.items() if not buildable]
+    buildable = [service for service, buildable in left.items() if buildable]
+
+    if pulled:
+        run_command(["docker", "compose", "pull", *pulled], cwd=deploy_dir)
+
+    if buildable:
+        run_command(
+            ["docker", "compose", "pull", "--ignore-pull-failures", *buildable],
+            cwd=deploy_dir,
+        )
+
+
+def _ensure_registry_cache(no_pull: bool) -> None:
+    if not no_pull and Config.instance().persisted.registry_cache:
+        with action("Ensure the registry cache is started"):
+            start_registry_cache()
+
+
+def _ensure_ingress() -> None:
     with action("Ensure Traefik is started"):
         start_ingress()
 
-    if after:
-        with action("Running after commands"):
-            _run_service_commands(deploy_dir, after)
 
-    with action("Prune Docker"):
-        _prune_docker()
+def _run_after_commands(deploy_dir: Path, hooks: list[list[Hook]]) -> None:
+    with action("Running after commands"):
+        run_hooks(deploy_dir, hooks)
 
-    success(f"Deployment of {project_name} completed successfully.")
 
+def _schedule_gc() -> None:
+    with action("Scheduling image garbage collection"):
+        schedule_gc()
 
-def _deploy(deploy_dir: Path, no_pull: bool):
+
+def _stop_old(
+    project_dir: Path,
+    obsolete: list[str],
+    cutover: Cutover,
+    drain_timeout: float,
+    stop_timeout: int | None,
+) -> None:
     """
-    Starts the deployment in Docker Compose
+    Takes the old deployments out of the routing, drains them if possible
+    and tears them down, giving back their cores.
+
+    Parameters
+    ----------
+    project_dir
+        The directory of the project
+    obsolete
+        IDs of the old deployments
+    cutover
+        How the traffic moved to the new deployment
+    drain_timeout
+        Maximum time to wait for the connections of the old deployments
+    stop_timeout
+        Seconds the old containers have to stop, see `teardown_deployments()`
+    """
+
+    cutover.finish()
+    retired = retire_deployments(project_dir, obsolete)
+
+    if retired and cutover.drains and drain_timeout:
+        with action("Draining old deployments"):
+            cutover.drain(drain_timeout)
+
+    with action("Stop old deployments"):
+        teardown_deployments(retired, stop_timeout)
+        cutover.cleanup()
+
+        for retired_dir in retired:
+            CpuAllocator().release(retired_dir)
+
+
+def _deploy(deploy_dir: Path):
+    """
+    Starts the deployment in Docker Compose. Images were pulled beforehand (if
+    required, see `_fetch_images()` and `_pull_left_to_compose()`), so
+    Compose only builds the ones that are still missing.
 
     Parameters
     ----------
     deploy_dir
         The directory where the deployment is located
-    no_pull
-        Whether to pull images before deployment
     """
 
-    pull_flag = [] if no_pull else ["--pull", "always"]
-    run_command(["docker", "compose", "up", "-d", *pull_flag], cwd=deploy_dir)
+    run_command(["docker", "compose", "up", "-d"], cwd=deploy_dir)
 
 
-def _read_compose_file():
+def _can_route(document: dict, explain: bool) -> bool:
+    """
+    Tells if the new deployment can go through weighted services (see
+    `Cutover`), which is required to shift or drain the traffic. The ingress,
+    started beforehand, must read its dynamic configuration directory and the
+    old and new deployments must be distinct compose projects. Otherwise, the
+    traffic switches at once.
+
+    Parameters
+    ----------
+    document
+        The parsed compose file
+    explain
+        Say why the traffic can't be routed, if it can't
+    """
+
+    if document.get("name"):
+        if explain:
+            console.print(
+                "[yellow]The compose file sets a project name, so the old and "
+                "new versions can't run side by side: switching the traffic "
+                "at once."
+            )
+
+        return False
+
+    if not running_features()[0]:
+        if explain:
+            console.print(
+                "[yellow]The running Traefik can't shift traffic, switching at "
+                "once. Run `master-builder ingress update` to enable it."
+            )
+
+        return False
+
+    return True
+
+
+def _metrics_port() -> int | None:
+    """
+    Port of the metrics of the running Traefik, if it exposes them.
+    """
+
+    if not running_features()[1]:
+        return None
+
+    persisted = Config.instance().persisted
+    profile = TraefikProfile.resolve(
+        persisted.traefik_profile,
+        persisted.traefik_options,
+    )
+
+    return profile.metrics_port
+
+
+def _dump_compose(document: dict) -> str:
+    """
+    Serializes a compose file which was rewritten, see `route_through_file()`.
+
+    Parameters
+    ----------
+    document
+        The compose file
+    """
+
+    return yaml.safe_dump(document, sort_keys=False, width=1000)
+
+
+def _read_compose_file(path: Path | None) -> tuple[str, dict]:
     """
     Reads the compose file from stdin and tries to guide the user into doing
-    this.
+    this. It may be compressed with gzip (see `multi_deploy`). Returns both
+    the raw content, which is deployed verbatim, and its parsed version.
+
+    Parameters
+    ----------
+    path
+        Read the compose file from there instead, if specified
     """
 
-    if not (compose := sys.stdin.read()):
+    if not (data := path.read_bytes() if path else sys.stdin.buffer.read()):
         msg = "The content of docker-compose.yml is expected on stdin."
         raise ErrorForUser(msg)
 
     try:
-        yaml.safe_load(compose)
+        if data.startswith(GZIP_MAGIC):
+            data = gzip.decompress(data)
+
+        compose = data.decode()
+    except (OSError, EOFError, UnicodeDecodeError) as e:
+        msg = f"Invalid docker-compose.yml: {e!s}"
+        raise ErrorForUser(msg) from None
+
+    try:
+        document = yaml.safe_load(compose)
     except yaml.YAMLError as e:
         msg = f"Invalid docker-compose.yml: {e!s}"
         raise ErrorForUser(msg) from None
 
-    return compose
+    if not isinstance(document, dict):
+        msg = "Invalid docker-compose.yml: expected a mapping at the root."
+        raise ErrorForUser(msg)
+
+    return compose, document
 
 
-def _run_service_commands(deploy_dir: Path, commands: list[str]):
+def _is_running(project_dir: Path, fingerprint: str | None, document: dict) -> bool:
     """
-    Runs a series of one-off commands in the services of the deployment
+    Tells if the current deployment of the project has the same fingerprint
+    (see `deploy_fingerprint()`) and is in good health, in which case there is
+    nothing to deploy.
 
     Parameters
     ----------
-    deploy_dir
-        The directory where the deployment is located
-    commands
-        A list of commands to run in the format <service>:<command>
+    project_dir
+        The directory of the project
+    fingerprint
+        Fingerprint of the version being deployed
+    document
+        The parsed compose file
     """
 
-    for cmd in commands:
-        match cmd.split(":", 1):
-            case [service, command]:
-                parts = shlex.split(command)
-                run_command(
-                    ["docker", "compose", "run", "-T", "--rm", service, *parts],
-                    cwd=deploy_dir,
-                )
-            case _:
-                msg = f"Invalid command format: {cmd}, expected <service>:<command>"
-                raise ErrorForUser(msg)
+    if not fingerprint:
+        return False
+
+    record = ProjectState.load(project_dir).current_record
+
+    if not record or record.fingerprint != fingerprint:
+        return False
+
+    services = (document.get("services") or {}).keys()
+    compose_project = compose_project_name(project_dir / record.deploy_id, document)
 
+    return project_ready(compose_project, services)
 
-def _prune_docker():
+
+def _activate(
+    project_dir: Path,
+    deploy_id: str,
+    compose_project: str,
+    fingerprint: str | None,
+) -> list[str]:
     """
-    Removes all unused images to free up space as we go
+    Makes the deployment the current one of the project, and records it along
+    with the images it runs and its fingerprint in the project's history.
+    Returns the IDs of the deployments which are now obsolete.
+
+    Parameters
+    ----------
+    project_dir
+        The directory of the project
+    deploy_id
+        ID of the deployment which just went live
+    compose_project
+        Name of its compose project
+    fingerprint
+        Fingerprint of the deployment, see `deploy_fingerprint()`
     """
 
-    run_command(["docker", "system", "prune", "-a", "-f"])
+    containers = DockerClient.instance().project_containers(
+        compose_project, all_states=True
+    )
+    images = sorted({c["ImageID"] for c in containers if c.get("ImageID")})
+
+    state = ProjectState.load(project_dir)
+    record = DeployRecord(deploy_id, time.time(), images, fingerprint)
+    return state.activate(project_dir, record)
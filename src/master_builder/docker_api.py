@@ -0,0 +1,429 @@
+import http.client
+import json
+import os
+import queue
+import re
+import socket
+from collections.abc import Iterator, Mapping, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+from urllib.parse import quote, urlencode
+
+from .errors import DockerApiError, ErrorForUser
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+COMPOSE_PROJECT_LABEL = "com.docker.compose.project"
+COMPOSE_SERVICE_LABEL = "com.docker.compose.service"
+
+_client: "DockerClient | None" = None
+
+
+def detect_docker_socket() -> str:
+    """
+    Finds the path to the Docker Engine socket, honoring DOCKER_HOST like the
+    CLI does.
+    """
+
+    host = os.environ.get("DOCKER_HOST", "")
+
+    if not host:
+        return DEFAULT_SOCKET
+
+    if host.startswith("unix://"):
+        return host.removeprefix("unix://")
+
+    msg = f"Only unix:// Docker hosts are supported, got {host!r}"
+    raise ErrorForUser(msg)
+
+
+def compose_project_name(directory: Path, document: Mapping | None = None) -> str:
+    """
+    Computes the name that Docker Compose gives to a project, which is what
+    ends up in the `com.docker.compose.project` label of its containers.
+
+    Parameters
+    ----------
+    directory
+        The directory in which the compose file lives
+    document
+        The parsed compose file, if it is known. Its `name` takes precedence
+        over the directory name.
+    """
+
+    name = (document or {}).get("name") or directory.name
+    return re.sub(r"[^a-z0-9_-]", "", name.lower())
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    A HTTP connection that goes through a unix socket instead of TCP
+    """
+
+    def __init__(self, socket_path: str, timeout: float | None = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerClient:
+    """
+    A minimal client for the Docker Engine API. Connections are kept alive and
+    pooled so that successive queries don't pay for a new connection (let
+    alone for forking the docker CLI).
+
+    Parameters
+    ----------
+    socket_path
+        Path to the unix socket of the Docker Engine
+    pool_size
+        Maximum number of idle connections that are kept around
+    timeout
+        Socket timeout for regular (non-streaming) requests
+    """
+
+    def __init__(
+        self,
+        socket_path: str | None = None,
+        pool_size: int = 4,
+        timeout: float = 60,
+    ):
+        self.socket_path = socket_path or detect_docker_socket()
+        self.timeout = timeout
+        self._pool: queue.LifoQueue[UnixHTTPConnection] = queue.LifoQueue(pool_size)
+
+    @classmethod
+    def instance(cls) -> "DockerClient":
+        global _client
+
+        if _client is None:
+            _client = cls()
+
+        return _client
+
+    def _new_connection(self, timeout: float | None) -> UnixHTTPConnection:
+        return UnixHTTPConnection(self.socket_path, timeout=timeout)
+
+    @contextmanager
+    def _connection(self) -> Iterator[UnixHTTPConnection]:
+        """
+        Borrows a connection from the pool and gives it back once done, unless
+        the server asked to close it or something went wrong.
+        """
+
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._new_connection(self.timeout)
+
+        try:
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @staticmethod
+    def _url(path: str, query: Mapping[str, Any] | None) -> str:
+        params = {k: v for k, v in (query or {}).items() if v is not None}
+
+        if params:
+            return f"{path}?{urlencode(params)}"
+
+        return path
+
+    @staticmethod
+    def _check(response: http.client.HTTPResponse, body: bytes) -> None:
+        if response.status < 400:
+            return
+
+        try:
+            message = json.loads(body)["message"]
+        except (ValueError, KeyError, TypeError):
+            message = body.decode(errors="replace") or response.reason
+
+        raise DockerApiError(response.status, message)
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        query: Mapping[str, Any] | None = None,
+        body: Any = None,
+        headers: Mapping[str, str] | None = None,
+    ) -> Any:
+        """
+        Sends a request to the API and returns the decoded JSON response (or
+        None if there is no response body).
+
+        Parameters
+        ----------
+        method
+            HTTP method
+        path
+            Path of the endpoint, like `/containers/json`
+        query
+            Query string parameters, None values are omitted
+        body
+            Something to be JSON-encoded as the request body
+        headers
+            Extra headers to send
+        """
+
+        url = self._url(path, query)
+        payload = None if body is None else json.dumps(body).encode()
+        all_headers = {"Content-Type": "application/json", **(headers or {})}
+
+        for attempt in range(2):
+            with self._connection() as conn:
+                try:
+                    conn.request(method, url, body=payload, headers=all_headers)
+                    response = conn.getresponse()
+                    data = response.read()
+                except (ConnectionResetError, BrokenPipeError) as e:
+                    # The daemon closed an idle pooled connection under our
+                    # feet, which is fine to retry once on a fresh one as
+                    # long as the request is safe to repeat.
+                    conn.close()
+
+                    if not attempt and method == "GET":
+                        continue
+
+                    msg = (
+                        f"Docker at {self.socket_path} closed the connection during "
+                        f"{method} {path}, which may or may not have been applied: "
+                        f"{e}"
+                    )
+                    raise ErrorForUser(msg) from None
+                except http.client.HTTPException as e:
+                    msg = f"Invalid response from Docker at {self.socket_path}: {e!r}"
+                    raise ErrorForUser(msg) from None
+                except OSError as e:
+                    msg = f"Could not reach Docker at {self.socket_path}: {e}"
+                    raise ErrorForUser(msg) from None
+
+                if response.will_close:
+                    conn.close()
+
+            self._check(response, data)
+            return json.loads(data) if data else None
+
+        raise AssertionError  # pragma: no cover
+
+    def stream(
+        self,
+        method: str,
+        path: str,
+        query: Mapping[str, Any] | None = None,
+        timeout: float | None = None,
+    ) -> Iterator[Any]:
+        """
+        Sends a request whose response is a stream of JSON objects (like
+        events) and yields them as they arrive. The stream uses a dedicated
+        connection which is not returned to the pool.
+
+        Parameters
+        ----------
+        method
+            HTTP method
+        path
+            Path of the endpoint
+        query
+            Query string parameters
+        timeout
+            Maximum time to wait for each object to arrive. The stream stops
+            silently when it is exceeded.
+        """
+
+        conn = self._new_connection(timeout)
+
+        try:
+            try:
+                conn.request(method, self._url(path, query))
+                response = conn.getresponse()
+            except http.client.HTTPException as e:
+                msg = f"Invalid response from Docker at {self.socket_path}: {e!r}"
+                raise ErrorForUser(msg) from None
+            except OSError as e:
+                msg = f"Could not reach Docker at {self.socket_path}: {e}"
+                raise ErrorForUser(msg) from None
+
+            if response.status >= 400:
+                self._check(response, response.read())
+
+            while True:
+                try:
+                    line = response.readline()
+                except TimeoutError:
+                    return
+
+                if not line:
+                    return
+
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _filters(**filters: Sequence[str] | None) -> str:
+        return json.dumps({k: list(v) for k, v in filters.items() if v})
+
+    def networks(self, names: Sequence[str] | None = None) -> list[dict]:
+        """
+        Lists networks. Beware that the Docker name filter matches substrings.
+
+        Parameters
+        ----------
+        names
+            Only list networks whose name contains one of those
+        """
+
+        return self.request("GET", "/networks", {"filters": self._filters(name=names)})
+
+    def containers(
+        self,
+        labels: Mapping[str, str] | None = None,
+        status: Sequence[str] | None = None,
+        all_states: bool = False,
+    ) -> list[dict]:
+        """
+        Lists containers matching some labels.
+
+        Parameters
+        ----------
+        labels
+            Labels which must all be present with the given value
+        status
+            Only list containers with one of those statuses (running, exited,
+            etc)
+        all_states
+            List stopped containers as well, not only running ones
+        """
+
+        label_filters = [f"{k}={v}" for k, v in (labels or {}).items()]
+        filters = self._filters(label=label_filters, status=status)
+
+        return self.request(
+            "GET",
+            "/containers/json",
+            {"all": "true" if all_states else None, "filters": filters},
+        )
+
+    def project_containers(
+        self,
+        project: str,
+        service: str | None = None,
+        **kwargs: Any,
+    ) -> list[dict]:
+        """
+        Lists the containers of a Docker Compose project.
+
+        Parameters
+        ----------
+        project
+            Name of the compose project (see `compose_project_name()`)
+        service
+            Restrict to this service of the project
+        kwargs
+            Passed to `containers()`
+        """
+
+        labels = {COMPOSE_PROJECT_LABEL: project}
+
+        if service:
+            labels[COMPOSE_SERVICE_LABEL] = service
+
+        return self.containers(labels=labels, **kwargs)
+
+    def inspect_container(self, container_id: str) -> dict:
+        """
+        Returns the full description of a container.
+
+        Parameters
+        ----------
+        container_id
+            ID or name of the container
+        """
+
+        return self.request("GET", f"/containers/{quote(container_id)}/json")
+
+    def events(
+        self,
+        filters: Mapping[str, Sequence[str]] | None = None,
+        since: float | None = None,
+        until: float | None = None,
+        timeout: float | None = None,
+    ) -> Iterator[dict]:
+        """
+        Follows the events stream of the daemon.
+
+        Parameters
+        ----------
+        filters
+            Docker filters, like `{"type": ["container"]}`
+        since
+            Replay events from this UNIX timestamp
+        until
+            Stop the stream at this UNIX timestamp
+        timeout
+            Stop the stream if no event arrives for that many seconds
+        """
+
+        query = {
+            "filters": self._filters(**(filters or {})),
+            "since": None if since is None else f"{since:.9f}",
+            "until": None if until is None else f"{until:.9f}",
+        }
+
+        yield from self.stream("GET", "/events", query, timeout=timeout)
+
+    def inspect_image(self, image: str) -> dict | None:
+        """
+        Returns the description of a local image, or None if there is no such
+        image.
+
+        Parameters
+        ----------
+        image
+            Reference or ID of the image
+        """
+
+        try:
+            return self.request("GET", f"/images/{quote(image, safe='/:@')}/json")
+        except DockerApiError as e:
+            if e.status == 404:
+                return None
+
+            raise
+
+    def distribution_digest(self, image: str, auth: str | None = None) -> str:
+        """
+        Asks the registry (through the daemon) for the current digest of an
+        image reference, without pulling anything.
+
+        Parameters
+        ----------
+        image
+            Reference of the image
+        auth
+            Value for the X-Registry-Auth header, if the registry needs it
+        """
+
+        headers = {"X-Registry-Auth": auth} if auth else None
+        info = self.request(
+            "GET",
+            f"/distribution/{quote(image, safe='/:@')}/json",
+            headers=headers,
+        )
+
+        return info["Descriptor"]["digest"]
@@ -1,6 +1,46 @@
+from pathlib import Path
+
+
 class MasterBuilderError(Exception):
     pass
 
 
 class ErrorForUser(MasterBuilderError):
     """An error intended to be displayed to the user"""
+
+
+class DockerApiError(MasterBuilderError):
+    """The Docker Engine API answered with an error"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Docker API error {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class CommandFailed(ErrorForUser):
+    """A command exited with an error, shown along with its last output"""
+
+    def __init__(
+        self,
+        command: list[str],
+        returncode: int,
+        tail: str,
+        log_file: Path | None = None,
+    ):
+        message = f"Command failed with return code {returncode}: {' '.join(command)}"
+
+        if tail:
+            message += f"\n\nLast output:\n{tail}"
+
+        if log_file:
+            message += f"\n\nFull output in {log_file}"
+
+        super().__init__(message)
+        self.command = command
+        self.returncode = returncode
+        self.tail = tail
+
+
+class Cancelled(MasterBuilderError):
+    """The work was cancelled because something it runs along with failed"""
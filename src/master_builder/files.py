@@ -0,0 +1,48 @@
+import os
+import tempfile
+from pathlib import Path
+
+
+def _read_umask() -> int:
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+# Read once at import, as reading it means changing it for every thread
+UMASK = _read_umask()
+
+
+def atomic_write_text(path: Path, content: str) -> None:
+    """
+    Writes a file through a temporary file which is then renamed over the
+    target, so that readers see either the old or the new content but never
+    a half-written file. The file keeps its permissions, or gets the usual
+    ones of new files if it didn't exist (unlike the temporary file, which
+    is only readable by its owner).
+
+    Parameters
+    ----------
+    path
+        The file to write
+    content
+        What to write in it
+    """
+
+    try:
+        mode = path.stat().st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~UMASK
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+
+    try:
+        with os.fdopen(fd, "w") as f:
+            os.fchmod(f.fileno(), mode)
+            f.write(content)
+
+        Path(tmp).replace(path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
@@ -0,0 +1,47 @@
+import hashlib
+import json
+from collections.abc import Mapping
+
+
+def deploy_fingerprint(
+    document: Mapping,
+    image_ids: Mapping[str, str | None],
+) -> str | None:
+    """
+    Identifies what a deployment runs: the compose file (normalized, so that
+    formatting and key order don't matter) and the exact image of each
+    service. Two deployments with the same fingerprint are the same.
+
+    Returns None when this can't be known for sure, like when a service is
+    built locally or its image could not be resolved.
+
+    Parameters
+    ----------
+    document
+        The parsed compose file
+    image_ids
+        The local ID of each image, see `master_builder.images`
+    """
+
+    images = {}
+
+    for service in (document.get("services") or {}).values():
+        service = service or {}
+        image = service.get("image")
+
+        if "build" in service or not isinstance(image, str):
+            return None
+
+        if not (image_id := image_ids.get(image)):
+            return None
+
+        images[image] = image_id
+
+    payload = json.dumps(
+        {"compose": document, "images": images},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+
+    return f"sha256:{hashlib.sha256(payload.encode()).hexdigest()}"
@@ -0,0 +1,110 @@
+import re
+import shlex
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+
+from .errors import ErrorForUser
+from .pipeline import Step, run_steps
+from .reporting import run_command
+
+HOOK = re.compile(
+    r"(?:(?P<group>[\w.-]+)/)?(?P<service>[\w.-]+)(?:@(?P<mode>run|exec))?:"
+    r"(?P<command>.+)",
+    re.DOTALL,
+)
+
+
+@dataclass(frozen=True)
+class Hook:
+    """
+    A command to run in a service of the deployment, see `parse_hooks()`.
+
+    Parameters
+    ----------
+    service
+        The service to run it in
+    command
+        The command and its arguments
+    exec
+        Run it in the running container of the service rather than in a new
+        one
+    """
+
+    service: str
+    command: list[str]
+    exec: bool = False
+
+    def argv(self) -> list[str]:
+        if self.exec:
+            return ["docker", "compose", "exec", "-T", self.service, *self.command]
+
+        return ["docker", "compose", "run", "-T", "--rm", self.service, *self.command]
+
+
+def parse_hooks(commands: list[str], allow_exec: bool) -> list[list[Hook]]:
+    """
+    Parses commands in the `[GROUP/]SERVICE[@exec]:COMMAND` format into the
+    groups of hooks to run one after the other. Commands which share a group
+    name run at the same time, the group taking the place of its first
+    command. Other commands run alone.
+
+    Parameters
+    ----------
+    commands
+        The commands, as given on the command line
+    allow_exec
+        Whether commands may run in the existing containers, which only
+        exist after the deployment
+    """
+
+    groups: list[list[Hook]] = []
+    named: dict[str, list[Hook]] = {}
+
+    for text in commands:
+        if not (match := HOOK.fullmatch(text.strip())):
+            msg = (
+                f"Invalid command format: {text}, expected "
+                f"[<group>/]<service>[@exec]:<command>"
+            )
+            raise ErrorForUser(msg)
+
+        if match["mode"] == "exec" and not allow_exec:
+            msg = f"Can't exec {text}, the new containers don't run yet"
+            raise ErrorForUser(msg)
+
+        hook = Hook(
+            match["service"], shlex.split(match["command"]), match["mode"] == "exec"
+        )
+
+        if not match["group"]:
+            groups.append([hook])
+        elif match["group"] in named:
+            named[match["group"]].append(hook)
+        else:
+            groups.append(named.setdefault(match["group"], [hook]))
+
+    return groups
+
+
+def run_hooks(deploy_dir: Path, groups: list[list[Hook]]) -> None:
+    """
+    Runs groups of hooks one after the other, the hooks of a group at the
+    same time (see `run_steps()`). If a hook fails, the other hooks of its
+    group are interrupted and the next groups don't run.
+
+    Parameters
+    ----------
+    deploy_dir
+        The directory where the deployment is located
+    groups
+        The hooks, see `parse_hooks()`
+    """
+
+    for group in groups:
+        run_steps(
+            [
+                Step(f"{i}", partial(run_command, hook.argv(), cwd=deploy_dir))
+                for i, hook in enumerate(group)
+            ]
+        )
@@ -0,0 +1,212 @@
+import fcntl
+import re
+import shutil
+import sys
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+import rich_click as click
+from rich.console import Console
+
+from .config import Config
+from .docker_api import DockerClient
+from .errors import DockerApiError, ErrorForUser
+from .reporting import action, handle_fatal, run_detached, success
+from .state import iter_project_states
+
+console = Console(force_terminal=True)
+
+UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+@dataclass(frozen=True)
+class Budget:
+    """
+    How much disk space images may use: either a number of bytes for all
+    images, or a percentage of the filesystem holding Docker's data.
+    """
+
+    value: float
+    relative: bool
+
+    @classmethod
+    def parse(cls, text: str) -> "Budget":
+        """
+        Parses a budget like "80%", "50G" or "500M".
+
+        Parameters
+        ----------
+        text
+            The budget as the user wrote it
+        """
+
+        if m := re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*%\s*", text):
+            if not 0 < float(m[1]) <= 100:
+                msg = f"Invalid budget percentage: {text!r}"
+                raise ErrorForUser(msg)
+
+            return cls(value=float(m[1]) / 100, relative=True)
+
+        if m := re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)I?B?\s*", text.upper()):
+            return cls(value=float(m[1]) * UNITS[m[2]], relative=False)
+
+        msg = f"Invalid budget: {text!r}, expected something like 80% or 50G"
+        raise ErrorForUser(msg)
+
+    def excess(self, client: DockerClient, images_size: int) -> int:
+        """
+        Computes how many bytes should be freed to get back within budget.
+
+        Parameters
+        ----------
+        client
+            Docker client, to find out where Docker stores its data
+        images_size
+            Disk space currently used by all the images
+        """
+
+        if not self.relative:
+            return max(0, int(images_size - self.value))
+
+        usage = shutil.disk_usage(client.request("GET", "/info")["DockerRootDir"])
+        return max(0, int(usage.used - usage.total * self.value))
+
+
+def protected_images(keep_versions: int) -> tuple[set[str], dict[str, float]]:
+    """
+    Goes through the deploy history of all projects to find out which images
+    must be kept (the ones of the last `keep_versions` deployments of each
+    project) and when each known image was last deployed.
+
+    Parameters
+    ----------
+    keep_versions
+        Number of deployments to keep the images of, for each project
+    """
+
+    config = Config.instance()
+    protected = set()
+    last_used: dict[str, float] = {}
+
+    for _, state in iter_project_states(config.deployments_dir):
+        for i, record in enumerate(state.history):
+            for image in record.images:
+                last_used[image] = max(last_used.get(image, 0), record.deployed_at)
+
+                if i < keep_versions:
+                    protected.add(image)
+
+    return protected, last_used
+
+
+def eviction_candidates(
+    images: Iterable[dict],
+    protected: set[str],
+    last_used: dict[str, float],
+) -> list[dict]:
+    """
+    Lists the images that may be deleted, least recently deployed first.
+    Only images that Master Builder deployed are candidates: the others
+    (pulled or built by hand, used by other tools, etc) are not its to
+    delete.
+
+    Parameters
+    ----------
+    images
+        Images, as listed by the `/system/df` endpoint
+    protected
+        IDs of the images to keep no matter what
+    last_used
+        When each image was last deployed
+    """
+
+    candidates = [
+        image
+        for image in images
+        if image["Id"] in last_used
+        and image["Id"] not in protected
+        and not image.get("Containers")
+    ]
+
+    return sorted(candidates, key=lambda i: last_used[i["Id"]])
+
+
+def collect_garbage() -> None:
+    """
+    Deletes least recently used images until their disk usage is within the
+    configured budget. Only images from the deployment history are deleted,
+    and never those of the last deployments of each project nor those used
+    by containers.
+    """
+
+    config = Config.instance()
+    persisted = config.persisted
+    client = DockerClient.instance()
+    budget = Budget.parse(persisted.gc_budget)
+
+    df = client.request("GET", "/system/df")
+    excess = budget.excess(client, df.get("LayersSize", 0))
+
+    if not excess:
+        console.print("Images are within budget, nothing to do")
+        return
+
+    protected, last_used = protected_images(persisted.gc_keep_versions)
+    freed = 0
+
+    for image in eviction_candidates(df.get("Images") or [], protected, last_used):
+        if freed >= excess:
+            break
+
+        try:
+            client.request("DELETE", f"/images/{image['Id']}", {"force": "true"})
+        except DockerApiError as e:
+            console.print(f"[yellow]Could not delete {image['Id']}: {e.message}")
+            continue
+
+        shared = max(image.get("SharedSize", 0), 0)
+        freed += max(image.get("Size", 0) - shared, 0)
+        tags = ", ".join(image.get("RepoTags") or []) or image["Id"]
+        console.print(f"Deleted {tags}")
+
+    console.print(f"Freed about {freed / UNITS['M']:.0f} MiB")
+
+    if freed < excess:
+        console.print(
+            "[yellow]Still over budget, the remaining images are either recent "
+            "deployments or weren't deployed by Master Builder"
+        )
+
+
+def schedule_gc() -> None:
+    """
+    Runs the garbage collection in a detached process, so that deployments
+    don't have to wait for it. Its output goes to the GC log file.
+    """
+
+    config = Config.instance()
+    run_detached(
+        [sys.executable, "-m", "master_builder", "gc"],
+        log_file=config.gc_log_file,
+    )
+
+
+@click.command()
+@handle_fatal
+def gc():
+    """Delete old images when they use more disk than the budget."""
+
+    config = Config.instance()
+    config.gc_lock_file.parent.mkdir(parents=True, exist_ok=True)
+
+    with config.gc_lock_file.open("w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            success("Another garbage collection is already running.")
+            return
+
+        with action("Collecting unused images"):
+            collect_garbage()
+
+    success("Garbage collection done.")
@@ -0,0 +1,315 @@
+import base64
+import json
+import os
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+
+from rich.console import Console
+
+from .docker_api import DockerClient
+from .errors import DockerApiError, ErrorForUser, MasterBuilderError
+from .reporting import parallel_map, run_command
+
+console = Console(force_terminal=True)
+
+DOCKER_HUB = "docker.io"
+DOCKER_HUB_AUTH_KEY = "https://index.docker.io/v1/"
+RESOLVE_WORKERS = 16
+
+
+@dataclass(frozen=True)
+class ImageStatus:
+    """What we know about an image before deciding to pull it or not"""
+
+    image: str
+    remote_digest: str | None
+    local_digests: frozenset[str]
+    local_id: str | None
+
+    @property
+    def up_to_date(self) -> bool:
+        return bool(self.remote_digest) and self.remote_digest in self.local_digests
+
+
+def compose_images(document: Mapping) -> list[str]:
+    """
+    Lists the images that Docker Compose would pull for a compose file. Images
+    which can be built locally, are never pulled or depend on variable
+    interpolation are left to Compose (see `compose_left_to_pull()`).
+
+    Parameters
+    ----------
+    document
+        The parsed compose file
+    """
+
+    images = set()
+
+    for service in (document.get("services") or {}).values():
+        image = (service or {}).get("image")
+
+        if not isinstance(image, str) or "$" in image or "build" in service:
+            continue
+
+        if service.get("pull_policy") in ("never", "build"):
+            continue
+
+        images.add(image)
+
+    return sorted(images)
+
+
+def compose_left_to_pull(document: Mapping) -> dict[str, bool]:
+    """
+    Lists the services whose image Docker Compose has to pull itself, because
+    `compose_images()` leaves them out, and tells for each one whether it can
+    be built instead when its image isn't in a registry.
+
+    Parameters
+    ----------
+    document
+        The parsed compose file
+    """
+
+    left = {}
+
+    for name, service in (document.get("services") or {}).items():
+        service = service or {}
+        image = service.get("image")
+
+        if not isinstance(image, str):
+            continue
+
+        if service.get("pull_policy") in ("never", "build"):
+            continue
+
+        if "$" in image or "build" in service:
+            left[name] = "build" in service
+
+    return left
+
+
+def image_registry(image: str) -> str:
+    """
+    Extracts the registry of an image reference, following the same rules as
+    Docker (a first component with a dot, a port or "localhost" is a
+    registry, otherwise it's the Docker Hub).
+
+    Parameters
+    ----------
+    image
+        Reference of the image
+    """
+
+    first, sep, _ = image.partition("/")
+
+    if sep and ("." in first or ":" in first or first == "localhost"):
+        return first
+
+    return DOCKER_HUB
+
+
+def registry_auth(registry: str) -> str | None:
+    """
+    Builds the X-Registry-Auth header for a registry out of the credentials
+    that `docker login` stored in the Docker config file. Credential helpers
+    are not supported, in which case the registry will be queried
+    anonymously.
+
+    Parameters
+    ----------
+    registry
+        The registry host (as returned by `image_registry()`)
+    """
+
+    config_dir = Path(os.environ.get("DOCKER_CONFIG", Path.home() / ".docker"))
+
+    try:
+        auths = json.loads((config_dir / "config.json").read_text())["auths"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    key = DOCKER_HUB_AUTH_KEY if registry == DOCKER_HUB else registry
+    entry = auths.get(key) or auths.get(f"https://{key}") or {}
+
+    try:
+        username, password = base64.b64decode(entry["auth"]).decode().split(":", 1)
+    except (KeyError, ValueError):
+        return None
+
+    header = {"username": username, "password": password, "serveraddress": key}
+    return base64.urlsafe_b64encode(json.dumps(header).encode()).decode()
+
+
+def image_status(image: str) -> ImageStatus:
+    """
+    Compares the digest of an image in its registry with the local copy.
+
+    Parameters
+    ----------
+    image
+        Reference of the image
+    """
+
+    client = DockerClient.instance()
+
+    try:
+        remote = client.distribution_digest(image, registry_auth(image_registry(image)))
+    except MasterBuilderError:
+        remote = None
+
+    local = client.inspect_image(image) or {}
+    digests = frozenset(d.partition("@")[2] for d in local.get("RepoDigests") or [])
+
+    return ImageStatus(
+        image=image,
+        remote_digest=remote,
+        local_digests=digests,
+        local_id=local.get("Id"),
+    )
+
+
+def local_image_id(image: str) -> str | None:
+    """
+    Returns the ID of the local copy of an image, if there is one.
+
+    Parameters
+    ----------
+    image
+        Reference of the image
+    """
+
+    return (DockerClient.instance().inspect_image(image) or {}).get("Id")
+
+
+def local_image_ids(images: list[str]) -> dict[str, str | None]:
+    """
+    Returns the IDs of the local copies of several images at once, see
+    `local_image_id()`.
+
+    Parameters
+    ----------
+    images
+        References of the images
+    """
+
+    try:
+        ids = parallel_map(local_image_id, images, RESOLVE_WORKERS)
+    except DockerApiError as e:
+        msg = f"Could not inspect images: {e.message}"
+        raise ErrorForUser(msg) from None
+
+    return dict(zip(images, ids, strict=True))
+
+
+def _pull_through(image: str, cached: str) -> bool:
+    """
+    Pulls an image from a pull-through cache (where its reference is
+    `cached`) and tags it with its own reference. Returns whether it worked.
+    """
+
+    pulled = run_command(
+        ["docker", "pull", "--quiet", cached],
+        check=False,
+        capture=True,
+        quiet=True,
+    )
+
+    if pulled.returncode:
+        error = pulled.stderr.strip() or f"exit code {pulled.returncode}"
+        console.print(f"[yellow]Could not pull {image} through the cache: {error}")
+        return False
+
+    tagged = run_command(
+        ["docker", "tag", cached, image],
+        check=False,
+        capture=True,
+        quiet=True,
+    )
+
+    return not tagged.returncode
+
+
+def _pull(image: str, cached: str | None = None) -> str | None:
+    """
+    Pulls an image, returns the error output if it failed. When the image
+    has a reference in a pull-through cache, it's pulled from there first
+    and only pulled from its registry if the cache fails.
+    """
+
+    if cached and _pull_through(image, cached):
+        console.print(f"[blue]↓[/blue] {image} pulled through the cache")
+        return None
+
+    result = run_command(
+        ["docker", "pull", "--quiet", image],
+        check=False,
+        capture=True,
+        quiet=True,
+    )
+
+    if result.returncode:
+        return result.stderr.strip() or f"exit code {result.returncode}"
+
+    console.print(f"[blue]↓[/blue] {image} pulled")
+    return None
+
+
+def pull_images(
+    images: list[str],
+    workers: int,
+    cached: Mapping[str, str] | None = None,
+) -> dict[str, str | None]:
+    """
+    Makes sure the local copy of the images is the latest one. All digests
+    are resolved in parallel and only the images whose digest changed (or
+    could not be resolved) are pulled, with at most `workers` pulls at once.
+
+    Parameters
+    ----------
+    images
+        The images to pull
+    workers
+        Maximum number of concurrent pulls
+    cached
+        The reference of images in a pull-through cache, to pull them from
+        there (see `cache_references()`)
+
+    Returns
+    -------
+    The IDs of the local copies of the images, once up to date
+    """
+
+    if not images:
+        return {}
+
+    try:
+        statuses = parallel_map(image_status, images, RESOLVE_WORKERS)
+    except DockerApiError as e:
+        msg = f"Could not inspect images: {e.message}"
+        raise ErrorForUser(msg) from None
+
+    to_pull = []
+    image_ids = {}
+
+    for status in statuses:
+        if status.up_to_date:
+            console.print(f"[green]✓[/green] {status.image} is up to date")
+            image_ids[status.image] = status.local_id
+        else:
+            to_pull.append(status.image)
+
+    if not to_pull:
+        return image_ids
+
+    cached = cached or {}
+    results = parallel_map(lambda i: _pull(i, cached.get(i)), to_pull, workers)
+    errors = dict(zip(to_pull, results, strict=True))
+
+    if failed := {i: e for i, e in errors.items() if e}:
+        lines = [f"- {i}: {e}" for i, e in failed.items()]
+        msg = "\n".join(["Could not pull images:", *lines])
+        raise ErrorForUser(msg)
+
+    return {**image_ids, **local_image_ids(to_pull)}
@@ -1,105 +1,31 @@
+from hashlib import sha256
+from pathlib import Path
+
 import rich_click as click
 from rich.console import Console
 
 from .config import Config
+from .docker_api import DockerClient, compose_project_name
 from .errors import ErrorForUser
+from .files import atomic_write_text
 from .reporting import action, handle_fatal, run_command, success
+from .tracing import tracing
+from .traefik import (
+    TRAEFIK_DYNAMIC_DIR,
+    TRAEFIK_NETWORK,
+    AcmeHttps,
+    StaticHttps,
+    TraefikProfile,
+    render_compose,
+)
 
 console = Console()
 
 
-TRAEFIK_COMPOSE_HTTP = """---
-services:
-  traefik:
-    image: traefik:v3.1
-    restart: always
-    command:
-      - "--api.insecure=true"
-      - "--providers.docker=true"
-      - "--providers.docker.exposedbydefault=false"
-      - "--entrypoints.web.address=:80"
-    ports:
-      - "80:80"
-    volumes:
-      - "/var/run/docker.sock:/var/run/docker.sock:ro"
-    labels:
-      - "traefik.enable=true"
-      - "traefik.http.routers.traefik.rule=Host(`traefik.localhost`)"
-      - "traefik.http.routers.traefik.service=api@internal"
-
-networks:
-  default:
-    name: traefik
-    external: true
-"""
-
-
-TRAEFIK_COMPOSE_HTTPS = """---
-services:
-  traefik:
-    image: traefik:v3.1
-    restart: always
-    command:
-      - "--api.insecure=true"
-      - "--providers.docker=true"
-      - "--providers.docker.exposedbydefault=false"
-      - "--entrypoints.web.address=:80"
-      - "--entrypoints.websecure.address=:443"
-      - "--entrypoints.web.http.redirections.entryPoint.to=websecure"
-      - "--entrypoints.web.http.redirections.entryPoint.scheme=https"
-      - "--certificatesresolvers.masterBuilder.acme.tlschallenge=true"
-      - "--certificatesresolvers.masterBuilder.acme.email={ssl_contact}"
-      - "--certificatesresolvers.masterBuilder.acme.storage=/letsencrypt/acme.json"
-    ports:
-      - "80:80"
-      - "443:443"
-    volumes:
-      - "/var/run/docker.sock:/var/run/docker.sock:ro"
-      - "{letsencrypt_dir}:/letsencrypt"
-    labels:
-      - "traefik.enable=true"
-      - "traefik.http.routers.traefik.rule=Host(`traefik.localhost`)"
-      - "traefik.http.routers.traefik.service=api@internal"
-
-networks:
-  default:
-    name: traefik
-    external: true
-"""
-
-TRAEFIK_COMPOSE_HTTPS_STATIC = """
-services:
-  traefik:
-    image: traefik:v3.1
-    restart: always
-    command:
-      - "--api.insecure=true"
-      - "--providers.docker=true"
-      - "--providers.docker.exposedbydefault=false"
-      - "--entrypoints.web.address=:80"
-      - "--entrypoints.websecure.address=:443"
-      - "--providers.file.directory=/etc/traefik/dynamic/"
-      - "--providers.file.watch=true"
-    ports:
-      - "80:80"
-      - "443:443"
-    volumes:
-      - "/var/run/docker.sock:/var/run/docker.sock:ro"
-      - "{cert_file}:/etc/traefik/ssl/default.crt:ro"
-      - "{key_file}:/etc/traefik/ssl/default.key:ro"
-      - "{dynamic_file}:/etc/traefik/dynamic/dynamic.yaml:ro"
-    labels:
-      - "traefik.enable=true"
-      - "traefik.http.routers.traefik.rule=Host(`traefik.localhost`)"
-      - "traefik.http.routers.traefik.service=api@internal"
-      - "traefik.http.routers.traefik.entrypoints=websecure"
-      - "traefik.http.routers.traefik.tls=true"
-
-networks:
-  default:
-    name: traefik
-    external: true
-"""
+INGRESS_FINGERPRINT_FILE = ".fingerprint"
+# Where older versions put the dynamic configuration, before it got its own
+# directory (see `Config.traefik_dynamic_dir`)
+LEGACY_DYNAMIC_FILE = "dynamic.yaml"
 
 TRAEFIK_DYNAMIC_FILE = """
 tls:
@@ -114,26 +40,32 @@ tls:
 def generate_compose() -> str:
     config = Config.instance()
     persisted = config.persisted
+    profile = TraefikProfile.resolve(
+        persisted.traefik_profile,
+        persisted.traefik_options,
+    )
 
     config.letsencrypt_dir.mkdir(parents=True, exist_ok=True)
+    config.traefik_dynamic_dir.mkdir(parents=True, exist_ok=True)
 
     if persisted.enable_https:
         if persisted.ssl_contact:
-            return TRAEFIK_COMPOSE_HTTPS.format(
-                ssl_contact=persisted.ssl_contact,
-                letsencrypt_dir=config.letsencrypt_dir,
+            return render_compose(
+                profile,
+                AcmeHttps(persisted.ssl_contact, config.letsencrypt_dir),
+                config.traefik_dynamic_dir,
             )
         elif persisted.ssl_key and persisted.ssl_cert:
-            return TRAEFIK_COMPOSE_HTTPS_STATIC.format(
-                cert_file=persisted.ssl_cert,
-                key_file=persisted.ssl_key,
-                dynamic_file=config.traefik_dynamic_file,
+            return render_compose(
+                profile,
+                StaticHttps(persisted.ssl_cert, persisted.ssl_key),
+                config.traefik_dynamic_dir,
             )
         else:
             msg = "Invalid configuration"
             raise ErrorForUser(msg)
     else:
-        return TRAEFIK_COMPOSE_HTTP
+        return render_compose(profile, None, config.traefik_dynamic_dir)
 
 
 def ensure_traefik_compose():
@@ -159,17 +91,50 @@ def ensure_traefik_compose():
             compose_file.write_text(expected_content)
 
 
+def generate_dynamic() -> str | None:
+    """
+    Returns the content of the Traefik dynamic configuration file, or None if
+    there must be no such file.
+    """
+
+    persisted = Config.instance().persisted
+
+    if persisted.enable_https and persisted.ssl_cert:
+        return TRAEFIK_DYNAMIC_FILE
+
+    return None
+
+
+def ingress_fingerprint() -> str:
+    """
+    Identifies the desired state of the ingress: its compose file, its
+    dynamic configuration and its network.
+    """
+
+    digest = sha256()
+
+    for part in (generate_compose(), generate_dynamic() or "", TRAEFIK_NETWORK):
+        digest.update(part.encode())
+        digest.update(b"\0")
+
+    return digest.hexdigest()
+
+
 def ensure_traefik_dynamic():
     """
-    Ensures that the Traefik dynamic configuration file exists.
+    Ensures that the Traefik dynamic configuration file exists, and removes
+    the one that older versions wrote elsewhere.
     """
 
     config = Config.instance()
-    persisted = config.persisted
     dynamic_file = config.traefik_dynamic_file
-    need_dynamic = persisted.enable_https and persisted.ssl_cert
+    legacy_file = config.ingress_dir / LEGACY_DYNAMIC_FILE
 
-    if not need_dynamic:
+    if legacy_file.exists():
+        with action("Deleting outdated Traefik dynamic configuration file"):
+            legacy_file.unlink()
+
+    if (expected_content := generate_dynamic()) is None:
         if dynamic_file.exists():
             with action("Deleting Traefik dynamic configuration file"):
                 dynamic_file.unlink()
@@ -181,8 +146,6 @@ def ensure_traefik_dynamic():
     if dynamic_file.exists():
         existing_content = dynamic_file.read_text()
 
-    expected_content = TRAEFIK_DYNAMIC_FILE
-
     if existing_content != expected_content:
         verb = "Updating" if dynamic_file.exists() else "Creating"
 
@@ -196,17 +159,39 @@ def is_running() -> bool:
     """
 
     ingress_dir = Config.instance().ingress_dir
-    ensure_traefik_compose()
 
-    result = run_command(
-        ["docker", "compose", "ps", "--services", "--filter", "status=running"],
-        cwd=ingress_dir,
-        check=False,
-        capture=True,
-        quiet=True,
+    containers = DockerClient.instance().project_containers(
+        compose_project_name(ingress_dir),
+        service="traefik",
+        status=["running"],
+    )
+
+    return bool(containers)
+
+
+def running_features() -> tuple[bool, bool]:
+    """
+    Tells what the running Traefik ingress supports, since its configuration
+    only changes when it gets restarted: whether it reads the dynamic
+    configuration directory (required to shift traffic, see `traffic.py`)
+    and whether it exposes Prometheus metrics.
+    """
+
+    ingress_dir = Config.instance().ingress_dir
+    containers = DockerClient.instance().project_containers(
+        compose_project_name(ingress_dir),
+        service="traefik",
+        status=["running"],
     )
 
-    return "traefik" in result.stdout
+    if not containers:
+        return False, False
+
+    container = containers[0]
+    mounts = {m.get("Destination") for m in container.get("Mounts") or []}
+    command = container.get("Command") or ""
+
+    return TRAEFIK_DYNAMIC_DIR in mounts, "--metrics.prometheus=true" in command
 
 
 def ensure_network() -> None:
@@ -214,28 +199,35 @@ def ensure_network() -> None:
     Ensures that the network for Traefik exists.
     """
 
-    exists = (
-        run_command(
-            ["docker", "network", "ls", "--format", "{{.Name}}"],
-            check=False,
-            capture=True,
-            quiet=True,
-        )
-        .stdout.strip()
-        .split("\n")
-    )
+    networks = DockerClient.instance().networks(names=[TRAEFIK_NETWORK])
 
-    if "traefik" not in exists:
+    if not any(n["Name"] == TRAEFIK_NETWORK for n in networks):
         with action("Creating Traefik network"):
-            run_command(["docker", "network", "create", "traefik"])
+            run_command(["docker", "network", "create", TRAEFIK_NETWORK])
 
 
 def start_ingress():
     """
     Start the Traefik ingress. This function is idempotent.
+
+    Once everything is in place, the fingerprint of the ingress (see
+    `ingress_fingerprint()`) is stored. Subsequent calls then only have to
+    check that Traefik is still running, as long as the desired state did
+    not change.
     """
 
     ingress_dir = Config.instance().ingress_dir
+    fingerprint_file = ingress_dir / INGRESS_FINGERPRINT_FILE
+    fingerprint = ingress_fingerprint()
+
+    try:
+        reconciled = fingerprint_file.read_text() == fingerprint
+    except FileNotFoundError:
+        reconciled = False
+
+    if reconciled and is_running():
+        return
+
     ensure_traefik_compose()
     ensure_traefik_dynamic()
     ensure_network()
@@ -244,6 +236,8 @@ def start_ingress():
         with action("Starting Traefik ingress"):
             run_command(["docker", "compose", "up", "-d"], cwd=ingress_dir)
 
+    atomic_write_text(fingerprint_file, fingerprint)
+
 
 def stop_ingress():
     """
@@ -259,9 +253,19 @@ def stop_ingress():
 
 
 @click.group()
-def ingress():
+@click.option(
+    "--trace-file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help=(
+        "Write the timing of each step and command to this file, in the Chrome "
+        "trace format (open it with https://ui.perfetto.dev)"
+    ),
+)
+@click.pass_context
+def ingress(ctx: click.Context, trace_file: Path | None):
     """Manage the Traefik ingress."""
-    pass
+
+    ctx.with_resource(tracing(trace_file))
 
 
 @ingress.command()
@@ -295,6 +299,7 @@ def update():
 
     ingress_dir = Config.instance().ingress_dir
     ensure_traefik_compose()
+    ensure_traefik_dynamic()
 
     with action("Pulling latest Traefik image"):
         run_command(["docker", "compose", "pull"], cwd=ingress_dir)
@@ -1,10 +1,13 @@
 import re
+from urllib.parse import urlsplit
 
 import rich_click as click
 
 from .config import Config, PersistedConfig
 from .errors import ErrorForUser
+from .image_gc import Budget
 from .reporting import handle_fatal, success
+from .traefik import PRESETS, TraefikProfile
 
 
 def validate_email(email):
@@ -27,6 +30,25 @@ def validate_email(email):
         return False
 
 
+def parse_options(options: tuple[str, ...]) -> dict[str, str]:
+    """
+    Parses KEY=VALUE options into a dictionary.
+    """
+
+    out = {}
+
+    for option in options:
+        key, sep, value = option.partition("=")
+
+        if not sep or not key.strip():
+            msg = f"Invalid option {option!r}, expected KEY=VALUE."
+            raise ErrorForUser(msg)
+
+        out[key.strip()] = value.strip()
+
+    return out
+
+
 @click.command()
 @click.option(
     "--ssl-contact",
@@ -45,12 +67,83 @@ def validate_email(email):
     is_flag=True,
     help="Enable HTTPS for the project. If yes, --ssl-contact is required.",
 )
+@click.option(
+    "--gc-keep-versions",
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help="Number of deployments of each project whose images are never deleted",
+)
+@click.option(
+    "--gc-budget",
+    default="80%",
+    show_default=True,
+    help=(
+        "Disk space above which old images get deleted, either for all images "
+        "(like 50G) or as a usage of the disk holding Docker's data (like 80%)"
+    ),
+)
+@click.option(
+    "--traefik-profile",
+    type=click.Choice(list(PRESETS)),
+    default="default",
+    show_default=True,
+    help="Preset of performance settings for the Traefik ingress",
+)
+@click.option(
+    "--traefik-option",
+    "traefik_options",
+    multiple=True,
+    metavar="KEY=VALUE",
+    help=(
+        "Overrides a setting of the Traefik profile, like http3=false or "
+        "max_idle_conns_per_host=64 (can be repeated)"
+    ),
+)
+@click.option(
+    "--registry-cache",
+    metavar="UPSTREAM",
+    default="",
+    help=(
+        "Run a local pull-through cache of this registry (like "
+        "https://registry-1.docker.io for the Docker Hub) and pull its images "
+        "through it when deploying"
+    ),
+)
+@click.option(
+    "--registry-cache-port",
+    type=click.IntRange(min=1, max=65535),
+    default=5000,
+    show_default=True,
+    help="Port of the registry cache, which only listens on 127.0.0.1",
+)
 @handle_fatal
-def init(ssl_contact: str, enable_https: bool, ssl_key: str, ssl_cert: str):
+def init(
+    ssl_contact: str,
+    enable_https: bool,
+    ssl_key: str,
+    ssl_cert: str,
+    gc_keep_versions: int,
+    gc_budget: str,
+    traefik_profile: str,
+    traefik_options: tuple[str, ...],
+    registry_cache: str,
+    registry_cache_port: int,
+):
     """Registers static values that are required for the project to work."""
 
     config = Config.instance(no_init_required=True)
     extra = {}
+    Budget.parse(gc_budget)
+    overrides = parse_options(traefik_options)
+    TraefikProfile.resolve(traefik_profile, overrides)
+
+    if registry_cache:
+        upstream = urlsplit(registry_cache)
+
+        if upstream.scheme not in ("http", "https") or not upstream.netloc:
+            msg = f"Invalid registry URL: {registry_cache!r}, expected http(s)://host"
+            raise ErrorForUser(msg)
 
     if enable_https:
         has_contact = bool(ssl_contact)
@@ -89,6 +182,12 @@ def init(ssl_contact: str, enable_https: bool, ssl_key: str, ssl_cert: str):
     config.persisted = PersistedConfig(
         init_done=True,
         enable_https=enable_https,
+        gc_keep_versions=gc_keep_versions,
+        gc_budget=gc_budget,
+        traefik_profile=traefik_profile,
+        traefik_options=overrides,
+        registry_cache=registry_cache.rstrip("/"),
+        registry_cache_port=registry_cache_port,
         **extra,
     )
 
@@ -0,0 +1,113 @@
+import fcntl
+import json
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from rich.console import Console
+
+from .config import Config
+
+console = Console(force_terminal=True)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+class DeployQueue:
+    """
+    Serializes the deployments of a project, while making sure that when
+    several of them pile up only the most recent one runs.
+
+    Each deployment takes a ticket (an increasing number, stored along with
+    the PID of its owner) and then waits for the project's lock. Once it gets
+    the lock, a deployment that sees a more recent ticket knows that it has
+    been superseded and steps aside, unless the owner of that ticket died in
+    the meantime.
+
+    Locks are per project, so different projects still deploy in parallel.
+
+    Parameters
+    ----------
+    project_name
+        Name of the project
+    """
+
+    def __init__(self, project_name: str):
+        locks_dir = Config.instance().locks_dir
+        self.project_name = project_name
+        self.lock_file = locks_dir / f"{project_name}.lock"
+        self.ticket_file = locks_dir / f"{project_name}.ticket"
+
+    def take_ticket(self) -> int:
+        """
+        Registers a new deployment in the queue and returns its ticket
+        """
+
+        self.ticket_file.parent.mkdir(parents=True, exist_ok=True)
+
+        with self.ticket_file.open("a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            ticket = _parse_ticket(f.read())[0] + 1
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps({"ticket": ticket, "pid": os.getpid()}))
+
+        return ticket
+
+    def superseded(self, ticket: int) -> bool:
+        """
+        Tells if a more recent deployment is waiting to run after this one.
+
+        Parameters
+        ----------
+        ticket
+            Ticket of the deployment
+        """
+
+        try:
+            latest, pid = _parse_ticket(self.ticket_file.read_text())
+        except FileNotFoundError:
+            return False
+
+        return latest > ticket and _pid_alive(pid)
+
+    @contextmanager
+    def turn(self) -> Iterator[bool]:
+        """
+        Waits for the deployments of the project that are running to finish,
+        then tells if this deployment should go on (True) or if it was
+        superseded by a more recent one (False). The lock is held until the
+        end of the context.
+        """
+
+        ticket = self.take_ticket()
+
+        with self.lock_file.open("w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                console.print(
+                    f"Another deployment of {self.project_name} is running, "
+                    "waiting for it to finish"
+                )
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            yield not self.superseded(ticket)
+
+
+def _parse_ticket(content: str) -> tuple[int, int]:
+    try:
+        data = json.loads(content)
+        return int(data["ticket"]), int(data["pid"])
+    except (ValueError, KeyError, TypeError):
+        return 0, 0
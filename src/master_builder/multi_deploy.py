@@ -0,0 +1,222 @@
+import gzip
+import shlex
+import subprocess
+import sys
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+import rich_click as click
+from rich.console import Console
+from rich.text import Text
+
+from .config import Config
+from .errors import ErrorForUser
+from .reporting import handle_fatal, parallel_map, success
+
+console = Console(force_terminal=True)
+
+CONTROL_PERSIST = "120"
+HOST_STYLES = ["cyan", "magenta", "green", "yellow", "blue", "red"]
+
+
+@dataclass(frozen=True)
+class Remote:
+    """
+    How to reach the hosts and run Master Builder on them.
+
+    Parameters
+    ----------
+    ssh
+        The SSH client and its own options
+    control_dir
+        Where the sockets of the shared SSH connections go
+    command
+        How to run Master Builder on the hosts
+    """
+
+    ssh: list[str]
+    control_dir: Path
+    command: str
+
+    def ssh_options(self) -> list[str]:
+        return [
+            "-o",
+            f"ControlPath={self.control_dir}/%C",
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPersist={CONTROL_PERSIST}",
+        ]
+
+    def connect(self, host: str) -> None:
+        """
+        Opens the shared connection to a host, unless there is one already.
+        It's started in the background by SSH itself and then reused by the
+        next commands (and deployments) for a while, saving the handshake.
+        The master is started on its own, as it would otherwise keep the
+        output of the first command open.
+
+        Parameters
+        ----------
+        host
+            The SSH destination
+        """
+
+        subprocess.run(
+            [*self.ssh, *self.ssh_options(), "-f", "-N", host],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=False,
+        )
+
+    def deploy(self, host: str, args: list[str], payload: bytes, prefix: Text) -> int:
+        """
+        Runs the deployment on a host and prints its output line by line,
+        each line prefixed with the host. Returns the exit code.
+
+        Parameters
+        ----------
+        host
+            The SSH destination
+        args
+            Arguments of the remote `deploy` command
+        payload
+            What goes to its stdin (the compose file, maybe compressed)
+        prefix
+            Printed before each line of output
+        """
+
+        remote = f"{self.command} deploy {shlex.join(args)}"
+
+        with subprocess.Popen(
+            [*self.ssh, *self.ssh_options(), host, remote],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        ) as process:
+            try:
+                feeder = threading.Thread(target=_feed, args=(process, payload))
+                feeder.start()
+
+                for line in process.stdout or []:
+                    text = Text.from_ansi(line.decode("utf-8", "replace").rstrip())
+                    console.print(Text.assemble(prefix, " ", text))
+
+                feeder.join()
+            except BaseException:
+                process.kill()
+                raise
+
+        return process.returncode
+
+
+def _feed(process: subprocess.Popen, payload: bytes) -> None:
+    try:
+        if process.stdin:
+            process.stdin.write(payload)
+            process.stdin.close()
+    except BrokenPipeError:
+        pass
+
+
+def _read_payload(compress: bool) -> bytes:
+    if not (content := sys.stdin.buffer.read()):
+        msg = "The content of docker-compose.yml is expected on stdin."
+        raise ErrorForUser(msg)
+
+    return gzip.compress(content) if compress else content
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.option(
+    "--host",
+    "hosts",
+    multiple=True,
+    required=True,
+    metavar="DESTINATION",
+    help="Host to deploy to, as given to SSH (user@host, ssh://user@host:port)",
+)
+@click.option(
+    "--parallel",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Maximum number of hosts deploying at the same time",
+)
+@click.option(
+    "--canary",
+    is_flag=True,
+    help="Deploy to the first host alone, and to the others only if it worked",
+)
+@click.option(
+    "--remote-command",
+    default="master-builder",
+    show_default=True,
+    help="How to run Master Builder on the hosts",
+)
+@click.option(
+    "--ssh",
+    "ssh_command",
+    default="ssh",
+    show_default=True,
+    help="The SSH client, with its options (like 'ssh -i key' or a stand-in)",
+)
+@click.option(
+    "--compress",
+    is_flag=True,
+    help=(
+        "Send the compose file compressed with gzip, which the hosts only "
+        "understand from the version of Master Builder which added this command"
+    ),
+)
+@click.argument("project_name")
+@click.argument("deploy_args", nargs=-1, type=click.UNPROCESSED)
+@handle_fatal
+def multi_deploy(
+    hosts: tuple[str, ...],
+    parallel: int,
+    canary: bool,
+    remote_command: str,
+    ssh_command: str,
+    compress: bool,
+    project_name: str,
+    deploy_args: tuple[str, ...],
+):
+    """
+    Deploy a project to several hosts over SSH, reading the compose file from
+    stdin. Extra arguments go to the deploy command of each host.
+    """
+
+    payload = _read_payload(compress)
+    control_dir = Config().ssh_control_dir
+    control_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    remote = Remote(shlex.split(ssh_command), control_dir, remote_command)
+    args = [*deploy_args, project_name]
+    hosts = tuple(dict.fromkeys(hosts))
+    width = max(len(h) for h in hosts)
+
+    def deploy_to(host: str) -> int:
+        style = HOST_STYLES[hosts.index(host) % len(HOST_STYLES)]
+        prefix = Text(f"{host:<{width}} |", style=style)
+        remote.connect(host)
+        return remote.deploy(host, args, payload, prefix)
+
+    codes = {}
+
+    if canary:
+        codes[hosts[0]] = deploy_to(hosts[0])
+
+        if codes[hosts[0]]:
+            msg = f"Deployment failed on the canary host {hosts[0]}, stopping there"
+            raise ErrorForUser(msg)
+
+    rest = [h for h in hosts if h not in codes]
+    codes.update(zip(rest, parallel_map(deploy_to, rest, parallel), strict=True))
+
+    if failed := [h for h, code in codes.items() if code]:
+        msg = f"Deployment of {project_name} failed on: {', '.join(failed)}"
+        raise ErrorForUser(msg)
+
+    success(f"Deployment of {project_name} completed on {len(hosts)} hosts.")
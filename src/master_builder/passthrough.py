@@ -0,0 +1,40 @@
+import os
+import sys
+
+from .config import Config
+from .state import current_deployment
+
+
+def compose_passthrough(args: list[str]) -> None:
+    """
+    Fast path for `master-builder compose <project> [args]`, which replaces
+    the current process by `docker compose` running in the project's current
+    deployment. This avoids loading click, rich and friends, which matters
+    when this is called in a loop by monitoring scripts.
+
+    Returns (without doing anything) when the arguments are not a plain
+    passthrough, like `compose --help`, in which case the regular CLI must
+    handle them.
+
+    Parameters
+    ----------
+    args
+        The arguments that follow `compose` on the command line
+    """
+
+    if not args or args[0].startswith("-"):
+        return
+
+    project_name, *compose_args = args
+
+    if compose_args[:1] == ["--"]:
+        compose_args = compose_args[1:]
+
+    config = Config.instance(no_init_required=True)
+
+    if not (current_deploy := current_deployment(config.project_dir(project_name))):
+        sys.stderr.write(f"Error: No deployments found for project {project_name}\n")
+        sys.exit(1)
+
+    os.chdir(current_deploy)
+    os.execvp("docker", ["docker", "compose", *compose_args])  # noqa: S606
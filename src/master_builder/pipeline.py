@@ -0,0 +1,107 @@
+import threading
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from dataclasses import dataclass
+from typing import Any
+
+from .reporting import cancellable, console
+
+
+@dataclass(frozen=True)
+class Step:
+    """
+    A step of a pipeline, see `run_steps()`.
+
+    Parameters
+    ----------
+    name
+        Identifies the step among the others
+    run
+        Does the work, its return value is the result of the step
+    after
+        Names of the steps which must be done before this one starts
+    critical
+        If the step fails, the whole pipeline fails. Otherwise the failure is
+        only reported and the result of the step is None.
+    shielded
+        The commands of the step are not killed when another step fails, it
+        runs to completion. For steps which would leave things half done.
+    """
+
+    name: str
+    run: Callable[[], object]
+    after: tuple[str, ...] = ()
+    critical: bool = True
+    shielded: bool = False
+
+
+def run_steps(steps: list[Step]) -> dict[str, Any]:
+    """
+    Runs steps in threads, each one as soon as the steps it comes after are
+    done, so that independent steps overlap. Returns the result of each step
+    by name.
+
+    When a critical step fails, no other step starts and the commands of the
+    running ones are killed (see `cancellable()`), except for shielded steps.
+    Once they all stopped, the error of the failed step is raised.
+
+    The threads run in a copy of the caller's context, so that their output
+    goes to the same place (see `parallel_map()`).
+
+    Parameters
+    ----------
+    steps
+        The steps, each one listed after the steps it comes after
+    """
+
+    seen: set[str] = set()
+
+    for step in steps:
+        if unknown := set(step.after) - seen:
+            msg = f"Step {step.name} comes after unknown steps: {', '.join(unknown)}"
+            raise ValueError(msg)
+
+        seen.add(step.name)
+
+    pending = list(steps)
+    results: dict[str, Any] = {}
+    running: dict[Future, Step] = {}
+    cancel = threading.Event()
+    context = copy_context()
+
+    with ThreadPoolExecutor(max(1, len(steps))) as pool:
+        try:
+            while pending or running:
+                for step in [s for s in pending if set(s.after) <= results.keys()]:
+                    pending.remove(step)
+                    future = pool.submit(context.copy().run, _run, step, cancel)
+                    running[future] = step
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    step = running.pop(future)
+                    results[step.name] = _result(future, step)
+        except BaseException:
+            cancel.set()
+            wait(running)
+            raise
+
+    return results
+
+
+def _run(step: Step, cancel: threading.Event) -> object:
+    with cancellable(threading.Event() if step.shielded else cancel):
+        return step.run()
+
+
+def _result(future: Future, step: Step) -> object:
+    try:
+        return future.result()
+    except Exception as e:
+        if step.critical:
+            raise
+
+        console.print(f"[yellow]{step.name} failed, moving on: {e}")
+        return None
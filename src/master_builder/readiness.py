@@ -0,0 +1,247 @@
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from rich.console import Console
+
+from .docker_api import COMPOSE_PROJECT_LABEL, COMPOSE_SERVICE_LABEL, DockerClient
+from .errors import ErrorForUser
+from .reporting import parallel_map
+
+console = Console(force_terminal=True)
+
+READY_TIMEOUT_LABEL = "master-builder.ready-timeout"
+INSPECT_WORKERS = 8
+
+READY = "ready"
+WAITING = "waiting"
+FAILED = "failed"
+
+
+@dataclass
+class _Service:
+    """Readiness tracking of all the containers of one service"""
+
+    name: str
+    deadline: float
+    states: dict[str, str] = field(default_factory=dict)
+    details: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.states) and all(s == READY for s in self.states.values())
+
+    @property
+    def failed(self) -> bool:
+        return any(s == FAILED for s in self.states.values())
+
+
+def container_readiness(info: dict) -> tuple[str, str]:
+    """
+    Tells if a container is ready, based on its inspection. Containers with a
+    health check must be healthy, the others must simply be running. A
+    container that exited successfully is considered done (that's a one-off
+    job), while one that crashed without being restarted is a failure.
+
+    Parameters
+    ----------
+    info
+        Output of the container inspection
+
+    Returns
+    -------
+    The readiness (READY, WAITING or FAILED) and a human-readable status
+    """
+
+    state = info.get("State") or {}
+    status = state.get("Status", "unknown")
+    health = (state.get("Health") or {}).get("Status")
+
+    if status == "exited" and not state.get("Restarting"):
+        code = state.get("ExitCode", 0)
+
+        if code == 0:
+            return READY, "exited successfully"
+
+        return FAILED, f"exited with code {code}"
+
+    if status == "dead":
+        return FAILED, "dead"
+
+    if health:
+        return (READY if health == "healthy" else WAITING), health
+
+    return (READY if status == "running" else WAITING), status
+
+
+def _service_timeout(container: dict, default_timeout: float) -> float:
+    value = (container.get("Labels") or {}).get(READY_TIMEOUT_LABEL)
+
+    if value is None:
+        return default_timeout
+
+    try:
+        return float(value)
+    except ValueError:
+        msg = f"Invalid {READY_TIMEOUT_LABEL} label: {value!r}"
+        raise ErrorForUser(msg) from None
+
+
+class ReadinessWatcher:
+    """
+    Follows the readiness of all the containers of a compose project (see
+    `container_readiness()`). Rather than polling, this follows the Docker
+    events stream and re-inspects a container only when something happens to
+    it, so that we move on as soon as the last one is ready.
+
+    Each service has its own timeout, which is `default_timeout` unless the
+    service has a `master-builder.ready-timeout` label (in seconds).
+
+    Parameters
+    ----------
+    project
+        Name of the compose project
+    default_timeout
+        Number of seconds each service has to become ready
+    """
+
+    def __init__(self, project: str, default_timeout: float):
+        self.project = project
+        self.client = DockerClient.instance()
+        self.start = time.time()
+        self.services: dict[str, _Service] = {}
+        self.owners: dict[str, _Service] = {}
+
+        for container in self.client.project_containers(project, all_states=True):
+            labels = container.get("Labels") or {}
+            name = labels.get(COMPOSE_SERVICE_LABEL, container["Id"])
+
+            if name not in self.services:
+                deadline = self.start + _service_timeout(container, default_timeout)
+                self.services[name] = _Service(name=name, deadline=deadline)
+
+            self.owners[container["Id"]] = self.services[name]
+
+    def refresh(self, container_id: str) -> bool:
+        """
+        Re-inspects a container and tells if its service changed state
+
+        Parameters
+        ----------
+        container_id
+            ID of the container to inspect
+        """
+
+        service = self.owners[container_id]
+        before = (service.ready, service.failed)
+        info = self.client.inspect_container(container_id)
+        readiness, detail = container_readiness(info)
+        service.states[container_id] = readiness
+        service.details[container_id] = detail
+
+        if service.ready and not before[0]:
+            console.print(f"[green]✓[/green] {service.name} is ready")
+
+        return (service.ready, service.failed) != before
+
+    def pending(self) -> list[_Service]:
+        """
+        Returns the services that are not ready yet, and raises if some of
+        them failed or ran out of time.
+        """
+
+        pending = [s for s in self.services.values() if not s.ready]
+
+        if failed := [s for s in pending if s.failed]:
+            _give_up(failed, "failed")
+
+        if expired := [s for s in pending if s.deadline <= time.time()]:
+            _give_up(expired, "did not become ready in time")
+
+        return pending
+
+    def wait(self) -> None:
+        """
+        Blocks until all the services are ready, raises an ErrorForUser if
+        it's not going to happen.
+        """
+
+        for container_id in self.owners:
+            self.refresh(container_id)
+
+        since = self.start
+
+        while pending := self.pending():
+            until = min(s.deadline for s in pending)
+            events = self.client.events(
+                {
+                    "type": ["container"],
+                    "label": [f"{COMPOSE_PROJECT_LABEL}={self.project}"],
+                },
+                since=since,
+                until=until,
+                timeout=until - time.time() + 5,
+            )
+
+            for event in events:
+                since = event.get("timeNano", since * 1e9) / 1e9
+
+                # Health checks are exec'd in the container, which is noise
+                if event.get("Action", "").startswith("exec_"):
+                    continue
+
+                if event.get("id") in self.owners and self.refresh(event["id"]):
+                    break
+
+
+def wait_until_ready(project: str, default_timeout: float) -> None:
+    """
+    Waits for all the containers of a compose project to be ready, see
+    `ReadinessWatcher`.
+
+    Parameters
+    ----------
+    project
+        Name of the compose project
+    default_timeout
+        Number of seconds each service has to become ready
+    """
+
+    ReadinessWatcher(project, default_timeout).wait()
+
+
+def project_ready(project: str, services: Iterable[str]) -> bool:
+    """
+    Tells, without waiting, if a compose project runs all the given services
+    and if all its containers are ready (see `container_readiness()`).
+
+    Parameters
+    ----------
+    project
+        Name of the compose project
+    services
+        Names of the services that must be there
+    """
+
+    client = DockerClient.instance()
+    containers = client.project_containers(project, all_states=True)
+    present = {(c.get("Labels") or {}).get(COMPOSE_SERVICE_LABEL) for c in containers}
+
+    if not containers or not set(services) <= present:
+        return False
+
+    infos = parallel_map(
+        lambda c: client.inspect_container(c["Id"]),
+        containers,
+        INSPECT_WORKERS,
+    )
+
+    return all(container_readiness(info)[0] == READY for info in infos)
+
+
+def _give_up(services: list[_Service], reason: str) -> None:
+    lines = [
+        f"- {s.name}: " + ", ".join(sorted(set(s.details.values()))) for s in services
+    ]
+    msg = "\n".join([f"Some services {reason}:", *lines])
+    raise ErrorForUser(msg)
@@ -0,0 +1,313 @@
+import http.client
+import time
+from hashlib import sha256
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import rich_click as click
+from rich.console import Console
+
+from .config import Config
+from .docker_api import DockerClient, compose_project_name
+from .errors import ErrorForUser
+from .files import atomic_write_text
+from .images import DOCKER_HUB, image_registry
+from .reporting import action, handle_fatal, run_command, success
+from .tracing import tracing
+
+console = Console()
+
+REGISTRY_CACHE_FINGERPRINT_FILE = ".fingerprint"
+REGISTRY_CACHE_IMAGE = "registry:2"
+DOCKER_HUB_HOSTS = {"docker.io", "index.docker.io", "registry-1.docker.io"}
+REGISTRY_CACHE_START_TIMEOUT = 30
+REGISTRY_CACHE_POLL_INTERVAL = 0.2
+
+REGISTRY_CACHE_COMPOSE = """services:
+  registry:
+    image: {image}
+    restart: always
+    network_mode: host
+    environment:
+      REGISTRY_HTTP_ADDR: "127.0.0.1:{port}"
+      REGISTRY_PROXY_REMOTEURL: "{upstream}"
+    volumes:
+      - "{data_dir}:/var/lib/registry"
+    labels:
+      - "master-builder.registry-cache=true"
+"""
+
+
+def upstream_registry(upstream: str) -> str:
+    """
+    The registry that a pull-through cache mirrors, named like
+    `image_registry()` names the registry of images.
+
+    Parameters
+    ----------
+    upstream
+        URL of the upstream registry, like https://registry-1.docker.io
+    """
+
+    host = urlsplit(upstream).netloc
+
+    if host in DOCKER_HUB_HOSTS:
+        return DOCKER_HUB
+
+    return host
+
+
+def cache_reference(image: str, upstream: str, address: str) -> str | None:
+    """
+    The reference of an image in the pull-through cache, like
+    `127.0.0.1:5000/library/nginx:1.27` for `nginx:1.27`, or None if the image
+    doesn't come from the registry which the cache mirrors.
+
+    Parameters
+    ----------
+    image
+        Reference of the image
+    upstream
+        URL of the registry mirrored by the cache
+    address
+        Host and port of the cache
+    """
+
+    registry = image_registry(image)
+
+    if registry != upstream_registry(upstream):
+        return None
+
+    first, sep, rest = image.partition("/")
+    path = rest if sep and first == registry else image
+
+    if registry == DOCKER_HUB and "/" not in path:
+        path = f"library/{path}"
+
+    return f"{address}/{path}"
+
+
+def cache_references(images: list[str]) -> dict[str, str]:
+    """
+    Maps the images that deploys must pull through the cache to their
+    reference in it (see `cache_reference()`). Empty when there is no cache.
+
+    Parameters
+    ----------
+    images
+        References of the images
+    """
+
+    persisted = Config.instance().persisted
+
+    if not persisted.registry_cache:
+        return {}
+
+    address = f"127.0.0.1:{persisted.registry_cache_port}"
+    references = {
+        image: cache_reference(image, persisted.registry_cache, address)
+        for image in images
+    }
+
+    return {image: ref for image, ref in references.items() if ref}
+
+
+def generate_compose() -> str:
+    config = Config.instance()
+    data_dir = config.registry_cache_dir / "data"
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    return REGISTRY_CACHE_COMPOSE.format(
+        image=REGISTRY_CACHE_IMAGE,
+        port=config.persisted.registry_cache_port,
+        upstream=config.persisted.registry_cache,
+        data_dir=data_dir,
+    )
+
+
+def ensure_registry_cache_compose() -> None:
+    """Ensure that the Docker Compose file of the cache is up to date."""
+
+    cache_dir = Config.instance().registry_cache_dir
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    compose_file = cache_dir / "docker-compose.yml"
+    expected_content = generate_compose()
+
+    try:
+        existing_content = compose_file.read_text()
+    except FileNotFoundError:
+        existing_content = ""
+
+    if existing_content != expected_content:
+        verb = "Updating" if compose_file.exists() else "Creating"
+
+        with action(f"{verb} registry cache Docker Compose file"):
+            atomic_write_text(compose_file, expected_content)
+
+
+def is_running() -> bool:
+    """
+    Check if the registry cache is running.
+    """
+
+    containers = DockerClient.instance().project_containers(
+        compose_project_name(Config.instance().registry_cache_dir),
+        service="registry",
+        status=["running"],
+    )
+
+    return bool(containers)
+
+
+def wait_until_serving(port: int, timeout: float) -> None:
+    """
+    Waits for the registry cache to answer on its `/v2/` endpoint, since the
+    container runs before the registry listens and pulling through it before
+    that fails. Any HTTP answer will do, including an error.
+
+    Parameters
+    ----------
+    port
+        Port of the cache, on localhost
+    timeout
+        Maximum number of seconds to wait
+    """
+
+    url = f"http://127.0.0.1:{port}/v2/"
+    deadline = time.monotonic() + timeout
+
+    while True:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+
+        try:
+            conn.request("GET", "/v2/")
+            conn.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            if time.monotonic() >= deadline:
+                msg = (
+                    f"The registry cache didn't answer on {url} "
+                    f"within {timeout:g}s: {e}"
+                )
+                raise ErrorForUser(msg) from None
+        else:
+            return
+        finally:
+            conn.close()
+
+        time.sleep(REGISTRY_CACHE_POLL_INTERVAL)
+
+
+def start_registry_cache() -> None:
+    """
+    Start the registry cache, or restart it if its configuration changed.
+    This function is idempotent, and does nothing when no cache is
+    configured.
+
+    Like for the ingress (see `start_ingress()`), the fingerprint of the
+    compose file is stored once it runs, so that subsequent calls only have
+    to check that the cache is still running.
+    """
+
+    config = Config.instance()
+
+    if not config.persisted.registry_cache:
+        return
+
+    cache_dir = config.registry_cache_dir
+    fingerprint_file = cache_dir / REGISTRY_CACHE_FINGERPRINT_FILE
+    fingerprint = sha256(generate_compose().encode()).hexdigest()
+
+    try:
+        reconciled = fingerprint_file.read_text() == fingerprint
+    except FileNotFoundError:
+        reconciled = False
+
+    if reconciled and is_running():
+        return
+
+    ensure_registry_cache_compose()
+
+    with action("Starting registry cache"):
+        run_command(["docker", "compose", "up", "-d"], cwd=cache_dir)
+        wait_until_serving(
+            config.persisted.registry_cache_port,
+            REGISTRY_CACHE_START_TIMEOUT,
+        )
+
+    atomic_write_text(fingerprint_file, fingerprint)
+
+
+def stop_registry_cache() -> None:
+    """
+    Stop the registry cache. This function is idempotent. The cached images
+    are kept.
+    """
+
+    cache_dir = Config.instance().registry_cache_dir
+
+    if is_running():
+        with action("Stopping registry cache"):
+            run_command(["docker", "compose", "down"], cwd=cache_dir)
+
+    (cache_dir / REGISTRY_CACHE_FINGERPRINT_FILE).unlink(missing_ok=True)
+
+
+@click.group()
+@click.option(
+    "--trace-file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help=(
+        "Write the timing of each step and command to this file, in the Chrome "
+        "trace format (open it with https://ui.perfetto.dev)"
+    ),
+)
+@click.pass_context
+def registry_cache(ctx: click.Context, trace_file: Path | None):
+    """Manage the pull-through registry cache (see `init --registry-cache`)."""
+
+    ctx.with_resource(tracing(trace_file))
+
+
+@registry_cache.command()
+@handle_fatal
+def start():
+    """Start the registry cache."""
+
+    if not Config.instance().persisted.registry_cache:
+        success("No registry cache is configured.")
+    else:
+        start_registry_cache()
+        success("Registry cache is running.")
+
+
+@registry_cache.command()
+@handle_fatal
+def stop():
+    """Stop the registry cache."""
+
+    if is_running():
+        stop_registry_cache()
+        success("Registry cache stopped successfully.")
+    else:
+        success("Registry cache is not running.")
+
+
+@registry_cache.command()
+@handle_fatal
+def status():
+    """Check the status of the registry cache."""
+
+    persisted = Config.instance().persisted
+
+    if not persisted.registry_cache:
+        s = "[yellow]not configured[/yellow]"
+    elif is_running():
+        s = f"[green]running[/green] on 127.0.0.1:{persisted.registry_cache_port}"
+    else:
+        s = "[red]not running[/red]"
+
+    console.print(f"Registry cache status: {s}")
+
+    if persisted.registry_cache:
+        console.print(f"Upstream: {persisted.registry_cache}")
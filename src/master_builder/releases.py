@@ -0,0 +1,160 @@
+import copy
+import time
+from pathlib import Path
+
+import rich_click as click
+from rich.console import Console
+
+from .config import Config, load_yaml
+from .docker_api import DockerClient
+from .errors import ErrorForUser
+from .files import atomic_write_text
+from .reporting import handle_fatal
+from .state import ProjectState
+
+console = Console(force_terminal=True)
+
+RELEASES_DIR = ".releases"
+
+
+def _repository(image: str) -> str:
+    name = image.partition("@")[0]
+    repository, _, tag = name.rpartition(":")
+
+    if not repository or "/" in tag:
+        repository = name
+
+    for prefix in ("docker.io/", "library/"):
+        repository = repository.removeprefix(prefix)
+
+    return repository
+
+
+def pin_images(document: dict) -> dict:
+    """
+    Replaces the image of each service by the digest of its local copy (like
+    `nginx@sha256:...`), so that the compose file designates exactly the
+    images it runs, even once their tags moved. Images which have no digest
+    (like those built locally) keep their reference.
+
+    Parameters
+    ----------
+    document
+        The parsed compose file, once deployed
+    """
+
+    document = copy.deepcopy(document)
+    client = DockerClient.instance()
+
+    for name, spec in (document.get("services") or {}).items():
+        image = (spec or {}).get("image")
+
+        if not isinstance(image, str) or "$" in image or "@" in image:
+            continue
+
+        digests = (client.inspect_image(image) or {}).get("RepoDigests") or []
+        matching = [d for d in digests if _repository(d) == _repository(image)]
+
+        if pinned := next(iter(matching or digests), None):
+            document["services"][name]["image"] = pinned
+        else:
+            console.print(f"[yellow]Can't pin the image of {name}, no digest found")
+
+    return document
+
+
+def release_file(project_dir: Path, deploy_id: str) -> Path:
+    """
+    Where the compose file of a deployment is kept for rollbacks.
+
+    Parameters
+    ----------
+    project_dir
+        The directory of the project
+    deploy_id
+        ID of the deployment
+    """
+
+    return project_dir / RELEASES_DIR / f"{deploy_id}.yml"
+
+
+def save_release(project_dir: Path, deploy_id: str, document: dict) -> None:
+    """
+    Keeps the compose file of a deployment which just went live, with its
+    images pinned (see `pin_images()`), to roll back to it later. Only the
+    releases of the deployments whose images are protected from the garbage
+    collection are kept (see `protected_images()`), others are deleted.
+
+    Parameters
+    ----------
+    project_dir
+        The directory of the project
+    deploy_id
+        ID of the deployment
+    document
+        Its compose file
+    """
+
+    yaml, _, dumper = load_yaml()
+    content = yaml.dump(pin_images(document), Dumper=dumper, sort_keys=False)
+    atomic_write_text(release_file(project_dir, deploy_id), content)
+
+    keep = Config.instance().persisted.gc_keep_versions
+    history = ProjectState.load(project_dir).history
+    kept = {f"{r.deploy_id}.yml" for r in history[:keep]} | {f"{deploy_id}.yml"}
+
+    for path in (project_dir / RELEASES_DIR).glob("*.yml"):
+        if path.name not in kept:
+            path.unlink(missing_ok=True)
+
+
+@click.command()
+@click.option("--list", "list_only", is_flag=True, help="List the releases and exit")
+@click.argument("project_name")
+@click.argument("deploy_id", required=False)
+@click.pass_context
+@handle_fatal
+def rollback(
+    ctx: click.Context,
+    list_only: bool,
+    project_name: str,
+    deploy_id: str | None,
+):
+    """
+    Bring back a previous deployment of a project (by default the one before
+    the current one), using the images it ran without pulling anything.
+    """
+
+    project_dir = Config.instance().project_dir(project_name)
+    state = ProjectState.load(project_dir)
+    releases = [
+        r for r in state.history if release_file(project_dir, r.deploy_id).exists()
+    ]
+
+    if list_only:
+        for record in releases:
+            at = time.strftime("%Y-%m-%d %H:%M", time.localtime(record.deployed_at))
+            current = " (current)" if record.deploy_id == state.current else ""
+            console.print(f"{record.deploy_id}  {at}{current}")
+
+        return
+
+    candidates = [r for r in releases if r.deploy_id != state.current]
+
+    if deploy_id:
+        candidates = [r for r in candidates if r.deploy_id == deploy_id]
+
+    if not candidates:
+        msg = f"No release of {project_name} to roll back to"
+        msg += f", see `master-builder rollback --list {project_name}`"
+        raise ErrorForUser(msg)
+
+    from .deploy import deploy
+
+    ctx.invoke(
+        deploy,
+        project_name=project_name,
+        compose_file=release_file(project_dir, candidates[0].deploy_id),
+        no_pull=True,
+        force=True,
+    )
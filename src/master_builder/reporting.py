@@ -1,18 +1,163 @@
+import codecs
+import os
+import selectors
 import shlex
 import subprocess
-from collections.abc import Callable
-from contextlib import contextmanager
+import sys
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar, copy_context
 from functools import wraps
 from pathlib import Path
+from typing import IO, Any, TypeVar
 
 from rich.console import Console
 from rich.panel import Panel
-from rich.traceback import Traceback
 
-from .errors import ErrorForUser
+from .errors import Cancelled, CommandFailed, DockerApiError, ErrorForUser
+from .tracing import span
 
 console = Console(force_terminal=True)
 
+TAIL_BYTES = 4 * 1024
+READ_CHUNK = 64 * 1024
+CANCEL_POLL_INTERVAL = 0.2
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_bound_streams: ContextVar[tuple[IO, IO, IO] | None] = ContextVar(
+    "bound_streams",
+    default=None,
+)
+_command_log: ContextVar["CommandLog | None"] = ContextVar("command_log", default=None)
+_cancel_event: ContextVar[threading.Event | None] = ContextVar(
+    "cancel_event",
+    default=None,
+)
+
+
+class StreamProxy:
+    """
+    Stands in for one of sys.stdin, sys.stdout or sys.stderr and forwards
+    everything to the corresponding stream bound to the current context (see
+    `bound_streams()`), or to the original stream if there is none. This is
+    how the agent can serve several clients at once, each command writing to
+    its own client's terminal.
+
+    Parameters
+    ----------
+    index
+        0 for stdin, 1 for stdout and 2 for stderr
+    default
+        The original stream
+    """
+
+    def __init__(self, index: int, default: IO):
+        self._index = index
+        self._default = default
+
+    def __getattr__(self, name: str) -> Any:
+        streams = _bound_streams.get()
+        target = streams[self._index] if streams else self._default
+        return getattr(target, name)
+
+
+def install_stream_proxies():
+    """
+    Replaces the standard streams by proxies, see `StreamProxy`.
+    """
+
+    sys.stdin, sys.stdout, sys.stderr = (  # type: ignore[assignment]
+        StreamProxy(i, s) for i, s in enumerate((sys.stdin, sys.stdout, sys.stderr))
+    )
+
+
+@contextmanager
+def bound_streams(stdin: IO, stdout: IO, stderr: IO) -> Iterator[None]:
+    """
+    Within this context (and threads started through `parallel_map()`), the
+    standard streams are redirected to the provided ones, provided that
+    `install_stream_proxies()` was called.
+
+    Parameters
+    ----------
+    stdin
+        Replacement for sys.stdin
+    stdout
+        Replacement for sys.stdout
+    stderr
+        Replacement for sys.stderr
+    """
+
+    token = _bound_streams.set((stdin, stdout, stderr))
+
+    try:
+        yield
+    finally:
+        _bound_streams.reset(token)
+
+
+def parallel_map(func: Callable[[T], R], items: Iterable[T], workers: int) -> list[R]:
+    """
+    Calls a function on each item in a pool of threads and returns the
+    results in order. The threads run in a copy of the caller's context, so
+    that their output goes to the same place.
+
+    Parameters
+    ----------
+    func
+        The function to call
+    items
+        Items to call it on
+    workers
+        Maximum number of threads
+    """
+
+    items = list(items)
+
+    if not items:
+        return []
+
+    context = copy_context()
+
+    def call(item: T) -> R:
+        return context.copy().run(func, item)
+
+    with ThreadPoolExecutor(max(1, min(workers, len(items)))) as pool:
+        return list(pool.map(call, items))
+
+
+@contextmanager
+def cancellable(event: threading.Event) -> Iterator[None]:
+    """
+    Within this context, commands run by `run_command()` get killed once the
+    event is set, raising `Cancelled`. Commands which need a terminal (see
+    the `interactive` parameter) are not killed, but none can start anymore.
+
+    Parameters
+    ----------
+    event
+        Set to cancel the commands
+    """
+
+    token = _cancel_event.set(event)
+
+    try:
+        yield
+    finally:
+        _cancel_event.reset(token)
+
+
+def _check_cancelled(command: list[str]) -> None:
+    if (event := _cancel_event.get()) and event.is_set():
+        msg = f"Cancelled: {' '.join(command)}"
+        raise Cancelled(msg)
+
 
 def handle_fatal(func: Callable):
     """
@@ -46,7 +191,9 @@ def action(message: str):
     """
 
     console.print(f"\n[magenta]==[ [bold]{message}[/bold] ]==\n")
-    yield
+
+    with span(message, "phase"):
+        yield
 
 
 def fatal(err: Exception):
@@ -64,11 +211,12 @@ def fatal(err: Exception):
         error_message = str(err)
         panel = Panel(error_message, title="Error", border_style="red", expand=False)
         console.print(panel)
-    elif isinstance(err, subprocess.CalledProcessError):
-        error_message = f"Command failed with return code {err.returncode}"
-        panel = Panel(error_message, title="Error", border_style="red", expand=False)
+    elif isinstance(err, DockerApiError):
+        panel = Panel(str(err), title="Error", border_style="red", expand=False)
         console.print(panel)
     else:
+        from rich.traceback import Traceback
+
         console.print(Traceback.from_exception(type(err), err, err.__traceback__))
 
     exit(1)
@@ -87,15 +235,32 @@ def success(message: str):
     console.print(Panel.fit(message, title="Success", border_style="green"))
 
 
+def skipped(message: str):
+    """
+    Displays a message explaining why there was nothing to do.
+
+    Parameters
+    ----------
+    message
+        The message to display
+    """
+
+    console.print(Panel.fit(message, title="Skipped", border_style="yellow"))
+
+
 def run_command(
     command: list[str],
     cwd: Path | None = None,
     check: bool = True,
     capture: bool = False,
     quiet: bool = False,
+    interactive: bool = False,
 ):
     """
-    Runs a command and prints it to the console.
+    Runs a command and prints it to the console. Its output is read line by
+    line as it comes: it gets echoed (unless captured), written to the
+    command log if there is one (see `command_log()`) and only its end is
+    kept in memory (see `OutputTail`), to be shown if the command fails.
 
     Parameters
     ----------
@@ -104,25 +269,359 @@ def run_command(
     cwd
         The directory to run the command in
     check
-        Whether to check the return code of the command
+        Whether to check the return code of the command, raising a
+        `CommandFailed` if it's not 0
     capture
-        Whether to capture the output of the command
+        Whether to capture the output of the command instead of echoing it
+        (only its end is returned, see `OutputTail`)
     quiet
         Do not announce the command before running it
+    interactive
+        Give the command our own standard streams, for commands that may
+        need a terminal. Nothing is then logged nor kept.
     """
 
+    _check_cancelled(command)
+
     if not quiet:
         cmd = " ".join(shlex.quote(x) for x in command)
         console.print(f"\n[blue]--> Running: [blue bold]{cmd}\n")
 
+    stdout: IO | int | None = subprocess.PIPE
+    stderr: IO | int | None = subprocess.PIPE
+
+    if interactive:
+        stdout, stderr = _inheritable(sys.stdout), _inheritable(sys.stderr)
+
+    tail = OutputTail()
+    log = _command_log.get()
+    name = " ".join(command[:3])
+
     try:
-        return subprocess.run(
-            command,
-            cwd=cwd,
-            check=check,
-            capture_output=capture,
-            encoding="utf-8" if capture else None,
-        )
+        with (
+            span(name, "command", argv=command, cwd=str(cwd or "")) as details,
+            subprocess.Popen(
+                command,
+                cwd=cwd,
+                stdin=_inheritable(sys.stdin),
+                stdout=stdout,
+                stderr=stderr,
+            ) as process,
+        ):
+            try:
+                if not interactive:
+                    _read_output(process, command, tail, log, echo=not capture)
+
+                details.update(_reap(process))
+            except BaseException:
+                process.kill()
+                raise
     finally:
         if not quiet:
             print("\n")  # noqa T201
+
+    if log and not interactive:
+        log.write(command, "exit", f"{process.returncode}")
+
+    if check and process.returncode:
+        log_file = log.path if log and not interactive else None
+        raise CommandFailed(command, process.returncode, tail.text(), log_file)
+
+    out = err = None
+
+    if capture:
+        out, err = tail.text("out"), tail.text("err")
+
+    return subprocess.CompletedProcess(command, process.returncode, out, err)
+
+
+class OutputTail:
+    """
+    The last lines printed by a command, with the time they were printed.
+    Older lines get dropped once they take more than `max_bytes`, so that
+    memory doesn't grow with the output of the command.
+
+    Parameters
+    ----------
+    max_bytes
+        How much output to keep
+    """
+
+    def __init__(self, max_bytes: int = TAIL_BYTES):
+        self.max_bytes = max_bytes
+        self.lines: deque[tuple[float, str, str]] = deque()
+        self.size = 0
+
+    def add(self, stream: str, line: str, at: float) -> None:
+        """
+        Keeps a line, dropping the oldest ones if needed
+
+        Parameters
+        ----------
+        stream
+            "out" or "err"
+        line
+            The line, without its line break
+        at
+            When it was printed
+        """
+
+        self.lines.append((at, stream, line))
+        self.size += len(line) + 1
+
+        while self.size > self.max_bytes and len(self.lines) > 1:
+            self.size -= len(self.lines.popleft()[2]) + 1
+
+    def text(self, stream: str | None = None) -> str:
+        """
+        The kept lines, prefixed with their time unless only one stream is
+        asked for (in which case it's the raw output).
+
+        Parameters
+        ----------
+        stream
+            Only return the lines of this stream
+        """
+
+        if stream:
+            return "".join(f"{line}\n" for _, s, line in self.lines if s == stream)
+
+        return "\n".join(f"{_timestamp(at)} {line}" for at, _, line in self.lines)
+
+
+class CommandLog:
+    """
+    A file receiving the output of all the commands run within a context,
+    line by line and with timestamps, see `command_log()`. It's only created
+    once a command prints something.
+
+    Parameters
+    ----------
+    path
+        Where to write
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file: IO | None = None
+        self.lock = threading.Lock()
+
+    def write(self, command: list[str], stream: str, line: str) -> None:
+        """
+        Appends a line of output
+
+        Parameters
+        ----------
+        command
+            The command which printed it
+        stream
+            "out", "err" or "exit" (for the exit code)
+        line
+            The line, without its line break
+        """
+
+        name = " ".join(" ".join(command[:3]).split())
+
+        with self.lock:
+            if self.file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.file = self.path.open("a", encoding="utf-8")
+
+            self.file.write(f"{_timestamp(time.time())} [{name}] {stream}: {line}\n")
+            self.file.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def discard(self) -> None:
+        """
+        Deletes what was logged so far, for runs which turned out to change
+        nothing. Later lines start a new file.
+        """
+
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+@contextmanager
+def command_log(path: Path) -> Iterator[CommandLog]:
+    """
+    Within this context (and threads started through `parallel_map()`), the
+    output of the commands run by `run_command()` is also written to a file.
+
+    Parameters
+    ----------
+    path
+        The log file, appended to
+    """
+
+    log = CommandLog(path)
+    token = _command_log.set(log)
+
+    try:
+        yield log
+    finally:
+        _command_log.reset(token)
+        log.close()
+
+
+def _timestamp(at: float) -> str:
+    return time.strftime("%H:%M:%S", time.localtime(at)) + f".{int(at % 1 * 1000):03d}"
+
+
+class _LineSplitter:
+    """
+    Decodes the output of a command and cuts it into lines, which can come
+    in several chunks. Lines longer than `max_length` are cut too.
+    """
+
+    def __init__(self, max_length: int):
+        self.max_length = max_length
+        self.decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self.pending = ""
+
+    def feed(self, chunk: bytes) -> tuple[str, list[str]]:
+        """
+        Returns the decoded chunk and the lines it completed. An empty chunk
+        means the end of the output.
+        """
+
+        text = self.decoder.decode(chunk, final=not chunk)
+        *lines, self.pending = (self.pending + text).split("\n")
+
+        if not chunk or len(self.pending) > self.max_length:
+            lines.append(self.pending)
+            self.pending = ""
+
+        # Progress bars redraw their line, only the last version was seen
+        return text, [s for line in lines if (s := line.rsplit("\r", 1)[-1])]
+
+
+def _read_output(
+    process: subprocess.Popen,
+    command: list[str],
+    tail: OutputTail,
+    log: CommandLog | None,
+    echo: bool,
+) -> None:
+    """
+    Reads both outputs of a process as they come, until it closes them or
+    the commands get cancelled (see `cancellable()`).
+    """
+
+    readers = {
+        pipe.fileno(): (stream, target, _LineSplitter(tail.max_bytes))
+        for pipe, stream, target in [
+            (process.stdout, "out", sys.stdout),
+            (process.stderr, "err", sys.stderr),
+        ]
+        if pipe
+    }
+
+    with selectors.DefaultSelector() as selector:
+        for fd in readers:
+            selector.register(fd, selectors.EVENT_READ)
+
+        while selector.get_map():
+            _check_cancelled(command)
+
+            for key, _ in selector.select(CANCEL_POLL_INTERVAL):
+                stream, target, splitter = readers[key.fd]
+                chunk = os.read(key.fd, READ_CHUNK)
+                text, lines = splitter.feed(chunk)
+
+                if echo and text:
+                    target.write(text)
+                    target.flush()
+
+                for line in lines:
+                    tail.add(stream, line, time.time())
+
+                    if log:
+                        log.write(command, stream, line)
+
+                if not chunk:
+                    selector.unregister(key.fd)
+
+
+def _reap(process: subprocess.Popen) -> dict:
+    """
+    Waits for a command to exit, like `Popen.wait()` but through
+    `os.wait4()`, which also gives the resource usage of the child. Returns
+    its exit code, CPU time and peak memory.
+
+    Parameters
+    ----------
+    process
+        The command, which nothing else waits for
+    """
+
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return {"exit_code": process.wait()}
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    return {
+        "exit_code": process.returncode,
+        "cpu_user_s": rusage.ru_utime,
+        "cpu_system_s": rusage.ru_stime,
+        "max_rss_kib": rusage.ru_maxrss,
+    }
+
+
+def _inheritable(stream: IO) -> IO | None:
+    """
+    Returns the stream if a child process can inherit it (which is not the
+    case of in-memory streams), None otherwise.
+    """
+
+    try:
+        stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+    stream.flush()
+    return stream
+
+
+def run_detached(
+    command: list[str],
+    cwd: Path | None = None,
+    log_file: Path | None = None,
+):
+    """
+    Starts a command in the background, in its own session and without any
+    link to our standard streams, so that it survives us and doesn't hold the
+    SSH connection open.
+
+    Parameters
+    ----------
+    command
+        The command to run
+    cwd
+        The directory to run the command in
+    log_file
+        If specified, the output of the command is appended to this file,
+        otherwise it is discarded
+    """
+
+    with ExitStack() as stack:
+        output: IO | int = subprocess.DEVNULL
+
+        if log_file:
+            log_file.parent.mkdir(parents=True, exist_ok=True)
+            output = stack.enter_context(log_file.open("ab"))
+
+        subprocess.Popen(
+            command,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=output,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
@@ -0,0 +1,207 @@
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from .cpus import host_cpus
+from .docker_api import COMPOSE_SERVICE_LABEL, DockerClient
+from .errors import ErrorForUser
+
+MEMORY = re.compile(r"(\d+(?:\.\d+)?)\s*([bkmgt]?)b?", re.IGNORECASE)
+MEMORY_UNITS = {"": 1, "b": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+HEADROOM = 0.9
+CGROUP_MEMORY_FILES = [
+    "/sys/fs/cgroup/system.slice/docker-{id}.scope/memory.current",
+    "/sys/fs/cgroup/docker/{id}/memory.current",
+    "/sys/fs/cgroup/memory/docker/{id}/memory.usage_in_bytes",
+    "/sys/fs/cgroup/memory/system.slice/docker-{id}.scope/memory.usage_in_bytes",
+]
+
+
+def parse_memory(value: object) -> int:
+    """
+    Parses a quantity of memory as written in compose files ("512m", "1g",
+    "1.5gb" or a number of bytes) into bytes.
+
+    Parameters
+    ----------
+    value
+        The quantity of memory
+    """
+
+    if isinstance(value, int):
+        return value
+
+    if not (match := MEMORY.fullmatch(str(value).strip())):
+        msg = f"Invalid quantity of memory: {value!r}"
+        raise ErrorForUser(msg)
+
+    return int(float(match[1]) * MEMORY_UNITS[match[2].lower()])
+
+
+def _resources(spec: dict, kind: str) -> dict:
+    return ((spec.get("deploy") or {}).get("resources") or {}).get(kind) or {}
+
+
+def declared_memory(spec: dict) -> int | None:
+    """
+    Memory that each container of a service is expected to use, taken from
+    its reservation or else its limit, if it declares any.
+
+    Parameters
+    ----------
+    spec
+        The service, from the parsed compose file
+    """
+
+    for value in (
+        _resources(spec, "reservations").get("memory"),
+        spec.get("mem_reservation"),
+        _resources(spec, "limits").get("memory"),
+        spec.get("mem_limit"),
+    ):
+        if value:
+            return parse_memory(value)
+
+    return None
+
+
+def declared_cpus(spec: dict) -> float:
+    """
+    Cores reserved by each container of a service.
+
+    Parameters
+    ----------
+    spec
+        The service, from the parsed compose file
+    """
+
+    try:
+        return float(_resources(spec, "reservations").get("cpus") or 0)
+    except ValueError:
+        return 0
+
+
+def available_memory() -> int:
+    """
+    Memory that can be used without swapping, according to the kernel.
+    """
+
+    for line in Path("/proc/meminfo").read_text().splitlines():
+        if line.startswith("MemAvailable:"):
+            return int(line.split()[1]) * 1024
+
+    return 0
+
+
+def available_cpus() -> float:
+    """
+    Cores left idle on average over the last minute.
+    """
+
+    load = float(Path("/proc/loadavg").read_text().split()[0])
+    return max(0.0, len(host_cpus()) - load)
+
+
+def container_memory(container_id: str) -> int | None:
+    """
+    Memory used by a running container, read from its cgroup (which depends
+    on the cgroup version and driver), or None if it can't be found.
+
+    Parameters
+    ----------
+    container_id
+        Full ID of the container
+    """
+
+    for pattern in CGROUP_MEMORY_FILES:
+        try:
+            return int(Path(pattern.format(id=container_id)).read_text())
+        except (OSError, ValueError):
+            continue
+
+    return None
+
+
+def observed_memory(compose_project: str) -> dict[str, int]:
+    """
+    Memory used by each container of the services of a running deployment,
+    on average over the containers of each service.
+
+    Parameters
+    ----------
+    compose_project
+        Name of the compose project of the deployment
+    """
+
+    usage: dict[str, list[int]] = {}
+
+    for container in DockerClient.instance().project_containers(
+        compose_project, status=["running"]
+    ):
+        service = (container.get("Labels") or {}).get(COMPOSE_SERVICE_LABEL)
+
+        if service and (used := container_memory(container["Id"])) is not None:
+            usage.setdefault(service, []).append(used)
+
+    return {s: sum(u) // len(u) for s, u in usage.items()}
+
+
+@dataclass
+class Admission:
+    """
+    What a new deployment needs compared to what the host has left, while
+    the current deployment still runs.
+    """
+
+    memory_needed: int
+    memory_free: int
+    cpus_needed: float
+    cpus_free: float
+
+    @property
+    def fits(self) -> bool:
+        return (
+            self.memory_needed <= self.memory_free * HEADROOM
+            and self.cpus_needed <= self.cpus_free
+        )
+
+    def describe(self) -> str:
+        return (
+            f"needs {self.memory_needed / (1 << 20):.0f} MiB of memory and "
+            f"{self.cpus_needed:g} cores, "
+            f"{self.memory_free / (1 << 20):.0f} MiB and {self.cpus_free:.1f} "
+            f"cores are available"
+        )
+
+
+def check_admission(document: dict, current_project: str | None) -> Admission:
+    """
+    Estimates what the new deployment needs on top of what already runs. Each
+    service counts for what its containers declare (see `declared_memory()`)
+    or, if they don't, for what the containers of the same service use in
+    the current deployment.
+
+    Parameters
+    ----------
+    document
+        The compose file of the new deployment
+    current_project
+        Compose project of the current deployment, if any
+    """
+
+    observed = observed_memory(current_project) if current_project else {}
+    memory = 0
+    cpus = 0.0
+
+    for name, spec in (document.get("services") or {}).items():
+        spec = spec or {}
+        replicas = int((spec.get("deploy") or {}).get("replicas") or 1)
+        per_container = declared_memory(spec)
+
+        if per_container is None:
+            per_container = observed.get(name, 0)
+
+        memory += replicas * per_container
+        cpus += replicas * declared_cpus(spec)
+
+    return Admission(memory, available_memory(), cpus, available_cpus())
@@ -0,0 +1,113 @@
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from .errors import ErrorForUser
+from .readiness import wait_until_ready
+from .reporting import action, run_command
+
+
+def service_order(document: dict) -> list[str]:
+    """
+    Orders the services of a compose file so that each one comes after those
+    it depends on. Services keep the order of the file otherwise.
+
+    Parameters
+    ----------
+    document
+        The parsed compose file
+    """
+
+    services = document.get("services") or {}
+    order: list[str] = []
+    visiting: set[str] = set()
+
+    def visit(name: str) -> None:
+        if name in order or name not in services:
+            return
+
+        if name in visiting:
+            msg = f"Service {name} depends on itself through depends_on"
+            raise ErrorForUser(msg)
+
+        visiting.add(name)
+
+        for dependency in (services[name] or {}).get("depends_on") or []:
+            visit(dependency)
+
+        visiting.discard(name)
+        order.append(name)
+
+    for name in services:
+        visit(name)
+
+    return order
+
+
+def roll_out(
+    deploy_dir: Path,
+    old_dir: Path,
+    document: dict,
+    compose_project: str,
+    ready_timeout: float,
+    on_moved: Callable[[set[str]], None],
+    settle: float = 0,
+) -> None:
+    """
+    Replaces the old deployment by the new one a service at a time, so that
+    only one service runs twice at any moment. Each service of the new
+    deployment is started and must get ready, then the traffic moves to it
+    and the same service of the old deployment gets stopped.
+
+    If something fails or the deployment gets interrupted, the old services
+    which were stopped get started again before raising, so that the old
+    deployment is whole.
+
+    Parameters
+    ----------
+    deploy_dir
+        Directory of the new deployment
+    old_dir
+        Directory of the current deployment
+    document
+        The compose file of the new deployment
+    compose_project
+        Compose project of the new deployment
+    ready_timeout
+        Seconds each service has to become ready, see `wait_until_ready()`
+    on_moved
+        Called with the services replaced so far, to move their traffic
+    settle
+        Seconds to let the traffic move before stopping an old service
+    """
+
+    moved: set[str] = set()
+
+    try:
+        for service in service_order(document):
+            with action(f"Replacing {service}"):
+                run_command(
+                    ["docker", "compose", "up", "-d", "--no-deps", service],
+                    cwd=deploy_dir,
+                )
+                wait_until_ready(compose_project, ready_timeout)
+
+                moved.add(service)
+                on_moved(moved)
+                time.sleep(settle)
+
+                run_command(
+                    ["docker", "compose", "stop", service],
+                    cwd=old_dir,
+                    check=False,
+                )
+    except BaseException:
+        if moved:
+            with action("Restarting the old services"):
+                run_command(
+                    ["docker", "compose", "start", *sorted(moved)],
+                    cwd=old_dir,
+                    check=False,
+                )
+
+        raise
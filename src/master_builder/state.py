@@ -0,0 +1,234 @@
+import json
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from uuid import uuid4
+
+from .files import atomic_write_text
+
+STATE_FILE = "state.json"
+CURRENT_LINK = "current"
+MAX_HISTORY = 50
+
+
+@dataclass
+class DeployRecord:
+    """A deployment that went live"""
+
+    deploy_id: str
+    deployed_at: float
+    images: list[str] = field(default_factory=list)
+    fingerprint: str | None = None
+
+
+@dataclass
+class ProjectState:
+    """
+    What Master Builder remembers about a project, stored in its directory.
+    That's the index of its deployments, so that nobody has to guess them by
+    listing the project's directory:
+
+    - `current` is the live deployment (also pointed at by the `current`
+      symlink, see `current_deployment()`)
+    - `pending` are deployments which were created but never went live, like
+      one being set up or the leftovers of a failed run
+    - `history` lists the deployments that went live, most recent first
+    """
+
+    current: str | None = None
+    pending: list[str] = field(default_factory=list)
+    history: list[DeployRecord] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, project_dir: Path) -> "ProjectState":
+        """
+        Reads the state of a project. Projects deployed before the state file
+        existed get their deployment directories listed once.
+
+        Parameters
+        ----------
+        project_dir
+            The directory of the project
+        """
+
+        try:
+            data = json.loads((project_dir / STATE_FILE).read_text())
+        except FileNotFoundError:
+            return cls(pending=[d.name for d in scan_deployments(project_dir)])
+
+        return cls(
+            current=data.get("current"),
+            pending=data.get("pending", []),
+            history=[DeployRecord(**r) for r in data.get("history", [])],
+        )
+
+    def save(self, project_dir: Path) -> None:
+        """
+        Writes the state of a project.
+
+        Parameters
+        ----------
+        project_dir
+            The directory of the project
+        """
+
+        content = json.dumps(asdict(self), indent=2)
+        atomic_write_text(project_dir / STATE_FILE, content)
+
+    @property
+    def current_record(self) -> DeployRecord | None:
+        """
+        The history entry of the current deployment, if known
+        """
+
+        return next((r for r in self.history if r.deploy_id == self.current), None)
+
+    def record(self, record: DeployRecord) -> None:
+        """
+        Adds a deployment to the history, most recent first.
+
+        Parameters
+        ----------
+        record
+            The deployment which just went live
+        """
+
+        self.history = [record, *self.history][:MAX_HISTORY]
+
+    def add_pending(self, deploy_id: str) -> None:
+        """
+        Registers a deployment which is being created.
+
+        Parameters
+        ----------
+        deploy_id
+            ID of the new deployment
+        """
+
+        self.pending.append(deploy_id)
+
+    def discard(self, deploy_id: str) -> None:
+        """
+        Forgets about a deployment that was removed.
+
+        Parameters
+        ----------
+        deploy_id
+            ID of the removed deployment
+        """
+
+        self.pending = [d for d in self.pending if d != deploy_id]
+
+        if self.current == deploy_id:
+            self.current = None
+
+    def activate(self, project_dir: Path, record: DeployRecord) -> list[str]:
+        """
+        Makes a deployment the current one, saves the state and swaps the
+        `current` symlink.
+
+        Parameters
+        ----------
+        project_dir
+            The directory of the project
+        record
+            The deployment which just went live
+
+        Returns
+        -------
+        The IDs of the deployments that are now obsolete (the previous one and
+        any pending one)
+        """
+
+        obsolete = [
+            d for d in [self.current, *self.pending] if d and d != record.deploy_id
+        ]
+
+        self.current = record.deploy_id
+        self.pending = []
+        self.record(record)
+        self.save(project_dir)
+        point_current(project_dir, record.deploy_id)
+
+        return obsolete
+
+
+def point_current(project_dir: Path, deploy_id: str) -> None:
+    """
+    Atomically points the `current` symlink of a project to a deployment, by
+    creating a new link and renaming it over the old one.
+
+    Parameters
+    ----------
+    project_dir
+        The directory of the project
+    deploy_id
+        ID of the deployment to point to
+    """
+
+    tmp = project_dir / f".{CURRENT_LINK}.{uuid4()}"
+    tmp.symlink_to(deploy_id)
+    tmp.replace(project_dir / CURRENT_LINK)
+
+
+def current_deployment(project_dir: Path) -> Path | None:
+    """
+    Finds the live deployment of a project, by following its `current`
+    symlink. For projects which were not deployed since it exists, this falls
+    back on the most recently modified deployment directory.
+
+    Parameters
+    ----------
+    project_dir
+        The directory of the project
+    """
+
+    try:
+        return project_dir / (project_dir / CURRENT_LINK).readlink()
+    except FileNotFoundError:
+        pass
+
+    return max(
+        scan_deployments(project_dir),
+        key=lambda d: d.stat().st_mtime,
+        default=None,
+    )
+
+
+def scan_deployments(project_dir: Path) -> list[Path]:
+    """
+    Lists the deployment directories of a project, which is only needed for
+    projects deployed before the state file existed.
+
+    Parameters
+    ----------
+    project_dir
+        The directory of the project
+    """
+
+    if not project_dir.is_dir():
+        return []
+
+    return [
+        d
+        for d in project_dir.iterdir()
+        if d.is_dir() and not d.is_symlink() and not d.name.startswith(".")
+    ]
+
+
+def iter_project_states(deployments_dir: Path) -> Iterator[tuple[str, ProjectState]]:
+    """
+    Yields the name and state of all the projects.
+
+    Parameters
+    ----------
+    deployments_dir
+        The directory containing all the projects
+    """
+
+    if not deployments_dir.is_dir():
+        return
+
+    for project_dir in deployments_dir.iterdir():
+        if project_dir.is_dir():
+            yield project_dir.name, ProjectState.load(project_dir)
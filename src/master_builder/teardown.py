@@ -0,0 +1,117 @@
+from functools import partial
+from pathlib import Path
+
+from rich.console import Console
+
+from .errors import ErrorForUser
+from .reporting import parallel_map, run_command, run_detached
+
+console = Console(force_terminal=True)
+
+RETIRED_DIR = ".retired"
+TEARDOWN_WORKERS = 4
+
+
+def retire_deployments(project_dir: Path, deploy_ids: list[str]) -> list[Path]:
+    """
+    Moves deployments into the `.retired` directory of the project. This is a
+    simple rename, so it's atomic and instant, and the deployment keeps its
+    directory name (hence its compose project name).
+
+    Parameters
+    ----------
+    project_dir
+        The directory of the project
+    deploy_ids
+        IDs of the deployments to retire. Those which don't exist (anymore)
+        are ignored.
+
+    Returns
+    -------
+    The new location of the retired deployments
+    """
+
+    retired_dir = project_dir / RETIRED_DIR
+    retired_dir.mkdir(parents=True, exist_ok=True)
+    retired = []
+
+    for deploy_id in deploy_ids:
+        target = retired_dir / deploy_id
+
+        try:
+            (project_dir / deploy_id).rename(target)
+        except FileNotFoundError:
+            continue
+
+        retired.append(target)
+
+    return retired
+
+
+def _stop(deploy_dir: Path, stop_timeout: int | None) -> str | None:
+    """
+    Stops a deployment, returns the error output if it failed.
+    """
+
+    timeout = [] if stop_timeout is None else ["-t", str(stop_timeout)]
+    result = run_command(
+        ["docker", "compose", "down", *timeout],
+        cwd=deploy_dir,
+        check=False,
+        capture=True,
+        quiet=True,
+    )
+
+    if result.returncode:
+        return result.stderr.strip() or f"exit code {result.returncode}"
+
+    console.print(f"Stopped {deploy_dir.name}")
+    return None
+
+
+def teardown_deployments(
+    deploy_dirs: list[Path],
+    stop_timeout: int | None = None,
+) -> None:
+    """
+    Runs `docker compose down` on several deployments at once, since most of
+    the time is spent waiting for containers to stop. Then the files of the
+    deployments that were stopped get deleted in the background. The ones
+    that could not be stopped are left in place.
+
+    Parameters
+    ----------
+    deploy_dirs
+        The (retired) deployments to tear down
+    stop_timeout
+        Seconds containers have to stop before getting killed, instead of
+        their `stop_grace_period` (10 seconds by default)
+    """
+
+    if not deploy_dirs:
+        return
+
+    stop = partial(_stop, stop_timeout=stop_timeout)
+    results = parallel_map(stop, deploy_dirs, TEARDOWN_WORKERS)
+    errors = dict(zip(deploy_dirs, results, strict=True))
+
+    delete_in_background([d for d, e in errors.items() if not e])
+
+    if failed := {d: e for d, e in errors.items() if e}:
+        lines = [f"- {d.name}: {e}" for d, e in failed.items()]
+        msg = "\n".join(["Could not stop old deployments:", *lines])
+        raise ErrorForUser(msg)
+
+
+def delete_in_background(deploy_dirs: list[Path]) -> None:
+    """
+    Deletes the files of stopped deployments without waiting for it.
+
+    Parameters
+    ----------
+    deploy_dirs
+        Directories to delete
+    """
+
+    if deploy_dirs:
+        run_detached(["rm", "-rf", "--", *(str(d) for d in deploy_dirs)])
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any
+
+from .files import atomic_write_text
+
+_tracer: ContextVar["Tracer | None"] = ContextVar("tracer", default=None)
+
+
+class Tracer:
+    """
+    Collects timing spans and exports them in the Chrome trace event format,
+    which can be opened in Perfetto (https://ui.perfetto.dev) or
+    chrome://tracing.
+
+    Spans are "complete" events: each one has a start and a duration, and
+    spans of the same thread nest by time. Spans from worker threads (like
+    concurrent pulls) show up on their own track.
+    """
+
+    def __init__(self) -> None:
+        self.events: list[dict] = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def add(self, name: str, category: str, start: int, end: int, args: dict):
+        """
+        Records a span
+
+        Parameters
+        ----------
+        name
+            What happened
+        category
+            Kind of span ("phase" or "command")
+        start
+            Start time, in nanoseconds since the epoch
+        end
+            End time, in nanoseconds since the epoch
+        args
+            Details to show along with the span
+        """
+
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start / 1000,
+            "dur": (end - start) / 1000,
+            "pid": self.pid,
+            "tid": threading.get_native_id(),
+            "args": args,
+        }
+
+        with self.lock:
+            self.events.append(event)
+
+    def export(self) -> dict:
+        """
+        Returns the whole trace, ready to be serialized as JSON
+        """
+
+        metadata = {
+            "name": "process_name",
+            "ph": "M",
+            "pid": self.pid,
+            "args": {"name": "master-builder"},
+        }
+
+        with self.lock:
+            events = [metadata, *sorted(self.events, key=lambda e: e["ts"])]
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+@contextmanager
+def tracing(trace_file: Path | None) -> Iterator[None]:
+    """
+    Records the spans (see `span()`) that happen within this context and
+    writes them to a file at the end, even if something failed in the
+    meantime. Does nothing if no file is provided.
+
+    Parameters
+    ----------
+    trace_file
+        Where to write the trace
+    """
+
+    if trace_file is None:
+        yield
+        return
+
+    tracer = Tracer()
+    token = _tracer.set(tracer)
+
+    try:
+        with span("master-builder", "process"):
+            yield
+    finally:
+        _tracer.reset(token)
+        atomic_write_text(trace_file, json.dumps(tracer.export()))
+
+
+@contextmanager
+def span(name: str, category: str, **args: Any) -> Iterator[dict[str, Any]]:
+    """
+    Measures how long the body of the context takes. The yielded dictionary
+    holds the details of the span, which can be completed from within the
+    body (like the exit code of a command). This is almost free when not
+    tracing.
+
+    Parameters
+    ----------
+    name
+        What is happening
+    category
+        Kind of span ("phase" or "command")
+    **args
+        Details to show along with the span
+    """
+
+    tracer = _tracer.get()
+
+    if tracer is None:
+        yield args
+        return
+
+    start = time.time_ns()
+
+    try:
+        yield args
+    except BaseException as e:
+        args.setdefault("error", repr(e))
+        raise
+    finally:
+        tracer.add(name, category, start, time.time_ns(), args)
@@ -0,0 +1,323 @@
+import re
+from collections.abc import Mapping
+from dataclasses import dataclass, replace
+from pathlib import Path
+from types import NoneType, UnionType
+from typing import get_args, get_type_hints
+
+from .config import load_yaml
+from .errors import ErrorForUser
+
+TRAEFIK_IMAGE = "traefik:v3.1"
+TRAEFIK_NETWORK = "traefik"
+TRAEFIK_DYNAMIC_DIR = "/etc/traefik/dynamic"
+COMPRESS_MIDDLEWARE = "mb-compress"
+
+ACCESS_LOG_MODES = ("off", "on", "buffered")
+DURATION = re.compile(r"\d+(ms|s|m|h)")
+
+PRESETS: dict[str, dict[str, object]] = {
+    "default": {},
+    "balanced": {
+        "compression": True,
+        "max_idle_conns_per_host": 32,
+        "access_log": "buffered",
+    },
+    "performance": {
+        "http3": True,
+        "compression": True,
+        "max_idle_conns_per_host": 128,
+        "dial_timeout": "5s",
+        "response_header_timeout": "60s",
+        "idle_conn_timeout": "90s",
+        "access_log": "off",
+        "metrics": True,
+    },
+}
+
+
+@dataclass(frozen=True)
+class TraefikProfile:
+    """
+    Performance-related settings of the Traefik ingress. They come from a
+    named preset (see `PRESETS`) with optional overrides, see `resolve()`.
+
+    Parameters
+    ----------
+    http3
+        Serve HTTP/3 (only when HTTPS is enabled)
+    compression
+        Compress responses on all entry points
+    max_idle_conns_per_host
+        Size of the pool of keep-alive connections to each backend (Traefik
+        keeps 200 by default)
+    dial_timeout
+        Maximum time to connect to a backend, like "5s"
+    response_header_timeout
+        Maximum time to wait for the headers of a backend's response
+    idle_conn_timeout
+        How long idle keep-alive connections to backends are kept
+    access_log
+        "off", "on" or "buffered" (written by batches of `access_log_buffer`
+        lines)
+    access_log_buffer
+        Number of lines of buffered access logs
+    metrics
+        Expose Prometheus metrics on `127.0.0.1:<metrics_port>`
+    metrics_port
+        Port of the metrics entry point
+    """
+
+    http3: bool = False
+    compression: bool = False
+    max_idle_conns_per_host: int | None = None
+    dial_timeout: str | None = None
+    response_header_timeout: str | None = None
+    idle_conn_timeout: str | None = None
+    access_log: str = "off"
+    access_log_buffer: int = 100
+    metrics: bool = False
+    metrics_port: int = 8082
+
+    @classmethod
+    def resolve(cls, preset: str, overrides: Mapping[str, str]) -> "TraefikProfile":
+        """
+        Builds the profile out of a preset and overrides, as stored in the
+        config. Raises an ErrorForUser if something is invalid.
+
+        Parameters
+        ----------
+        preset
+            Name of the preset
+        overrides
+            Values of specific settings, as text (like "http3" -> "false")
+        """
+
+        if preset not in PRESETS:
+            msg = f"Unknown Traefik profile {preset!r}, expected one of: "
+            msg += ", ".join(PRESETS)
+            raise ErrorForUser(msg)
+
+        types = get_type_hints(cls)
+        values = dict(PRESETS[preset])
+
+        for key, text in overrides.items():
+            if key not in types:
+                msg = f"Unknown Traefik option {key!r}, expected one of: "
+                msg += ", ".join(types)
+                raise ErrorForUser(msg)
+
+            values[key] = _parse_option(key, types[key], text)
+
+        profile = replace(cls(), **values)  # type: ignore[arg-type]
+        profile.validate()
+        return profile
+
+    def validate(self) -> None:
+        if self.access_log not in ACCESS_LOG_MODES:
+            msg = f"Invalid access_log {self.access_log!r}, expected one of: "
+            msg += ", ".join(ACCESS_LOG_MODES)
+            raise ErrorForUser(msg)
+
+        for name in ("dial_timeout", "response_header_timeout", "idle_conn_timeout"):
+            value = getattr(self, name)
+
+            if value is not None and not DURATION.fullmatch(value):
+                msg = f"Invalid {name} {value!r}, expected a duration like 30s"
+                raise ErrorForUser(msg)
+
+    def command(self, entrypoints: list[str], https: bool) -> list[str]:
+        """
+        Static configuration flags of Traefik for this profile.
+
+        Parameters
+        ----------
+        entrypoints
+            The entry points serving traffic
+        https
+            Whether HTTPS is enabled
+        """
+
+        command = []
+        transport = "--serversTransport"
+
+        if self.http3 and https:
+            command.append("--entrypoints.websecure.http3=true")
+
+        if self.compression:
+            command += [
+                f"--entrypoints.{e}.http.middlewares={COMPRESS_MIDDLEWARE}@docker"
+                for e in entrypoints
+            ]
+
+        if self.max_idle_conns_per_host is not None:
+            command.append(
+                f"{transport}.maxIdleConnsPerHost={self.max_idle_conns_per_host}"
+            )
+
+        for name, value in [
+            ("dialTimeout", self.dial_timeout),
+            ("responseHeaderTimeout", self.response_header_timeout),
+            ("idleConnTimeout", self.idle_conn_timeout),
+        ]:
+            if value is not None:
+                command.append(f"{transport}.forwardingTimeouts.{name}={value}")
+
+        if self.access_log != "off":
+            command.append("--accesslog=true")
+
+        if self.access_log == "buffered":
+            command.append(f"--accesslog.bufferingsize={self.access_log_buffer}")
+
+        if self.metrics:
+            command += [
+                f"--entrypoints.metrics.address=:{self.metrics_port}",
+                "--metrics.prometheus=true",
+                "--metrics.prometheus.entrypoint=metrics",
+            ]
+
+        return command
+
+    def ports(self, https: bool) -> list[str]:
+        ports = []
+
+        if self.http3 and https:
+            ports.append("443:443/udp")
+
+        if self.metrics:
+            ports.append(f"127.0.0.1:{self.metrics_port}:{self.metrics_port}")
+
+        return ports
+
+    def labels(self) -> list[str]:
+        if self.compression:
+            return [f"traefik.http.middlewares.{COMPRESS_MIDDLEWARE}.compress=true"]
+
+        return []
+
+
+def _parse_option(key: str, kind: type | UnionType, text: str) -> object:
+    text = text.strip()
+    kinds = get_args(kind) if isinstance(kind, UnionType) else (kind,)
+
+    if NoneType in kinds and text.lower() in ("", "none", "default"):
+        return None
+
+    if bool in kinds:
+        if text.lower() in ("1", "true", "yes", "on"):
+            return True
+
+        if text.lower() in ("0", "false", "no", "off"):
+            return False
+
+        msg = f"Invalid value for {key}: {text!r}, expected true or false"
+        raise ErrorForUser(msg)
+
+    if int in kinds:
+        try:
+            return int(text)
+        except ValueError:
+            msg = f"Invalid value for {key}: {text!r}, expected a number"
+            raise ErrorForUser(msg) from None
+
+    return text
+
+
+@dataclass(frozen=True)
+class AcmeHttps:
+    """HTTPS with certificates from Let's Encrypt"""
+
+    contact: str
+    letsencrypt_dir: Path
+
+
+@dataclass(frozen=True)
+class StaticHttps:
+    """HTTPS with a certificate provided by the user"""
+
+    cert_file: str
+    key_file: str
+
+
+def render_compose(
+    profile: TraefikProfile,
+    https: AcmeHttps | StaticHttps | None,
+    dynamic_dir: Path,
+) -> str:
+    """
+    Generates the compose file of the Traefik ingress.
+
+    Parameters
+    ----------
+    profile
+        Performance settings
+    https
+        How HTTPS is set up, if it is
+    dynamic_dir
+        Directory of the dynamic configuration files (TLS settings, weights of
+        the traffic shifts), watched by Traefik
+    """
+
+    command = [
+        "--api.insecure=true",
+        "--providers.docker=true",
+        "--providers.docker.exposedbydefault=false",
+        f"--providers.file.directory={TRAEFIK_DYNAMIC_DIR}/",
+        "--providers.file.watch=true",
+        "--entrypoints.web.address=:80",
+    ]
+    ports = ["80:80"]
+    volumes = [
+        "/var/run/docker.sock:/var/run/docker.sock:ro",
+        f"{dynamic_dir}:{TRAEFIK_DYNAMIC_DIR}:ro",
+    ]
+    labels = [
+        "traefik.enable=true",
+        "traefik.http.routers.traefik.rule=Host(`traefik.localhost`)",
+        "traefik.http.routers.traefik.service=api@internal",
+    ]
+    entrypoints = ["web"]
+
+    if https:
+        command.append("--entrypoints.websecure.address=:443")
+        ports.append("443:443")
+        entrypoints.append("websecure")
+
+    if isinstance(https, AcmeHttps):
+        acme = "--certificatesresolvers.masterBuilder.acme"
+        command += [
+            "--entrypoints.web.http.redirections.entryPoint.to=websecure",
+            "--entrypoints.web.http.redirections.entryPoint.scheme=https",
+            f"{acme}.tlschallenge=true",
+            f"{acme}.email={https.contact}",
+            f"{acme}.storage=/letsencrypt/acme.json",
+        ]
+        volumes.append(f"{https.letsencrypt_dir}:/letsencrypt")
+    elif isinstance(https, StaticHttps):
+        volumes += [
+            f"{https.cert_file}:/etc/traefik/ssl/default.crt:ro",
+            f"{https.key_file}:/etc/traefik/ssl/default.key:ro",
+        ]
+        labels += [
+            "traefik.http.routers.traefik.entrypoints=websecure",
+            "traefik.http.routers.traefik.tls=true",
+        ]
+
+    document = {
+        "services": {
+            "traefik": {
+                "image": TRAEFIK_IMAGE,
+                "restart": "always",
+                "command": command + profile.command(entrypoints, bool(https)),
+                "ports": ports + profile.ports(bool(https)),
+                "volumes": volumes,
+                "labels": labels + profile.labels(),
+            },
+        },
+        "networks": {
+            "default": {"name": TRAEFIK_NETWORK, "external": True},
+        },
+    }
+
+    yaml, _, dumper = load_yaml()
+    return "---\n" + yaml.dump(document, Dumper=dumper, sort_keys=False, width=1000)
@@ -0,0 +1,665 @@
+import copy
+import http.client
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .config import Config, load_yaml
+from .errors import ErrorForUser
+from .files import atomic_write_text
+from .reporting import action, console
+
+ROUTES_FILE = "routes.json"
+ROUTERS = "traefik.http.routers."
+SERVICES = "traefik.http.services."
+MIN_REQUESTS = 20
+ROUTING_DELAY = 2.5
+DRAIN_POLL_INTERVAL = 0.5
+METRIC_LINE = re.compile(
+    r"^traefik_service_(requests_total|request_duration_seconds_sum|open_connections)"
+    r"\{(?P<labels>[^}]*)\}\s+(?P<value>\S+)$"
+)
+METRIC_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+@dataclass(frozen=True)
+class ShiftPlan:
+    """
+    How to move the traffic to a new deployment.
+
+    Parameters
+    ----------
+    steps
+        Successive shares of the traffic sent to the new version, in percents
+        and ending with 100
+    interval
+        Seconds to observe each step before the next one
+    max_error_rate
+        By how much the share of 5xx responses of the new version may exceed
+        the one of the old version (0.01 being one point)
+    max_latency_ratio
+        How many times slower than the old version the new one may respond,
+        on average
+    """
+
+    steps: tuple[int, ...]
+    interval: float
+    max_error_rate: float
+    max_latency_ratio: float
+
+    @classmethod
+    def parse(
+        cls,
+        steps: str,
+        interval: float,
+        max_error_rate: float,
+        max_latency_ratio: float,
+    ) -> "ShiftPlan":
+        """
+        Builds the plan out of the command line options, the steps being a
+        comma-separated list of percents (like "10,50,100").
+        """
+
+        try:
+            percents = [int(s) for s in steps.split(",") if s.strip()]
+        except ValueError:
+            msg = f"Invalid traffic shift steps {steps!r}, expected like 10,50,100"
+            raise ErrorForUser(msg) from None
+
+        if not all(0 < p <= 100 for p in percents) or percents != sorted(set(percents)):
+            msg = "Traffic shift steps must be increasing percents, like 10,50,100"
+            raise ErrorForUser(msg)
+
+        if not percents or percents[-1] != 100:
+            percents.append(100)
+
+        return cls(tuple(percents), interval, max_error_rate, max_latency_ratio)
+
+
+def service_labels(spec: dict) -> dict[str, str]:
+    """
+    Reads the labels of a service of a compose file, which can be written as
+    a list or a mapping.
+
+    Parameters
+    ----------
+    spec
+        The service, from the parsed compose file
+    """
+
+    labels = spec.get("labels") or {}
+
+    if isinstance(labels, list):
+        pairs = (str(item).partition("=") for item in labels)
+        return {key: value for key, _, value in pairs}
+
+    return {
+        str(k): "" if v is None else str(v).lower() if isinstance(v, bool) else str(v)
+        for k, v in labels.items()
+    }
+
+
+def has_routers(document: dict) -> bool:
+    """
+    Tells if some services of a compose file get HTTP traffic from Traefik,
+    through routers of their labels.
+
+    Parameters
+    ----------
+    document
+        The parsed compose file
+    """
+
+    return any(
+        _names(service_labels(spec), ROUTERS)
+        for spec in (document.get("services") or {}).values()
+        if isinstance(spec, dict)
+    )
+
+
+def _names(labels: dict[str, str], prefix: str) -> list[str]:
+    return sorted(
+        {k[len(prefix) :].split(".", 1)[0] for k in labels if k.startswith(prefix)}
+    )
+
+
+def _rename(labels: dict[str, str], prefix: str, old: str, new: str) -> None:
+    for key in [k for k in labels if k.startswith(f"{prefix}{old}.")]:
+        labels[f"{prefix}{new}.{key[len(prefix) + len(old) + 1 :]}"] = labels.pop(key)
+
+
+def route_through_file(
+    document: dict,
+    project_name: str,
+    compose_project: str,
+) -> tuple[dict, dict[str, str], dict[str, str]]:
+    """
+    Rewrites the Traefik labels of a compose file so that its HTTP routers
+    go through weighted services of the file provider. Returns the new
+    document, the routes, which map each weighted service to the service of
+    this deployment it balances to, and the compose service running the
+    containers behind each route.
+
+    Routers and services get renamed after the deployment, so that those of
+    the old and new versions never conflict while both run. The weighted
+    services then decide how the traffic is split (see `write_weights()`),
+    without restarting anything.
+
+    Routers pointing at something else than a service defined by the
+    deployment (like `api@internal`) are left alone.
+
+    Parameters
+    ----------
+    document
+        The parsed compose file
+    project_name
+        Name of the project, which the weighted services are named after
+    compose_project
+        Name of the compose project of the deployment, see
+        `compose_project_name()`
+    """
+
+    document = copy.deepcopy(document)
+    services = {
+        name: spec
+        for name, spec in (document.get("services") or {}).items()
+        if isinstance(spec, dict)
+    }
+    labels_of = {name: service_labels(spec) for name, spec in services.items()}
+    defined = {
+        s: name for name, labels in labels_of.items() for s in _names(labels, SERVICES)
+    }
+    prefix = re.sub(r"[^a-z0-9-]", "-", project_name.lower())
+    routes = {}
+    owners = {}
+
+    for name, labels in labels_of.items():
+        if not (routers := _names(labels, ROUTERS)):
+            continue
+
+        own = _names(labels, SERVICES)
+        implicit = False
+
+        for router in routers:
+            target = labels.get(f"{ROUTERS}{router}.service")
+
+            if target is None and len(own) == 1:
+                backend = own[0]
+            elif target is None and not own:
+                backend = name
+                implicit = True
+            elif target in defined:
+                backend = target
+            else:
+                continue
+
+            weighted = f"{prefix}-{router}"
+            routes[weighted] = f"{backend}-{compose_project}@docker"
+            owners[weighted] = defined.get(backend, name)
+
+            _rename(labels, ROUTERS, router, f"{router}-{compose_project}")
+            labels[f"{ROUTERS}{router}-{compose_project}.service"] = f"{weighted}@file"
+
+        for service in own:
+            _rename(labels, SERVICES, service, f"{service}-{compose_project}")
+
+        if implicit:
+            key = f"{SERVICES}{name}-{compose_project}.loadbalancer.passhostheader"
+            labels[key] = "true"
+
+        services[name]["labels"] = labels
+
+    return document, routes, owners
+
+
+def save_routes(deploy_dir: Path, routes: dict[str, str]) -> None:
+    atomic_write_text(deploy_dir / ROUTES_FILE, json.dumps(routes, indent=2))
+
+
+def load_routes(deploy_dir: Path | None) -> dict[str, str] | None:
+    """
+    Reads the routes of a deployment (see `route_through_file()`), or None
+    if it doesn't go through weighted services.
+
+    Parameters
+    ----------
+    deploy_dir
+        The directory of the deployment
+    """
+
+    if deploy_dir is None:
+        return None
+
+    try:
+        return json.loads((deploy_dir / ROUTES_FILE).read_text())
+    except FileNotFoundError:
+        return None
+
+
+def weights_file(project_name: str) -> Path:
+    return Config.instance().traefik_dynamic_dir / f"project-{project_name}.yaml"
+
+
+def write_weights(
+    project_name: str,
+    old: dict[str, str],
+    new: dict[str, str],
+    percent: int,
+) -> None:
+    """
+    Writes the weighted services of a project, which Traefik picks up right
+    away. Routes that exist in only one of the versions go entirely to it.
+    The file is deleted if there are no routes left.
+
+    Parameters
+    ----------
+    project_name
+        Name of the project
+    old
+        Routes of the current deployment
+    new
+        Routes of the new deployment
+    percent
+        Share of the traffic going to the new deployment
+    """
+
+    services = {}
+
+    for name in sorted(old.keys() | new.keys()):
+        entries = []
+
+        if name in old and (percent < 100 or name not in new):
+            weight = 100 - percent if name in new else 1
+            entries.append({"name": old[name], "weight": weight})
+
+        if name in new and (percent > 0 or name not in old):
+            weight = percent if name in old else 1
+            entries.append({"name": new[name], "weight": weight})
+
+        services[name] = {"weighted": {"services": entries}}
+
+    path = weights_file(project_name)
+
+    if not services:
+        path.unlink(missing_ok=True)
+        return
+
+    yaml, _, dumper = load_yaml()
+    content = yaml.dump({"http": {"services": services}}, Dumper=dumper)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write_text(path, content)
+
+
+@dataclass
+class BackendStats:
+    """
+    Counters of the requests handled by some Traefik services, and the
+    number of requests they are serving right now (which a difference keeps
+    as is).
+    """
+
+    requests: float = 0
+    errors: float = 0
+    duration: float = 0
+    open_connections: float = 0
+
+    def __sub__(self, other: "BackendStats") -> "BackendStats":
+        return BackendStats(
+            self.requests - other.requests,
+            self.errors - other.errors,
+            self.duration - other.duration,
+            self.open_connections,
+        )
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0
+
+    @property
+    def mean_latency(self) -> float:
+        return self.duration / self.requests if self.requests else 0
+
+
+def scrape_metrics(port: int, backends: set[str]) -> BackendStats:
+    """
+    Sums the request counters of some services, as exposed by Traefik's
+    Prometheus endpoint.
+
+    Parameters
+    ----------
+    port
+        Port of the metrics entry point, on localhost
+    backends
+        Names of the services to count (like "web-abc@docker")
+    """
+
+    url = f"http://127.0.0.1:{port}/metrics"
+    stats = BackendStats()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+
+    try:
+        conn.request("GET", "/metrics")
+        response = conn.getresponse()
+        text = response.read().decode()
+    except (OSError, http.client.HTTPException) as e:
+        msg = f"Could not read the Traefik metrics at {url}: {e}"
+        raise ErrorForUser(msg) from None
+    finally:
+        conn.close()
+
+    if response.status != 200:
+        msg = f"Could not read the Traefik metrics at {url}: HTTP {response.status}"
+        raise ErrorForUser(msg)
+
+    for line in text.splitlines():
+        if not (match := METRIC_LINE.match(line)):
+            continue
+
+        labels = dict(METRIC_LABEL.findall(match["labels"]))
+
+        if labels.get("service") not in backends:
+            continue
+
+        value = float(match["value"])
+
+        if match[1] == "requests_total":
+            stats.requests += value
+
+            if labels.get("code", "").startswith("5"):
+                stats.errors += value
+        elif match[1] == "open_connections":
+            stats.open_connections += value
+        else:
+            stats.duration += value
+
+    return stats
+
+
+def degradation(
+    new: BackendStats,
+    reference: BackendStats | None,
+    plan: ShiftPlan,
+) -> str | None:
+    """
+    Compares the new version with the old one over the same period, and
+    explains what got worse if anything. There is no verdict until the new
+    version has served enough requests.
+
+    Parameters
+    ----------
+    new
+        Requests served by the new version
+    reference
+        Requests served by the old version, if it served enough of them
+    plan
+        The thresholds
+    """
+
+    if new.requests < MIN_REQUESTS:
+        return None
+
+    base_rate = reference.error_rate if reference else 0
+
+    if new.error_rate > base_rate + plan.max_error_rate:
+        return (
+            f"{new.error_rate:.1%} of the requests failed on the new version, "
+            f"against {base_rate:.1%} on the old one"
+        )
+
+    if (
+        reference
+        and reference.mean_latency
+        and new.mean_latency > reference.mean_latency * plan.max_latency_ratio
+    ):
+        return (
+            f"the new version responds in {new.mean_latency * 1000:.0f}ms on "
+            f"average, against {reference.mean_latency * 1000:.0f}ms for the "
+            f"old one"
+        )
+
+    return None
+
+
+def shift_traffic(
+    project_name: str,
+    old: dict[str, str],
+    new: dict[str, str],
+    plan: ShiftPlan,
+    metrics_port: int | None,
+) -> None:
+    """
+    Moves the traffic step by step to the new version, observing each step
+    for a while. Raises an ErrorForUser if the new version degrades the
+    error rate or the latency, leaving the weights as they were at the
+    failing step (see `write_weights()` to roll back).
+
+    Parameters
+    ----------
+    project_name
+        Name of the project
+    old
+        Routes of the current deployment
+    new
+        Routes of the new deployment
+    plan
+        The steps and thresholds
+    metrics_port
+        Port of Traefik's metrics, or None if they are not exposed, in which
+        case the steps are only timed
+    """
+
+    if metrics_port is None:
+        console.print(
+            "[yellow]Traefik metrics are disabled, the traffic shift can't "
+            "check the new version (see the `metrics` Traefik option)"
+        )
+
+    old_backends = set(old.values())
+    new_backends = set(new.values())
+    reference = None
+
+    for percent in plan.steps:
+        with action(f"Sending {percent}% of the traffic to the new version"):
+            write_weights(project_name, old, new, percent)
+
+            if metrics_port is None:
+                time.sleep(plan.interval)
+                continue
+
+            old_before = scrape_metrics(metrics_port, old_backends)
+            new_before = scrape_metrics(metrics_port, new_backends)
+            time.sleep(plan.interval)
+            old_stats = scrape_metrics(metrics_port, old_backends) - old_before
+            new_stats = scrape_metrics(metrics_port, new_backends) - new_before
+
+            if old_stats.requests >= MIN_REQUESTS:
+                reference = old_stats
+
+            if problem := degradation(new_stats, reference, plan):
+                msg = f"Traffic shift stopped at {percent}%: {problem}."
+                raise ErrorForUser(msg)
+
+
+@dataclass
+class Cutover:
+    """
+    How the traffic moves from the current deployment of a project to a new
+    one. When the new deployment is routed (see `route()`), the old one gets
+    taken out of the routing before it stops, and the traffic is shifted
+    progressively if there is a plan. Otherwise, or if the current
+    deployment isn't routed, both versions are served together until the old
+    one stops.
+
+    Parameters
+    ----------
+    project_name
+        Name of the project
+    old
+        Routes of the current deployment, if it has any
+    plan
+        The traffic shift, if there is one
+    metrics_port
+        Port of Traefik's metrics, if it exposes them
+    """
+
+    project_name: str
+    old: dict[str, str] | None
+    plan: ShiftPlan | None = None
+    metrics_port: int | None = None
+    new: dict[str, str] | None = None
+    owners: dict[str, str] = field(default_factory=dict)
+
+    def route(self, document: dict, compose_project: str) -> dict:
+        """
+        Rewrites the compose file of the new deployment so that it goes
+        through weighted services (see `route_through_file()`). Without HTTP
+        routers, the compose file stays as it is.
+        """
+
+        routed, self.new, self.owners = route_through_file(
+            document, self.project_name, compose_project
+        )
+
+        return routed if self.new else document
+
+    @property
+    def drains(self) -> bool:
+        """
+        Whether the old deployment stops receiving requests before it stops
+        (see `finish()`), so that it can be drained.
+        """
+
+        return bool(self.old) and self.new is not None
+
+    def prepare(self, deploy_dir: Path) -> None:
+        """
+        Records the routes of the new deployment and gets the weighted
+        services ready before it starts, with all the traffic still going to
+        the old one if there is one.
+        """
+
+        if self.new is None:
+            return
+
+        save_routes(deploy_dir, self.new)
+        write_weights(
+            self.project_name, self.old or {}, self.new, 0 if self.old else 100
+        )
+
+    def move(self, services: set[str]) -> None:
+        """
+        Sends the routes of some services entirely to the new deployment, and
+        those of the other services to the old one. That's how a rolling
+        deployment switches the traffic, one service after the other.
+
+        Parameters
+        ----------
+        services
+            Compose services that were replaced so far
+        """
+
+        if self.new is None:
+            return
+
+        old = self.old or {}
+        moved = {r for r, s in self.owners.items() if s in services}
+        write_weights(
+            self.project_name,
+            {r: b for r, b in old.items() if r not in moved or r not in self.new},
+            {r: b for r, b in self.new.items() if r in moved or r not in old},
+            100,
+        )
+
+    def run(self) -> None:
+        """
+        Shifts the traffic, see `shift_traffic()`.
+        """
+
+        if self.plan and self.old and self.new is not None:
+            shift_traffic(
+                self.project_name, self.old, self.new, self.plan, self.metrics_port
+            )
+
+    def abort(self) -> None:
+        """
+        Sends all the traffic back to the old deployment.
+        """
+
+        if self.new is not None:
+            write_weights(self.project_name, self.old or {}, {}, 0)
+
+    def finish(self) -> None:
+        """
+        Takes the old deployment out of the routing, once the new one is
+        live. Its containers keep the connections they have.
+        """
+
+        if self.new is not None:
+            write_weights(self.project_name, {}, self.new, 100)
+
+    def drain(self, timeout: float) -> None:
+        """
+        Waits until the old deployment, out of the routing since `finish()`,
+        is done with the requests it was serving (websockets and downloads
+        included), or until the timeout. Traefik counts them in the
+        `open_connections` metric of the old services, idle keep-alive
+        connections aside. Without its metrics, the requests can't be
+        counted: this says so and only waits for Traefik to apply the routing
+        change.
+
+        Parameters
+        ----------
+        timeout
+            Maximum number of seconds to wait
+        """
+
+        deadline = time.monotonic() + timeout
+
+        if self.metrics_port is None:
+            console.print(
+                "[yellow]Traefik metrics are disabled, so the requests that the "
+                "old version is still serving can't be waited for (see the "
+                "`metrics` Traefik option), it only gets the time to stop "
+                "receiving new ones"
+            )
+
+        time.sleep(min(ROUTING_DELAY, timeout))
+
+        if self.metrics_port is None:
+            return
+
+        backends = set((self.old or {}).values())
+        announced = False
+
+        while True:
+            try:
+                stats = scrape_metrics(self.metrics_port, backends)
+            except ErrorForUser as e:
+                console.print(f"[yellow]{e}, stopping the old version anyway")
+                return
+
+            if not (count := int(stats.open_connections)):
+                return
+
+            if time.monotonic() >= deadline:
+                console.print(
+                    f"{count} request(s) still open after {timeout:g}s, stopping anyway"
+                )
+                return
+
+            if not announced:
+                console.print(f"Waiting for {count} request(s) to finish")
+                announced = True
+
+            time.sleep(DRAIN_POLL_INTERVAL)
+
+    def cleanup(self) -> None:
+        """
+        Removes the weighted services of the old deployment once it is
+        stopped, if the new one isn't routed.
+        """
+
+        if self.new is None:
+            weights_file(self.project_name).unlink(missing_ok=True)
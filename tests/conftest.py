@@ -0,0 +1,103 @@
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+BENCH_DIR = Path(__file__).parent.parent / "bench"
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+
+@pytest.fixture
+def mb_env(tmp_path: Path) -> dict[str, str]:
+    """
+    Environment to run the CLI in a subprocess, with its own home and without
+    the resident agent.
+    """
+
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / "config.yml").write_text("init_done: true\n")
+
+    return {
+        **os.environ,
+        "PYTHONPATH": str(SRC_DIR),
+        "MB_HOME": str(home),
+        "MB_NO_AGENT": "1",
+        "COLUMNS": "200",
+    }
+
+
+def run_mb(
+    env: dict[str, str],
+    *args: str,
+    stdin: bytes = b"",
+) -> subprocess.CompletedProcess[str]:
+    """
+    Runs the CLI like a user would, returns its outcome with the output as
+    plain text.
+    """
+
+    process = subprocess.run(
+        [sys.executable, "-m", "master_builder", *args],
+        env=env,
+        input=stdin,
+        capture_output=True,
+        check=False,
+        timeout=60,
+    )
+
+    return subprocess.CompletedProcess(
+        process.args,
+        process.returncode,
+        ANSI_ESCAPE.sub("", process.stdout.decode()),
+        ANSI_ESCAPE.sub("", process.stderr.decode()),
+    )
+
+
+@pytest.fixture
+def mb(mb_env: dict[str, str]):
+    """Runs the CLI in the environment of `mb_env`, see `run_mb()`."""
+
+    def run(*args: str, stdin: bytes = b"") -> subprocess.CompletedProcess[str]:
+        return run_mb(mb_env, *args, stdin=stdin)
+
+    return run
+
+
+@pytest.fixture
+def docker(mb_env, tmp_path, monkeypatch):
+    """
+    Simulated Docker host (see `bench/fake_engine.py`) used by the CLI run
+    with `mb`, gives the engine. Its `profile` can be changed at any time.
+    """
+
+    monkeypatch.syspath_prepend(str(BENCH_DIR))
+    from fake_engine import FakeEngine, Profile
+
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    fake_docker = bin_dir / "docker"
+    fake_docker.write_text(
+        f"#!{sys.executable} -S\n"
+        "import sys\n"
+        f"sys.path.insert(0, {str(BENCH_DIR)!r})\n"
+        "from fake_docker import main\n"
+        "main()\n"
+    )
+    fake_docker.chmod(0o755)
+
+    engine = FakeEngine(tmp_path / "docker.sock", Profile(), tmp_path)
+    engine.start()
+
+    mb_env["PATH"] = f"{bin_dir}{os.pathsep}{mb_env['PATH']}"
+    mb_env["DOCKER_HOST"] = f"unix://{tmp_path / 'docker.sock'}"
+    mb_env["DOCKER_CONFIG"] = str(tmp_path / "docker-config")
+
+    try:
+        yield engine
+    finally:
+        engine.stop()
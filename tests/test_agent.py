@@ -0,0 +1,82 @@
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def agent(mb_env, tmp_path):
+    """
+    Runs an agent in its own directory, for the commands run with `mb`,
+    gives its PID.
+    """
+
+    del mb_env["MB_NO_AGENT"]
+    mb_env["DOCKER_HOST"] = f"unix://{tmp_path / 'no-docker.sock'}"
+    agent_dir = tmp_path / "agent"
+    agent_dir.mkdir()
+    socket_path = Path(mb_env["MB_HOME"]) / "agent.sock"
+
+    with subprocess.Popen(
+        [sys.executable, "-m", "master_builder", "serve"],
+        cwd=agent_dir,
+        env=dict(mb_env),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    ) as process:
+        deadline = time.monotonic() + 30
+
+        while not socket_path.exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        try:
+            yield process.pid
+        finally:
+            process.terminate()
+            process.wait(10)
+
+
+def traced_pids(trace_file: Path) -> set[int]:
+    trace = json.loads(trace_file.read_text())
+    return {event["pid"] for event in trace["traceEvents"]}
+
+
+def test_paths_are_relative_to_the_caller(mb, agent, tmp_path, monkeypatch):
+    caller_dir = tmp_path / "caller"
+    caller_dir.mkdir()
+    monkeypatch.chdir(caller_dir)
+
+    (caller_dir / "docker-compose.yml").write_text("services: {}\n")
+
+    mb(
+        "deploy",
+        "--file",
+        "docker-compose.yml",
+        "--trace-file=trace.json",
+        "my-project",
+    )
+
+    assert traced_pids(caller_dir / "trace.json") == {agent}
+
+
+def test_caller_with_another_environment_runs_locally(
+    mb, mb_env, agent, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(mb_env, "DOCKER_HOST", f"unix://{tmp_path / 'other.sock'}")
+
+    (tmp_path / "docker-compose.yml").write_text("services: {}\n")
+
+    result = mb(
+        "deploy",
+        "--file=docker-compose.yml",
+        "--trace-file",
+        "trace.json",
+        "my-project",
+    )
+
+    assert "other.sock" in result.stdout
+    assert agent not in traced_pids(tmp_path / "trace.json")
@@ -0,0 +1,139 @@
+import json
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+COMPOSE_FILE = b"""
+services:
+  web:
+    image: example/web:latest
+"""
+ROUTED_COMPOSE_FILE = COMPOSE_FILE + (
+    b"    labels:\n"
+    b"      - traefik.enable=true\n"
+    b"      - traefik.http.routers.web.rule=Host(`example.com`)\n"
+)
+
+
+def deployments(mb_env: dict[str, str]) -> list[str]:
+    project_dir = Path(mb_env["MB_HOME"]) / "deployments" / "my-project"
+    return sorted(p.name for p in project_dir.iterdir() if len(p.name) == 36)
+
+
+def state(mb_env: dict[str, str]) -> dict:
+    project_dir = Path(mb_env["MB_HOME"]) / "deployments" / "my-project"
+    return json.loads((project_dir / "state.json").read_text())
+
+
+def wait_for_call(docker, subcommand: list[str], timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        for call in list(docker.calls):
+            args = [a for a in call.argv if not a.startswith("-")]
+
+            if args[: len(subcommand)] == subcommand and not call.end:
+                return
+
+        time.sleep(0.05)
+
+    msg = f"docker {' '.join(subcommand)} was not called"
+    raise AssertionError(msg)
+
+
+def test_deploys_a_project(mb, mb_env, docker):
+    docker.publish("example/web:latest", "v1")
+
+    result = mb("deploy", "my-project", stdin=COMPOSE_FILE)
+
+    assert result.returncode == 0, result.stdout
+    assert state(mb_env)["current"] in deployments(mb_env)
+    assert not state(mb_env)["pending"]
+
+
+def test_interrupted_deployment_is_removed(mb, mb_env, docker):
+    docker.publish("example/web:latest", "v1")
+    assert mb("deploy", "my-project", stdin=COMPOSE_FILE).returncode == 0
+    live = deployments(mb_env)
+
+    docker.publish("example/web:latest", "v2")
+    docker.profile.latency["compose up"] = 1
+
+    with subprocess.Popen(
+        [sys.executable, "-m", "master_builder", "deploy", "my-project"],
+        env=mb_env,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    ) as process:
+        process.stdin.write(COMPOSE_FILE)
+        process.stdin.close()
+        wait_for_call(docker, ["compose", "up"])
+        process.send_signal(signal.SIGINT)
+
+        assert process.wait(30) != 0
+
+    assert deployments(mb_env) == live
+    assert state(mb_env)["current"] == live[0]
+    assert not state(mb_env)["pending"]
+
+
+def test_old_deployment_is_torn_down_when_after_commands_fail(mb, mb_env, docker):
+    docker.publish("example/web:latest", "v1")
+    assert mb("deploy", "my-project", stdin=COMPOSE_FILE).returncode == 0
+    old = deployments(mb_env)
+
+    docker.publish("example/web:latest", "v2")
+    docker.profile.latency["compose down"] = 1
+    docker.profile.failures["compose run"] = 1
+
+    result = mb("deploy", "--after", "web:false", "my-project", stdin=COMPOSE_FILE)
+    retired_dir = Path(mb_env["MB_HOME"]) / "deployments" / "my-project" / ".retired"
+    downs = [c for c in docker.calls if c.argv[-1:] == ["down"]]
+
+    assert result.returncode != 0
+    assert deployments(mb_env) == [state(mb_env)["current"]] != old
+    assert not list(retired_dir.iterdir())
+    assert [(bool(c.end), c.exit_code) for c in downs] == [(True, 0)]
+
+
+def test_compose_pulls_the_images_left_to_it(mb, docker):
+    docker.publish("example/web:latest", "v1")
+    compose_file = COMPOSE_FILE + (
+        b"  worker:\n"
+        b"    image: example/worker:${TAG:-latest}\n"
+        b"  app:\n"
+        b"    image: example/app:latest\n"
+        b"    build: .\n"
+    )
+
+    result = mb("deploy", "my-project", stdin=compose_file)
+    pulls = [c.argv for c in docker.calls if "pull" in c.argv]
+
+    assert result.returncode == 0, result.stdout
+    assert ["compose", "pull", "worker"] in pulls
+    assert ["compose", "pull", "--ignore-pull-failures", "app"] in pulls
+    assert not [argv for argv in pulls if "example/app:latest" in argv]
+
+
+def test_old_version_is_drained_by_default(mb, docker):
+    docker.publish("example/web:latest", "v1")
+    assert mb("deploy", "my-project", stdin=ROUTED_COMPOSE_FILE).returncode == 0
+
+    docker.publish("example/web:latest", "v2")
+    result = mb("deploy", "my-project", stdin=ROUTED_COMPOSE_FILE)
+
+    assert result.returncode == 0, result.stdout
+    assert "Draining old deployments" in result.stdout
+
+
+def test_compose_file_without_routers_is_kept_verbatim(mb, mb_env, docker):
+    docker.publish("example/web:latest", "v1")
+
+    assert mb("deploy", "my-project", stdin=COMPOSE_FILE).returncode == 0
+
+    project_dir = Path(mb_env["MB_HOME"]) / "deployments" / "my-project"
+    deploy_dir = project_dir / state(mb_env)["current"]
+    assert (deploy_dir / "docker-compose.yml").read_bytes() == COMPOSE_FILE
@@ -0,0 +1,123 @@
+import socketserver
+import threading
+from collections.abc import Callable
+
+import pytest
+
+from master_builder.docker_api import DockerClient
+from master_builder.errors import DockerApiError, ErrorForUser
+
+Reply = Callable[[socketserver.StreamRequestHandler, str], bool]
+
+
+def json_reply(status: int, body: str) -> Reply:
+    def reply(handler, request_line):
+        handler.wfile.write(
+            f"HTTP/1.1 {status} Whatever\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n{body}".encode()
+        )
+        return True
+
+    return reply
+
+
+def hang_up(handler, request_line):
+    return False
+
+
+def garbage(handler, request_line):
+    handler.wfile.write(b"not http at all\r\n\r\n")
+    return False
+
+
+@pytest.fixture
+def docker_socket(tmp_path):
+    """
+    Stand-in for the Docker Engine on a unix socket. Requests get the
+    replies of the list in turn, each telling whether to keep the connection
+    open. Gives the list, the socket path and the request lines received.
+    """
+
+    replies: list[Reply] = []
+    received: list[str] = []
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            while request_line := self.rfile.readline().decode().strip():
+                length = 0
+
+                while header := self.rfile.readline().strip():
+                    name, _, value = header.decode().partition(":")
+
+                    if name.lower() == "content-length":
+                        length = int(value)
+
+                self.rfile.read(length)
+                received.append(request_line)
+
+                if not replies.pop(0)(self, request_line):
+                    return
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    path = tmp_path / "docker.sock"
+    server = Server(str(path), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        yield replies, str(path), received
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_decodes_the_response(docker_socket):
+    replies, path, received = docker_socket
+    replies.append(json_reply(200, '{"Version": "27.0"}'))
+
+    assert DockerClient(path).request("GET", "/version") == {"Version": "27.0"}
+    assert received == ["GET /version HTTP/1.1"]
+
+
+def test_error_responses_raise_docker_api_errors(docker_socket):
+    replies, path, _ = docker_socket
+    replies.append(json_reply(404, '{"message": "No such container: web"}'))
+
+    with pytest.raises(DockerApiError) as error:
+        DockerClient(path).request("GET", "/containers/web/json")
+
+    assert error.value.status == 404
+    assert error.value.message == "No such container: web"
+
+
+def test_get_is_retried_once_when_the_connection_closes(docker_socket):
+    replies, path, received = docker_socket
+    replies.extend([hang_up, json_reply(200, "[]")])
+
+    assert DockerClient(path).request("GET", "/containers/json") == []
+    assert len(received) == 2
+
+
+def test_post_is_not_retried_when_the_connection_closes(docker_socket):
+    replies, path, received = docker_socket
+    replies.extend([hang_up, json_reply(204, "")])
+
+    with pytest.raises(ErrorForUser, match="may or may not have been applied"):
+        DockerClient(path).request("POST", "/containers/web/stop")
+
+    assert len(received) == 1
+
+
+def test_invalid_responses_raise_errors_for_user(docker_socket):
+    replies, path, _ = docker_socket
+    replies.append(garbage)
+
+    with pytest.raises(ErrorForUser, match="Invalid response from Docker"):
+        DockerClient(path).request("POST", "/containers/create", body={})
+
+
+def test_missing_socket_raises_an_error_for_user(tmp_path):
+    with pytest.raises(ErrorForUser, match="Could not reach Docker"):
+        DockerClient(str(tmp_path / "nothing.sock")).request("GET", "/version")
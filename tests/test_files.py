@@ -0,0 +1,26 @@
+import pytest
+
+from master_builder import files
+from master_builder.files import atomic_write_text
+
+
+def test_keeps_the_mode_of_the_file(tmp_path):
+    path = tmp_path / "config.yml"
+    path.write_text("old")
+    path.chmod(0o640)
+
+    atomic_write_text(path, "new")
+
+    assert path.read_text() == "new"
+    assert path.stat().st_mode & 0o7777 == 0o640
+
+
+@pytest.mark.parametrize("umask", [0o022, 0o077])
+def test_new_files_follow_the_umask(tmp_path, monkeypatch, umask):
+    monkeypatch.setattr(files, "UMASK", umask)
+    path = tmp_path / "state" / "state.json"
+
+    atomic_write_text(path, "{}")
+
+    assert path.stat().st_mode & 0o7777 == 0o666 & ~umask
+    assert [p.name for p in path.parent.iterdir()] == ["state.json"]
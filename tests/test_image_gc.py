@@ -0,0 +1,27 @@
+from master_builder.image_gc import eviction_candidates
+
+
+def image(id_: str, created: int = 0, containers: int = 0) -> dict:
+    return {"Id": id_, "Created": created, "Containers": containers}
+
+
+def test_only_deployed_images_are_evicted():
+    images = [image("deployed"), image("built-by-hand"), image("pulled-by-hand")]
+
+    candidates = eviction_candidates(images, set(), {"deployed": 100})
+
+    assert [i["Id"] for i in candidates] == ["deployed"]
+
+
+def test_least_recently_deployed_images_go_first():
+    images = [
+        image("recent", created=10),
+        image("old", created=300),
+        image("protected"),
+        image("running", containers=1),
+    ]
+    last_used = {"recent": 200, "old": 100, "protected": 50, "running": 50}
+
+    candidates = eviction_candidates(images, {"protected"}, last_used)
+
+    assert [i["Id"] for i in candidates] == ["old", "recent"]
@@ -0,0 +1,19 @@
+from master_builder.images import compose_images, compose_left_to_pull
+
+DOCUMENT = {
+    "services": {
+        "web": {"image": "example/web:1.0"},
+        "worker": {"image": "example/worker:${TAG:-latest}"},
+        "app": {"image": "example/app:1.0", "build": "."},
+        "local": {"build": "."},
+        "offline": {"image": "example/offline:1.0", "pull_policy": "never"},
+    }
+}
+
+
+def test_only_plain_images_are_pulled_beforehand():
+    assert compose_images(DOCUMENT) == ["example/web:1.0"]
+
+
+def test_compose_pulls_interpolated_and_buildable_images():
+    assert compose_left_to_pull(DOCUMENT) == {"worker": False, "app": True}
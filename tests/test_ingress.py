@@ -0,0 +1,14 @@
+from pathlib import Path
+
+
+def test_start_removes_the_dynamic_file_of_older_versions(mb, mb_env, docker):
+    ingress_dir = Path(mb_env["MB_HOME"]) / "ingress"
+    ingress_dir.mkdir()
+    (ingress_dir / "dynamic.yaml").write_text("tls: {}\n")
+
+    result = mb("ingress", "start")
+
+    assert result.returncode == 0, result.stdout
+    assert not (ingress_dir / "dynamic.yaml").exists()
+    assert (ingress_dir / "dynamic").is_dir()
+    assert "/etc/traefik/dynamic:ro" in (ingress_dir / "docker-compose.yml").read_text()
@@ -0,0 +1,157 @@
+import json
+import shlex
+import sys
+from pathlib import Path
+
+import pytest
+
+COMPOSE_FILE = b"services:\n  web:\n    image: nginx\n"
+
+# Stands in for ssh: runs the remote command locally, telling it the host
+STAND_IN_SSH = """
+import os, subprocess, sys
+
+args = sys.argv[1:]
+while args[0].startswith("-"):
+    if args[0] == "-N":
+        sys.exit(0)
+    args = args[2:] if args[0] == "-o" else args[1:]
+
+host, command = args[0], " ".join(args[1:])
+env = {**os.environ, "STAND_IN_HOST": host}
+sys.exit(subprocess.run(["sh", "-c", command], env=env).returncode)
+"""
+
+# Stands in for master-builder on the hosts: reads the compose file the way
+# deploy does, records what it got and fails on hosts named "bad..."
+STAND_IN_REMOTE = """
+import json, os, sys
+from pathlib import Path
+
+from master_builder.deploy import _read_compose_file
+
+host = os.environ["STAND_IN_HOST"]
+compose, _ = _read_compose_file(None)
+record = {"args": sys.argv[1:], "compose": compose}
+Path(sys.argv[0]).with_name(f"{host}.json").write_text(json.dumps(record))
+print(f"deployed on {host}")
+sys.exit(1 if host.startswith("bad") else 0)
+"""
+
+
+@pytest.fixture
+def stand_ins(tmp_path: Path) -> list[str]:
+    """The options of multi-deploy to go through the stand-ins"""
+
+    ssh = tmp_path / "ssh.py"
+    ssh.write_text(STAND_IN_SSH)
+    remote = tmp_path / "remote.py"
+    remote.write_text(STAND_IN_REMOTE)
+
+    return [
+        "--ssh",
+        shlex.join([sys.executable, str(ssh)]),
+        "--remote-command",
+        shlex.join([sys.executable, str(remote)]),
+    ]
+
+
+def received(tmp_path: Path, host: str) -> dict | None:
+    try:
+        return json.loads((tmp_path / f"{host}.json").read_text())
+    except FileNotFoundError:
+        return None
+
+
+def test_deploys_to_every_host(mb, stand_ins, tmp_path):
+    hosts = ["deployer@vm1", "deployer@vm2", "other@vm1"]
+    result = mb(
+        "multi-deploy",
+        *stand_ins,
+        *[arg for host in hosts for arg in ("--host", host)],
+        "my-project",
+        "--before",
+        "web:./manage.py migrate",
+        stdin=COMPOSE_FILE,
+    )
+
+    assert result.returncode == 0, result.stdout
+
+    for host in hosts:
+        assert received(tmp_path, host) == {
+            "args": ["deploy", "--before", "web:./manage.py migrate", "my-project"],
+            "compose": COMPOSE_FILE.decode(),
+        }
+        assert f"{host:<12} | deployed on {host}" in result.stdout
+
+
+def test_sends_the_compose_file_as_is_by_default(mb, stand_ins, tmp_path):
+    payload = tmp_path / "payload"
+    spy = [
+        "--remote-command",
+        f"sh -c 'cat > {shlex.quote(str(payload))}' --",
+    ]
+
+    result = mb(
+        "multi-deploy",
+        *stand_ins,
+        *spy,
+        "--host",
+        "vm1",
+        "my-project",
+        stdin=COMPOSE_FILE,
+    )
+
+    assert result.returncode == 0, result.stdout
+    assert payload.read_bytes() == COMPOSE_FILE
+
+
+def test_compressed_compose_file_is_understood(mb, stand_ins, tmp_path):
+    result = mb(
+        "multi-deploy",
+        *stand_ins,
+        "--compress",
+        "--host",
+        "vm1",
+        "my-project",
+        stdin=COMPOSE_FILE,
+    )
+
+    assert result.returncode == 0, result.stdout
+    assert received(tmp_path, "vm1")["compose"] == COMPOSE_FILE.decode()
+
+
+def test_reports_the_hosts_which_failed(mb, stand_ins, tmp_path):
+    result = mb(
+        "multi-deploy",
+        *stand_ins,
+        "--host",
+        "bad-vm",
+        "--host",
+        "vm2",
+        "my-project",
+        stdin=COMPOSE_FILE,
+    )
+
+    assert result.returncode == 1
+    assert "failed on: bad-vm" in result.stdout
+    assert received(tmp_path, "vm2")
+
+
+def test_failed_canary_stops_the_deployment(mb, stand_ins, tmp_path):
+    result = mb(
+        "multi-deploy",
+        *stand_ins,
+        "--canary",
+        "--host",
+        "bad-vm",
+        "--host",
+        "vm2",
+        "my-project",
+        stdin=COMPOSE_FILE,
+    )
+
+    assert result.returncode == 1
+    assert "canary host bad-vm" in result.stdout
+    assert received(tmp_path, "bad-vm")
+    assert not received(tmp_path, "vm2")
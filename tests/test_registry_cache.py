@@ -0,0 +1,77 @@
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from master_builder import registry_cache
+from master_builder.errors import ErrorForUser
+from master_builder.registry_cache import wait_until_serving
+
+# Paths requested from the stand-in registry
+REQUESTS: list[str] = []
+
+
+class StandInRegistry(BaseHTTPRequestHandler):
+    """Answers like registry:2 does on its API root, when unauthenticated"""
+
+    def do_GET(self):
+        REQUESTS.append(self.path)
+        self.send_response(401 if self.path == "/v2/" else 404)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(registry_cache, "REGISTRY_CACHE_POLL_INTERVAL", 0.01)
+    REQUESTS.clear()
+
+
+@pytest.fixture
+def late_registry():
+    """
+    Stand-in registry which only starts listening a little while after the
+    test started, like registry:2 after `compose up -d`. Gives its port.
+    """
+
+    port = free_port()
+    servers = []
+
+    def listen_later():
+        time.sleep(0.5)
+        server = ThreadingHTTPServer(("127.0.0.1", port), StandInRegistry)
+        servers.append(server)
+        server.serve_forever()
+
+    threading.Thread(target=listen_later, daemon=True).start()
+
+    try:
+        yield port
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+def test_waits_for_the_registry_to_listen(late_registry):
+    start = time.monotonic()
+
+    wait_until_serving(late_registry, 10)
+
+    assert time.monotonic() - start >= 0.5
+    assert REQUESTS == ["/v2/"]
+
+
+def test_gives_up_when_the_registry_never_answers():
+    with pytest.raises(ErrorForUser, match="didn't answer"):
+        wait_until_serving(free_port(), 0.2)
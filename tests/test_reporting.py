@@ -0,0 +1,48 @@
+import json
+import sys
+
+import pytest
+
+from master_builder.errors import CommandFailed
+from master_builder.reporting import command_log, run_command
+from master_builder.tracing import tracing
+
+BUSY = "import sys; sum(range(3_000_000)); sys.exit(int(sys.argv[1]))"
+
+
+def command_spans(trace_file):
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    return [e for e in events if e.get("cat") == "command"]
+
+
+def test_commands_are_traced_with_their_resource_usage(tmp_path):
+    trace_file = tmp_path / "trace.json"
+
+    with tracing(trace_file):
+        result = run_command([sys.executable, "-c", BUSY, "3"], check=False)
+
+    assert result.returncode == 3
+    (traced,) = command_spans(trace_file)
+    assert traced["args"]["exit_code"] == 3
+    assert traced["args"]["cpu_user_s"] + traced["args"]["cpu_system_s"] > 0
+    assert traced["args"]["max_rss_kib"] > 0
+
+
+def test_failed_command_points_at_its_log(tmp_path):
+    log_file = tmp_path / "deploy.log"
+
+    with command_log(log_file), pytest.raises(CommandFailed) as failure:
+        run_command([sys.executable, "-c", "print('oops'); exit(2)"], quiet=True)
+
+    assert f"Full output in {log_file}" in str(failure.value)
+    assert "oops" in log_file.read_text()
+
+
+def test_discarded_log_leaves_no_file(tmp_path):
+    log_file = tmp_path / "deploy.log"
+
+    with command_log(log_file) as log:
+        run_command([sys.executable, "-c", "print('hello')"], quiet=True)
+        log.discard()
+
+    assert not log_file.exists()
@@ -0,0 +1,35 @@
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).parent.parent
+
+
+@pytest.fixture
+def startup(monkeypatch):
+    """The startup budget script (see `bench/startup.py`)"""
+
+    monkeypatch.syspath_prepend(str(ROOT_DIR / "bench"))
+    monkeypatch.setenv("PYTHONPATH", str(ROOT_DIR / "src"))
+    import startup
+
+    return startup
+
+
+def test_commands_only_import_what_they_need(startup):
+    for scenario in startup.SCENARIOS:
+        loaded = startup.loaded_modules(scenario.modules)
+
+        assert not set(scenario.forbidden) & loaded, scenario.name
+
+
+def test_commands_start_within_their_budget(startup):
+    for scenario in startup.SCENARIOS:
+        budget = scenario.budget_ms * startup.SCALE
+        times = []
+
+        # A busy machine slows down every run of an attempt, hence a few
+        while len(times) < 3 and min(times, default=budget + 1) > budget:
+            times.append(startup.import_time_ms(scenario.modules))
+
+        assert min(times) <= budget, f"{scenario.name}: {min(times):.1f} ms"
@@ -0,0 +1,74 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from master_builder import traffic
+from master_builder.traffic import Cutover
+
+OLD = {"my-project-web": "web-old@docker"}
+NEW = {"my-project-web": "web-new@docker"}
+METRICS = """# TYPE traefik_service_open_connections gauge
+traefik_service_open_connections{{protocol="http",service="web-old@docker"}} {old}
+traefik_service_open_connections{{protocol="http",service="web-new@docker"}} 7
+"""
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    """
+    Stand-in for the metrics of Traefik, serving successive values of the
+    open connections of the old and new services. Gives the list of values
+    still to serve (the last one stays) and the port.
+    """
+
+    monkeypatch.setattr(traffic, "ROUTING_DELAY", 0)
+    monkeypatch.setattr(traffic, "DRAIN_POLL_INTERVAL", 0.01)
+    values = [0]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            value = values.pop(0) if len(values) > 1 else values[0]
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(METRICS.format(old=value).encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        yield values, server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_drain_waits_for_the_open_requests_of_the_old_version(metrics):
+    values, port = metrics
+    values[:] = [2, 1, 0]
+
+    Cutover("my-project", OLD, metrics_port=port, new=NEW).drain(10)
+
+    assert values == [0]
+
+
+def test_drain_gives_up_after_the_timeout(metrics):
+    values, port = metrics
+    values[:] = [1]
+    start = time.monotonic()
+
+    Cutover("my-project", OLD, metrics_port=port, new=NEW).drain(0.2)
+
+    assert time.monotonic() - start < 2
+
+
+def test_drain_without_metrics_only_waits_for_the_routing(monkeypatch, capsys):
+    monkeypatch.setattr(traffic, "ROUTING_DELAY", 0)
+
+    Cutover("my-project", OLD, new=NEW).drain(10)
+
+    assert "can't be waited for" in capsys.readouterr().out